@@ -8,18 +8,94 @@ from http.server import HTTPServer, BaseHTTPRequestHandler
 import json
 import urllib.request
 import urllib.parse
+import http.client
 import sqlite3
 import os
+import sys
 import subprocess
 import re
-from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 import threading
+import queue
+import functools
+import contextvars
+import contextlib
+import math
+import socket
+import signal
+import time
+import uuid
+import hashlib
+import base64
+import struct
+import zlib
+import tempfile
+import random
+import atexit
+import logging
+import logging.handlers
+import hmac
+import cProfile
+import pstats
+import tracemalloc
+import inspect
+import itertools
+import unicodedata
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows: JSON store locking stays per-process there
+    fcntl = None
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows: peak RSS is reported as 0 there
+    resource = None
 
 EMBEDDINGS_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'embeddings.db')
 # Use local Ollama instance for embeddings
 OLLAMA_API_URL = "http://localhost:11434"
 
+# Keep-alive connections to Ollama, shared by all threads of a process
+OLLAMA_CONFIG = {
+    'max_connections': 8,         # Requests in flight at once; more wait for a free connection
+    'connect_timeout': 5,
+    'read_timeout': 60,           # Waiting for a response (capped by the call's deadline)
+    'pool_wait': 30               # How long a request may wait for a free connection
+}
+
+# Embedding generation (provider: ollama, sentence_transformers or hashing)
+EMBEDDING_CONFIG = {
+    'provider': 'ollama',
+    'model': None,                # None: the provider's default model
+    'batch_size': 32,             # Texts per request (per encode call for in-process models)
+    'max_batch_tokens': 8192,     # Estimated tokens per request; a longer text is sent on its own
+    'chars_per_token': 3,         # Conservative for Russian text (English is closer to 4)
+    'split_statuses': (400, 413, 422)  # Rejected input: bisect to find the bad texts (others fail the batch)
+}
+
+# Server-wide concurrency of embedding requests, adapted to observed latency and errors (AIMD)
+EMBEDDING_SCHEDULER_CONFIG = {
+    'initial_limit': 4,
+    'min_limit': 1,
+    'max_limit': 8,               # Hard ceiling; keep it at most OLLAMA_CONFIG['max_connections']
+    'latency_tolerance': 2.0,     # Slower than this many times the best time per text counts as overload
+    'backoff': 0.5,               # Multiplicative decrease on overload or errors
+    'decrease_interval': 1.0      # Seconds between two decreases (one overload episode, one cut)
+}
+
+# Embeddings already computed, keyed by model and normalized text
+EMBEDDING_CACHE_CONFIG = {
+    'memory_bytes': 64 * 1024 * 1024,   # In-process LRU tier (float32 vectors)
+    'sqlite': True,                     # Persistent tier in the embeddings database
+    'sqlite_max_rows': 200000,          # Least recently used rows beyond this are deleted
+    'prune_every': 1000                 # Check the row limit after this many inserts
+}
+
 # Semantic search configuration
 SEMANTIC_SEARCH_CONFIG = {
     'default_threshold': 0.6,  # Default similarity threshold (60%) - Matches app default
@@ -38,11 +114,1327 @@ GIT_DEFAULT_REPO_PATH = "/Users/falin/AndroidStudioProjects/AI-with-Love"
 # CRM data storage
 CRM_USERS = []
 CRM_TICKETS = []
+CRM_FILES_STATE = None  # (inode, mtime, size) of the CRM files when last loaded
 CRM_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
 
 WEBPAGES_DIR = '/var/www/html/webpages'
 WEBPAGE_BASE_URL = 'http://148.253.209.151/webpages'
 
+# HTTP server configuration
+SERVER_CONFIG = {
+    'mode': 'threaded',   # 'threaded' (bounded worker pool), 'prefork' (worker processes) or 'single'
+    'workers': 8,         # Worker threads serving requests concurrently (per process)
+    'queue_size': 32,     # Accepted connections allowed to wait for a free worker (per process)
+    'processes': None     # Pre-fork worker processes (default: CPU count)
+}
+
+# HTTP connection configuration
+HTTP_CONFIG = {
+    'idle_timeout': 15,                   # Seconds a keep-alive connection may stay idle
+    'max_requests_per_connection': 100,   # Close the connection after this many requests
+    'max_body_bytes': 64 * 1024 * 1024,   # Largest accepted request body (base64 PDFs)
+    'max_decompressed_bytes': 64 * 1024 * 1024,  # Largest request body after gzip/deflate decoding
+    'compress_min_bytes': 1024,           # Smaller responses are not worth compressing
+    'compress_level': 6,                  # zlib level for gzip/deflate responses
+    'max_upload_bytes': 1024 * 1024 * 1024,  # Largest document accepted by POST /upload
+    'upload_block_bytes': 64 * 1024       # Uploads are streamed to disk in blocks of this size
+}
+
+# Logging: records go through a bounded queue to a background writer thread
+LOG_CONFIG = {
+    'level': 'INFO',
+    'format': 'json',             # 'json' (one object per line) or 'text' ([timestamp] message)
+    'queue_size': 10000,          # Records waiting for the writer; further records are dropped, never waited for
+    'file': None,                 # Also write to this file, rotated by size
+    'max_bytes': 10 * 1024 * 1024,
+    'backup_count': 5,
+    'sample_rates': {}            # Tool name -> fraction of its calls whose INFO/DEBUG lines are written
+}
+
+# GET /metrics (Prometheus text format)
+METRICS_CONFIG = {
+    'path': '/metrics',
+    'snapshot_dir': None,         # Pre-fork workers publish their metrics here (default: data/metrics)
+    'snapshot_interval': 2        # Seconds between snapshots of a pre-fork worker (staleness of a scrape)
+}
+
+# Per-call tracing (tools/call _meta.trace or the X-MCP-Trace header)
+TRACE_CONFIG = {
+    'export_file': None,          # Also append finished traces here as OTLP/JSON lines (OpenTelemetry file format)
+    'service_name': 'mcp-server'
+}
+
+# Admin features (admin tools, call profiling) need X-MCP-Admin-Token; disabled while no token is set
+ADMIN_CONFIG = {
+    'token': None
+}
+
+# Profiling of single tool calls (tools/call _meta.profile, admin only)
+PROFILE_CONFIG = {
+    'dir': None,                  # Where .prof files are written (default: data/profiles)
+    'keep': 50,                   # Older profiles are deleted
+    'top': 20,                    # Rows of the summary returned with the result
+    'sort_keys': ('cumulative', 'tottime', 'calls')
+}
+
+# Memory diagnostics (memory_trace admin tool)
+MEMORY_CONFIG = {
+    'max_snapshots': 5,           # tracemalloc snapshots kept for diffs
+    'default_frames': 25          # Traceback depth; deep enough to reach the tool method from most allocations
+}
+
+# tools/call recorder: one compact JSON line per call, replayable with replay_trace.py
+RECORDER_CONFIG = {
+    'file': None,                 # Recording is off until a file is set (MCP_RECORD_FILE)
+    'blob_chars': 256,            # Longer strings (and lists longer than blob_items) are replaced by a hash
+    'blob_items': 64,
+    'queue_size': 10000,          # Records waiting for the writer; further records are dropped
+    'flush_interval': 1.0,        # Seconds the writer waits to gather a batch
+    'batch_size': 500
+}
+
+# POST /upload: raw document bodies streamed to a temporary file, then ingested
+UPLOAD_CONFIG = {
+    'path': '/upload',
+    'dir': None,                          # Temporary files directory (default: system temp dir)
+    'content_types': {                    # Content-Type -> ingestion tool
+        'application/pdf': 'process_pdf',
+        'text/plain': 'process_text_chunks',
+        'text/markdown': 'process_text_chunks'
+    }
+}
+
+class HTTPRequestError(Exception):
+    """Request that must be answered with a specific HTTP status"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def choose_content_encoding(accept_encoding):
+    """Pick gzip or deflate for a response from an Accept-Encoding header (None: identity)"""
+    accepted = {}
+    for item in (accept_encoding or '').split(','):
+        name, _, params = item.strip().partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name.strip().lower()] = quality
+
+    for encoding in ('gzip', 'deflate'):
+        quality = accepted.get(encoding, accepted.get('*', 0.0))
+        if quality > 0:
+            return encoding
+    return None
+
+def compress_body(body, encoding):
+    """Compress a response body with gzip or deflate (zlib format)"""
+    wbits = 16 + zlib.MAX_WBITS if encoding == 'gzip' else zlib.MAX_WBITS
+    compressor = zlib.compressobj(HTTP_CONFIG['compress_level'], zlib.DEFLATED, wbits)
+    return compressor.compress(body) + compressor.flush()
+
+def _content_encoding_wbits(encoding, data):
+    """zlib window bits for a Content-Encoding, given the first bytes of the data"""
+    if encoding in ('gzip', 'x-gzip'):
+        return 16 + zlib.MAX_WBITS
+    # deflate: zlib-wrapped as the RFC says, or raw deflate as some clients send
+    zlib_header = len(data) >= 2 and (data[0] & 0x0F) == 8 and ((data[0] << 8) | data[1]) % 31 == 0
+    return zlib.MAX_WBITS if zlib_header else -zlib.MAX_WBITS
+
+def iter_decompressed(blocks, encoding, limit, block_size=None):
+    """Inflate gzip/deflate data block by block, refusing to produce more than limit bytes
+
+    block_size caps each yielded block, so a highly compressed input is never
+    inflated into memory at once.
+    """
+    if encoding not in ('gzip', 'x-gzip', 'deflate'):
+        raise HTTPRequestError(415, f'Unsupported Content-Encoding: {encoding}')
+
+    decompressor = None
+    total = 0
+    try:
+        for data in blocks:
+            while data:
+                if decompressor is None:
+                    decompressor = zlib.decompressobj(_content_encoding_wbits(encoding, data))
+                max_length = limit + 1 - total
+                if block_size:
+                    max_length = min(max_length, block_size)
+                chunk = decompressor.decompress(data, max_length)
+                total += len(chunk)
+                if total > limit:
+                    raise HTTPRequestError(413, f'Decompressed request body exceeds {limit} bytes')
+                if chunk:
+                    yield chunk
+                data = decompressor.unconsumed_tail
+                if decompressor.eof:
+                    # Concatenated gzip members follow each other
+                    data = decompressor.unused_data + data
+                    decompressor = None
+        if decompressor is not None:
+            raise HTTPRequestError(400, f'Truncated {encoding} request body')
+    except zlib.error as e:
+        raise HTTPRequestError(400, f'Invalid {encoding} request body: {e}')
+
+def decompress_body(body, encoding, limit):
+    """Decode a gzip/deflate request body, refusing to inflate beyond limit bytes"""
+    return b''.join(iter_decompressed([body], encoding, limit))
+
+# JSON-RPC batch configuration
+BATCH_CONFIG = {
+    'workers': 8,      # Server-wide pool executing calls from batch requests
+    'max_size': 32     # Maximum number of calls in one batch
+}
+
+# Background job configuration
+JOB_CONFIG = {
+    'workers': 2,                   # Jobs executed concurrently (per process)
+    'async_tools': ['process_pdf', 'process_text_chunks'],  # Tools accepting 'async': true
+    'progress_interval': 0.5,       # Minimum seconds between progress writes to the jobs table
+    'retention_days': 7             # Finished jobs older than this are purged on startup
+}
+
+# Tool result encoding
+RESULT_CONFIG = {
+    # 'both': structuredContent plus a compact JSON text block (for clients reading content[0].text)
+    # 'structured': structuredContent only, so the result is serialized exactly once
+    # 'text': compact JSON text block only
+    'default_format': 'both',
+    'formats': ('both', 'structured', 'text')
+}
+
+# Tool call deadlines (defaults come from each tool's registered timeout)
+DEADLINE_CONFIG = {
+    'max_seconds': 600,          # Upper bound for _meta.deadlineMs
+    'poll_interval': 0.1         # Seconds between cancellation checks while waiting on subprocesses
+}
+
+# Admission control: concurrent calls per tool concurrency class (per process)
+CONCURRENCY_CONFIG = {
+    'limits': {                  # Classes not listed here are unlimited
+        'embedding': 4,
+        'ingestion': 2,
+        'github': 4,
+        'git': 4
+    },
+    'wait_seconds': 5            # How long a call may wait for a free slot before it is rejected
+}
+
+_batch_executor = None
+_batch_executor_lock = threading.Lock()
+
+def get_batch_executor():
+    """Return the shared pool for batch calls (created lazily, after any fork)"""
+    global _batch_executor
+    with _batch_executor_lock:
+        if _batch_executor is None:
+            _batch_executor = ThreadPoolExecutor(
+                max_workers=BATCH_CONFIG['workers'],
+                thread_name_prefix='mcp-batch'
+            )
+        return _batch_executor
+
+class RequestAborted(Exception):
+    """Tool call stopped before completion; code is the JSON-RPC error code to report"""
+
+    code = -32000
+
+    def __init__(self, message, data=None):
+        super().__init__(message)
+        self.data = data
+
+class RequestCancelled(RequestAborted):
+    """Client cancelled the call (notifications/cancelled) or went away"""
+
+    code = -32800
+
+class DeadlineExceeded(RequestAborted):
+    """Call ran past its deadline"""
+
+    code = -32001
+
+class ServerBusy(RequestAborted):
+    """No free slot in the tool's concurrency class"""
+
+    code = -32003
+
+class RequestContext:
+    """
+    Per-call state shared between the transport and the tool being executed
+
+    Tools report progress through report_progress(); when the client asked
+    for it (a progressToken in _meta) and the transport streams, each report
+    is sent as a notifications/progress message. Blocking work bounds its
+    waits with call_timeout() so cancellation and the deadline (a
+    time.monotonic() value) stop it quickly.
+    """
+
+    def __init__(self, request_id=None, progress_token=None, notify=None, deadline=None):
+        self.request_id = request_id
+        self.progress_token = progress_token
+        self.notify = notify
+        self.deadline = deadline
+        self.progress_base = 0
+        self.last_progress = 0
+        self.cancel_event = threading.Event()
+
+    def report_progress(self, progress, total=None, message=None):
+        """Send a progress notification for this call (values only ever grow)"""
+        if self.progress_token is None or self.notify is None:
+            return
+
+        progress = self.progress_base + progress
+        if progress < self.last_progress:
+            return
+        self.last_progress = progress
+
+        params = {'progressToken': self.progress_token, 'progress': progress}
+        if total is not None:
+            params['total'] = self.progress_base + total
+        if message:
+            params['message'] = message
+
+        self.notify({
+            'jsonrpc': '2.0',
+            'method': 'notifications/progress',
+            'params': params
+        })
+
+    def next_progress_phase(self):
+        """Start a new phase whose progress continues from the last reported value"""
+        self.progress_base = self.last_progress
+
+    def cancel(self):
+        """Ask the tool to stop at its next cancellation check"""
+        self.cancel_event.set()
+
+    def remaining(self):
+        """Seconds left until the deadline (None without a deadline)"""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def abort_error(self):
+        """Return the exception describing why the call must stop, or None"""
+        if self.cancel_event.is_set():
+            return RequestCancelled('Request cancelled')
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            return DeadlineExceeded('Deadline exceeded')
+        return None
+
+    def is_cancelled(self):
+        """Check whether the call should stop early (cancelled or past its deadline)"""
+        return self.abort_error() is not None
+
+class ToolCall:
+    """
+    Bookkeeping of one tool call for MCPServerHandler.tool_call()
+
+    The caller sets status ('ok', 'failed' or 'aborted'; a call that never
+    sets it counts as 'error'), result_bytes and profiler while it runs.
+    """
+
+    def __init__(self, tool_label, context, trace=None):
+        self.tool_label = tool_label
+        self.context = context
+        self.trace = trace
+        self.status = 'error'
+        self.result_bytes = None
+        self.profiler = None
+
+# Call being served in this thread, and the event stream of the HTTP request (if streaming)
+_request_context = contextvars.ContextVar('mcp_request_context', default=None)
+_event_stream = contextvars.ContextVar('mcp_event_stream', default=None)
+
+def current_request_context():
+    """Return the RequestContext of the tool call being served, if any"""
+    return _request_context.get()
+
+def report_progress(progress, total=None, message=None):
+    """Report progress of the current tool call to a streaming client"""
+    context = _request_context.get()
+    if context is not None:
+        context.report_progress(progress, total, message)
+
+def next_progress_phase():
+    """Continue progress of the current tool call in a new phase"""
+    context = _request_context.get()
+    if context is not None:
+        context.next_progress_phase()
+
+def is_cancelled():
+    """Check whether the current tool call was cancelled or ran out of time"""
+    context = _request_context.get()
+    return context is not None and context.is_cancelled()
+
+def check_cancelled():
+    """Raise RequestCancelled or DeadlineExceeded if the current tool call must stop"""
+    context = _request_context.get()
+    if context is not None:
+        error = context.abort_error()
+        if error is not None:
+            raise error
+
+def call_timeout(default):
+    """Timeout for a blocking operation: the default, capped by the call's remaining time"""
+    context = _request_context.get()
+    if context is None:
+        return default
+    error = context.abort_error()
+    if error is not None:
+        raise error
+    remaining = context.remaining()
+    if remaining is None:
+        return default
+    return remaining if default is None else min(default, remaining)
+
+def run_subprocess(cmd, cwd=None, timeout=30):
+    """
+    Run a command like subprocess.run(capture_output=True, text=True)
+
+    The process is killed as soon as the current tool call is cancelled
+    (raising RequestCancelled) or its timeout, capped by the call deadline,
+    expires (raising subprocess.TimeoutExpired).
+    """
+    context = _request_context.get()
+    limit = time.monotonic() + call_timeout(timeout)
+    process = subprocess.Popen(cmd, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    while True:
+        try:
+            stdout, stderr = process.communicate(timeout=DEADLINE_CONFIG['poll_interval'])
+            return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+        except subprocess.TimeoutExpired:
+            error = context.abort_error() if context is not None else None
+            if error is None and time.monotonic() < limit:
+                continue
+            process.kill()
+            process.communicate()
+            if isinstance(error, RequestCancelled):
+                raise error
+            raise subprocess.TimeoutExpired(cmd, timeout)
+
+# Tool calls being served by this process, for notifications/cancelled: (client scope, request id) -> [contexts]
+ACTIVE_CALLS = {}
+ACTIVE_CALLS_LOCK = threading.Lock()
+
+class JsonStoreLock:
+    """
+    Lock guarding read-modify-write cycles on the JSON stores
+
+    Re-entrant within a thread. Where fcntl is available the outermost
+    acquisition also takes an exclusive flock on a lock file in the data
+    directory, so pre-fork worker processes never interleave updates.
+    """
+
+    def __init__(self):
+        self._thread_lock = threading.RLock()
+        self._local = threading.local()
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        depth = getattr(self._local, 'depth', 0)
+        if depth == 0 and fcntl is not None:
+            try:
+                os.makedirs(CRM_DATA_DIR, exist_ok=True)
+                handle = open(os.path.join(CRM_DATA_DIR, '.json_store.lock'), 'a')
+                fcntl.flock(handle, fcntl.LOCK_EX)
+            except Exception:
+                self._thread_lock.release()
+                raise
+            self._local.handle = handle
+        self._local.depth = depth + 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._local.depth -= 1
+        if self._local.depth == 0 and fcntl is not None:
+            handle = self._local.handle
+            self._local.handle = None
+            fcntl.flock(handle, fcntl.LOCK_UN)
+            handle.close()
+        self._thread_lock.release()
+        return False
+
+# Guards read-modify-write cycles on the JSON stores (CRM, tasks, team members)
+DATA_LOCK = JsonStoreLock()
+
+def with_data_lock(func):
+    """Run a tool method while holding the JSON store lock"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with DATA_LOCK:
+            return func(*args, **kwargs)
+    return wrapper
+
+def encode_json(payload):
+    """Serialize a response compactly: no indentation, no spaces, UTF-8 instead of \\u escapes"""
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def log_preview(value, limit=100):
+    """Short description of a value for log lines, without serializing all of it"""
+    if isinstance(value, dict):
+        parts = []
+        length = 0
+        for key, item in value.items():
+            if isinstance(item, (dict, list)):
+                part = f'{key}=<{type(item).__name__} of {len(item)}>'
+            elif isinstance(item, str) and len(item) > 40:
+                part = f'{key}=<str of {len(item)} chars>'
+            else:
+                part = f'{key}={item!r}'
+            parts.append(part)
+            length += len(part) + 2
+            if length > limit:
+                break
+        text = '{' + ', '.join(parts) + '}'
+    elif isinstance(value, (list, tuple)):
+        text = f'<{type(value).__name__} of {len(value)}>'
+    else:
+        text = repr(value[:limit + 1] if isinstance(value, str) else value)
+    return text if len(text) <= limit else text[:limit] + '...'
+
+logger = logging.getLogger('mcp_server')
+access_logger = logging.getLogger('mcp_server.access')
+
+# Tool call being served by this thread: tool name, request id and its sampling decision
+_log_fields = contextvars.ContextVar('mcp_log_fields', default=None)
+
+# Message prefixes that set the level when none is given
+LOG_LEVEL_MARKERS = (('❌', logging.ERROR), ('⚠️', logging.WARNING), ('🛑', logging.WARNING))
+
+class LazyPreview:
+    """log_preview of a value, computed by the writer thread and only if the record is written"""
+
+    __slots__ = ('value', 'limit')
+
+    def __init__(self, value, limit=100):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self):
+        return log_preview(self.value, self.limit)
+
+class JSONLogFormatter(logging.Formatter):
+    """One JSON object per record"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'pid': record.process,
+            'thread': record.threadName
+        }
+        for key in ('tool', 'request_id'):
+            value = getattr(record, key, None)
+            if value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class LogContextFilter(logging.Filter):
+    """Tag records with the current tool call and drop INFO/DEBUG lines of unsampled calls"""
+
+    def filter(self, record):
+        fields = _log_fields.get()
+        if fields is None:
+            return True
+        record.tool = fields['tool']
+        record.request_id = fields['request_id']
+        return fields['sampled'] or record.levelno >= logging.WARNING
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that never blocks the logging thread
+
+    Records are queued unformatted (the listener thread formats them) and
+    dropped, with a count kept, when the queue is full.
+    """
+
+    def __init__(self, record_queue):
+        super().__init__(record_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+_log_listener = None
+
+def log_sampled(tool_name):
+    """Decide once per call whether a tool call's INFO/DEBUG lines are written"""
+    rate = LOG_CONFIG['sample_rates'].get(tool_name)
+    return rate is None or random.random() < rate
+
+def configure_logging(stream=None, file=None):
+    """Send server logs through a bounded queue to a background writer (stdout and optional rotating file)"""
+    global _log_listener
+    stop_logging()
+
+    if LOG_CONFIG['format'] == 'json':
+        formatter = JSONLogFormatter()
+    else:
+        formatter = logging.Formatter('[%(asctime)s] %(message)s', '%Y-%m-%d %H:%M:%S')
+
+    handlers = [logging.StreamHandler(stream or sys.stdout)]
+    file = file or LOG_CONFIG['file']
+    if file:
+        handlers.append(logging.handlers.RotatingFileHandler(
+            file, maxBytes=LOG_CONFIG['max_bytes'], backupCount=LOG_CONFIG['backup_count'], encoding='utf-8'
+        ))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    queue_handler = DroppingQueueHandler(queue.Queue(LOG_CONFIG['queue_size']))
+    queue_handler.addFilter(LogContextFilter())
+    logger.handlers[:] = [queue_handler]
+    logger.setLevel(LOG_CONFIG['level'].upper())
+    logger.propagate = False
+
+    _log_listener = logging.handlers.QueueListener(queue_handler.queue, *handlers)
+    _log_listener.start()
+    return queue_handler
+
+def stop_logging():
+    """Write out queued records and stop the writer thread"""
+    global _log_listener
+    if _log_listener is None:
+        return
+    listener, _log_listener = _log_listener, None
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
+
+atexit.register(stop_logging)
+atexit.register(lambda: CALL_RECORDER.flush(timeout=2))
+
+class Metric:
+    """Base of the Prometheus metrics: values per label combination"""
+
+    kind = 'untyped'
+
+    def __init__(self, name, help, labelnames=(), merge='sum'):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.merge = merge          # How values of several processes combine: sum, min or max
+        self._values = {}
+        self._function = None
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def set_function(self, function):
+        """Compute the (unlabelled) value when metrics are collected"""
+        self._function = function
+
+    def snapshot(self):
+        """Values keyed by their JSON-encoded label values"""
+        if self._function is not None:
+            try:
+                return {'[]': self._function()}
+            except Exception:
+                return {}
+        with self._lock:
+            return {json.dumps(key): (list(value) if isinstance(value, list) else value)
+                    for key, value in self._values.items()}
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextlib.contextmanager
+    def track(self, **labels):
+        """Count something as in progress for the duration of the block"""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            # Per-bucket counts (not cumulative), then sum and count
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 3)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    break
+            else:
+                index = len(self.buckets)
+            counts[index] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """Observe the duration of the block"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+def _format_metric_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+def _format_metric_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+class MetricsRegistry:
+    """Process metrics, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def snapshot(self):
+        """Current values of every metric (JSON-serializable)"""
+        return {metric.name: metric.snapshot() for metric in self.metrics}
+
+    def merge(self, snapshots):
+        """Combine snapshots of several processes into one"""
+        merged = {}
+        for metric in self.metrics:
+            values = {}
+            for snapshot in snapshots:
+                for key, value in snapshot.get(metric.name, {}).items():
+                    if key not in values:
+                        values[key] = list(value) if isinstance(value, list) else value
+                    elif isinstance(value, list):
+                        values[key] = [a + b for a, b in zip(values[key], value)]
+                    elif metric.merge == 'min':
+                        values[key] = min(values[key], value)
+                    elif metric.merge == 'max':
+                        values[key] = max(values[key], value)
+                    else:
+                        values[key] += value
+            merged[metric.name] = values
+        return merged
+
+    def render(self, snapshots=None):
+        """Prometheus text exposition of this process, or of the merged snapshots of several"""
+        values = self.merge(snapshots) if snapshots is not None else self.snapshot()
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for key, value in sorted(values.get(metric.name, {}).items()):
+                label_values = json.loads(key)
+                if metric.kind != 'histogram':
+                    labels = _format_metric_labels(metric.labelnames, label_values)
+                    lines.append(f'{metric.name}{labels} {_format_metric_value(value)}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float('inf'),), value):
+                    cumulative += count
+                    labels = _format_metric_labels(metric.labelnames, label_values,
+                                                   [('le', _format_metric_value(float(bound)))])
+                    lines.append(f'{metric.name}_bucket{labels} {cumulative}')
+                labels = _format_metric_labels(metric.labelnames, label_values)
+                lines.append(f'{metric.name}_sum{labels} {_format_metric_value(value[-2])}')
+                lines.append(f'{metric.name}_count{labels} {value[-1]}')
+        return '\n'.join(lines) + '\n'
+
+METRICS = MetricsRegistry()
+
+REQUESTS_TOTAL = METRICS.register(Counter(
+    'mcp_requests_total', 'JSON-RPC requests by method', ('method',)))
+REQUEST_SECONDS = METRICS.register(Histogram(
+    'mcp_request_duration_seconds', 'JSON-RPC request handling time by method', ('method',)))
+HTTP_IN_FLIGHT = METRICS.register(Gauge(
+    'mcp_http_requests_in_flight', 'HTTP requests being handled'))
+CONNECTION_QUEUE_DEPTH = METRICS.register(Gauge(
+    'mcp_connection_queue_depth', 'Accepted connections waiting for a free worker thread'))
+TOOL_CALLS_TOTAL = METRICS.register(Counter(
+    'mcp_tool_calls_total', 'Tool calls by tool and outcome (ok, failed, aborted, error)', ('tool', 'status')))
+TOOL_SECONDS = METRICS.register(Histogram(
+    'mcp_tool_duration_seconds', 'Tool call time by tool', ('tool',)))
+TOOL_IN_FLIGHT = METRICS.register(Gauge(
+    'mcp_tool_calls_in_flight', 'Tool calls running, by tool', ('tool',)))
+JOBS_QUEUED = METRICS.register(Gauge(
+    'mcp_jobs_queued', 'Background jobs waiting for a job worker'))
+OLLAMA_SECONDS = METRICS.register(Histogram(
+    'mcp_ollama_request_duration_seconds', 'Ollama API call time by endpoint', ('endpoint',)))
+OLLAMA_ERRORS = METRICS.register(Counter(
+    'mcp_ollama_errors_total', 'Failed Ollama API calls by endpoint', ('endpoint',)))
+OLLAMA_CONNECTIONS_OPENED = METRICS.register(Counter(
+    'mcp_ollama_connections_opened_total', 'TCP connections opened to Ollama (low when keep-alive works)'))
+EMBEDDING_CONCURRENCY_LIMIT = METRICS.register(Gauge(
+    'mcp_embedding_concurrency_limit', 'Embedding requests allowed in flight by the adaptive scheduler'))
+EMBEDDING_REQUESTS_IN_FLIGHT = METRICS.register(Gauge(
+    'mcp_embedding_requests_in_flight', 'Embedding requests holding a scheduler slot'))
+EMBEDDING_CACHE_LOOKUPS = METRICS.register(Counter(
+    'mcp_embedding_cache_lookups_total', 'Embedding cache lookups by result (memory, sqlite, miss)', ('result',)))
+EMBEDDING_CACHE_BYTES = METRICS.register(Gauge(
+    'mcp_embedding_cache_memory_bytes', 'Bytes held by the in-process embedding cache'))
+SQLITE_SECONDS = METRICS.register(Histogram(
+    'mcp_sqlite_query_duration_seconds', 'SQLite statement execution time by statement kind', ('statement',),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)))
+GITHUB_SECONDS = METRICS.register(Histogram(
+    'mcp_github_request_duration_seconds', 'GitHub API call time by HTTP method', ('method',)))
+GITHUB_ERRORS = METRICS.register(Counter(
+    'mcp_github_errors_total', 'Failed GitHub API calls by HTTP status (0: no response)', ('status',)))
+GITHUB_RATE_LIMIT_REMAINING = METRICS.register(Gauge(
+    'mcp_github_rate_limit_remaining', 'X-RateLimit-Remaining of the latest GitHub API response', merge='min'))
+LOG_RECORDS_DROPPED = METRICS.register(Counter(
+    'mcp_log_records_dropped_total', 'Log records dropped because the log queue was full'))
+
+LOG_RECORDS_DROPPED.set_function(
+    lambda: sum(getattr(handler, 'dropped', 0) for handler in logger.handlers))
+
+# Methods reported under their own label; anything else is counted as 'other'
+METRIC_METHODS = ('initialize', 'tools/list', 'tools/call', 'notifications/cancelled')
+
+def metrics_snapshot_path(pid=None):
+    """Snapshot file of a pre-fork worker"""
+    return os.path.join(METRICS_CONFIG['snapshot_dir'], f'{pid or os.getpid()}.json')
+
+def publish_metrics_snapshot():
+    """Write this process' metrics where the other workers can read them"""
+    write_json_atomic(metrics_snapshot_path(), METRICS.snapshot(), indent=None)
+
+def collect_metrics():
+    """Metrics text of this process, or of all pre-fork workers when they publish snapshots"""
+    snapshot_dir = METRICS_CONFIG['snapshot_dir']
+    if not snapshot_dir:
+        return METRICS.render()
+
+    publish_metrics_snapshot()
+    snapshots = []
+    for name in os.listdir(snapshot_dir):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(snapshot_dir, name), encoding='utf-8') as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return METRICS.render(snapshots)
+
+def _sql_statement_kind(sql):
+    words = sql.split(None, 1)
+    kind = words[0].lower() if words else ''
+    return kind if kind in ('select', 'insert', 'update', 'delete', 'create', 'alter', 'pragma') else 'other'
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that records statement execution time"""
+
+    def execute(self, sql, parameters=()):
+        with SQLITE_SECONDS.time(statement=_sql_statement_kind(sql)):
+            return super().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        with SQLITE_SECONDS.time(statement=_sql_statement_kind(sql)):
+            return super().executemany(sql, seq_of_parameters)
+
+class TimedConnection(sqlite3.Connection):
+    """Connection whose statements and commits are timed"""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        with SQLITE_SECONDS.time(statement='commit'):
+            super().commit()
+
+# Trace of the tool call being served, and the span new spans are children of
+_trace = contextvars.ContextVar('mcp_trace', default=None)
+_trace_parent = contextvars.ContextVar('mcp_trace_parent', default=None)
+_trace_export_lock = threading.Lock()
+
+class Span:
+    """One timed stage of a traced call"""
+
+    __slots__ = ('name', 'span_id', 'parent_id', 'start_ns', 'end_ns', 'attributes', 'error')
+
+    def __init__(self, name, parent_id=None, attributes=None):
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes or {}
+        self.error = None
+
+class Trace:
+    """Spans recorded for one traced tool call, under a root span covering the whole call"""
+
+    def __init__(self, name, **attributes):
+        self.trace_id = uuid.uuid4().hex
+        self.root = Span(name, attributes=attributes)
+        self.spans = [self.root]
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def finish(self, error=None):
+        if self.root.end_ns is None:
+            self.root.end_ns = time.time_ns()
+            self.root.error = error
+
+    def summary(self):
+        """Spans for the response _meta, with offsets and durations in milliseconds"""
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span.start_ns)
+        origin = self.root.start_ns
+        entries = []
+        for span in spans:
+            entry = {
+                'name': span.name,
+                'spanId': span.span_id,
+                'parentSpanId': span.parent_id,
+                'startMs': round((span.start_ns - origin) / 1e6, 3),
+                'durationMs': round(((span.end_ns or time.time_ns()) - span.start_ns) / 1e6, 3)
+            }
+            if span.attributes:
+                entry['attributes'] = span.attributes
+            if span.error:
+                entry['error'] = span.error
+            entries.append(entry)
+        return {'traceId': self.trace_id, 'spans': entries}
+
+    def to_otlp(self):
+        """The trace as an OTLP/JSON ExportTraceServiceRequest"""
+        def attribute(key, value):
+            if isinstance(value, bool):
+                typed = {'boolValue': value}
+            elif isinstance(value, int):
+                typed = {'intValue': str(value)}
+            elif isinstance(value, float):
+                typed = {'doubleValue': value}
+            else:
+                typed = {'stringValue': str(value)}
+            return {'key': key, 'value': typed}
+
+        with self._lock:
+            spans = list(self.spans)
+        otlp_spans = []
+        for span in spans:
+            otlp_span = {
+                'traceId': self.trace_id,
+                'spanId': span.span_id,
+                'name': span.name,
+                'kind': 2 if span is self.root else 1,   # SERVER for the call, INTERNAL for stages
+                'startTimeUnixNano': str(span.start_ns),
+                'endTimeUnixNano': str(span.end_ns or span.start_ns),
+                'attributes': [attribute(key, value) for key, value in span.attributes.items()],
+                'status': {'code': 2, 'message': span.error} if span.error else {'code': 1}
+            }
+            if span.parent_id:
+                otlp_span['parentSpanId'] = span.parent_id
+            otlp_spans.append(otlp_span)
+
+        return {'resourceSpans': [{
+            'resource': {'attributes': [attribute('service.name', TRACE_CONFIG['service_name']),
+                                        attribute('process.pid', os.getpid())]},
+            'scopeSpans': [{'scope': {'name': 'http_mcp_server'}, 'spans': otlp_spans}]
+        }]}
+
+@contextlib.contextmanager
+def trace_span(name, **attributes):
+    """
+    Time a stage of the current call when it is traced
+
+    Yields the span's attribute dict, so results known only at the end (row
+    counts, sizes) can be added. Without a trace only the dict is created.
+    """
+    trace = _trace.get()
+    if trace is None:
+        yield attributes
+        return
+
+    span = Span(name, _trace_parent.get(), attributes)
+    token = _trace_parent.set(span.span_id)
+    try:
+        yield span.attributes
+    except BaseException as e:
+        span.error = str(e) or type(e).__name__
+        raise
+    finally:
+        _trace_parent.reset(token)
+        span.end_ns = time.time_ns()
+        trace.add(span)
+
+def export_trace(trace):
+    """Append a finished trace to the OTLP/JSON export file, if one is configured"""
+    path = TRACE_CONFIG['export_file']
+    if not path:
+        return
+    line = json.dumps(trace.to_otlp(), ensure_ascii=False, separators=(',', ':')) + '\n'
+    with _trace_export_lock, open(path, 'a', encoding='utf-8') as f:
+        f.write(line)
+
+def profile_dir():
+    """Directory of saved call profiles"""
+    return PROFILE_CONFIG['dir'] or os.path.join(CRM_DATA_DIR, 'profiles')
+
+class CallProfiler:
+    """
+    cProfile around one tool call: execution and result encoding
+
+    cProfile follows only the calling thread, and only one call can be
+    profiled at a time. The profile is saved as a .prof file (pstats format,
+    e.g. for snakeviz or python -m pstats) and summarized by its top rows.
+    """
+
+    _active = threading.Lock()
+
+    def __init__(self, tool_name, sort='cumulative', top=None):
+        if sort not in PROFILE_CONFIG['sort_keys']:
+            raise ValueError(f"Unknown profile sort '{sort}'. Use one of: {', '.join(PROFILE_CONFIG['sort_keys'])}")
+        self.tool_name = tool_name
+        self.sort = sort
+        self.top = max(1, min(int(top or PROFILE_CONFIG['top']), 100))
+        self.profile = None
+        self.elapsed = None
+
+    def start(self):
+        if not CallProfiler._active.acquire(blocking=False):
+            raise ServerBusy('Another tool call is being profiled, retry later')
+        self.profile = cProfile.Profile()
+        self.started = time.perf_counter()
+        self.profile.enable()
+
+    def stop(self):
+        """Stop profiling (safe to call more than once)"""
+        if self.elapsed is None and self.profile is not None:
+            self.profile.disable()
+            self.elapsed = time.perf_counter() - self.started
+            CallProfiler._active.release()
+
+    def save(self):
+        """Write the profile and return its summary"""
+        self.stop()
+        directory = profile_dir()
+        os.makedirs(directory, exist_ok=True)
+        name = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{self.tool_name}-{uuid.uuid4().hex[:8]}.prof"
+        path = os.path.join(directory, name)
+        self.profile.dump_stats(path)
+        prune_profiles()
+
+        stats = pstats.Stats(self.profile)
+        stats.sort_stats(self.sort)
+        top = []
+        for function in stats.fcn_list[:self.top]:
+            primitive_calls, calls, tottime, cumtime, _ = stats.stats[function]
+            filename, line, function_name = function
+            top.append({
+                'function': function_name,
+                'location': f'{os.path.basename(filename)}:{line}' if line else filename,
+                'calls': calls if calls == primitive_calls else f'{calls}/{primitive_calls}',
+                'tottime': round(tottime, 6),
+                'cumtime': round(cumtime, 6)
+            })
+        return {
+            'file': name,
+            'wallSeconds': round(self.elapsed, 6),
+            'sort': self.sort,
+            'top': top
+        }
+
+def prune_profiles():
+    """Keep only the newest PROFILE_CONFIG['keep'] profiles"""
+    directory = profile_dir()
+    names = sorted(name for name in os.listdir(directory) if name.endswith('.prof'))
+    for name in names[:-PROFILE_CONFIG['keep']]:
+        with contextlib.suppress(OSError):
+            os.unlink(os.path.join(directory, name))
+
+def current_rss_bytes():
+    """Resident set size of this process (from /proc; 0 where it is not available)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+def peak_rss_bytes():
+    """Highest resident set size this process has reached"""
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+class ToolMemoryStats:
+    """
+    RSS change and peak RSS growth of tool calls, per tool
+
+    Measured around each call, so calls running at the same time share the
+    blame; the peak growth still shows which tools push the high-water mark.
+    """
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, tool_name, rss_delta, peak_growth):
+        with self._lock:
+            stats = self._stats.setdefault(tool_name, {
+                'calls': 0, 'rss_delta_last': 0, 'rss_delta_max': 0,
+                'peak_growth_max': 0, 'peak_growth_total': 0
+            })
+            stats['calls'] += 1
+            stats['rss_delta_last'] = rss_delta
+            stats['rss_delta_max'] = max(stats['rss_delta_max'], rss_delta)
+            stats['peak_growth_max'] = max(stats['peak_growth_max'], peak_growth)
+            stats['peak_growth_total'] += peak_growth
+        if peak_growth:
+            TOOL_PEAK_RSS_GROWTH.inc(peak_growth, tool=tool_name)
+
+    def report(self):
+        with self._lock:
+            return {tool_name: dict(stats) for tool_name, stats in self._stats.items()}
+
+TOOL_MEMORY = ToolMemoryStats()
+
+PROCESS_RSS = METRICS.register(Gauge(
+    'mcp_process_resident_memory_bytes', 'Resident set size of the server process(es)'))
+PROCESS_PEAK_RSS = METRICS.register(Gauge(
+    'mcp_process_peak_resident_memory_bytes', 'Highest resident set size of a server process', merge='max'))
+TOOL_PEAK_RSS_GROWTH = METRICS.register(Counter(
+    'mcp_tool_peak_rss_growth_bytes_total', 'Growth of the peak RSS during calls, by tool', ('tool',)))
+PROCESS_RSS.set_function(current_rss_bytes)
+PROCESS_PEAK_RSS.set_function(peak_rss_bytes)
+
+# tracemalloc snapshots taken by memory_trace: id -> (taken at, snapshot)
+_memory_snapshots = {}
+_memory_snapshot_ids = itertools.count(1)
+
+def _tool_line_ranges():
+    """Source line ranges of the registered tool methods: filename -> [(first, last, tool name)]"""
+    ranges = {}
+    for spec in TOOL_REGISTRY.values():
+        code = inspect.unwrap(spec.handler).__code__
+        lines = [line for _, _, line in code.co_lines() if line]
+        ranges.setdefault(code.co_filename, []).append((min(lines), max(lines), spec.name))
+    return ranges
+
+def allocations_by_tool(snapshot):
+    """Live traced memory grouped by the outermost tool method on each allocation's traceback"""
+    ranges = _tool_line_ranges()
+    totals = {}
+    for trace in snapshot.traces:
+        owner = 'other'
+        # Frames run from the oldest to the most recent: the first tool found is the one called
+        for frame in trace.traceback:
+            for first, last, tool_name in ranges.get(frame.filename, ()):
+                if first <= frame.lineno <= last:
+                    owner = tool_name
+                    break
+            if owner != 'other':
+                break
+        size, count = totals.get(owner, (0, 0))
+        totals[owner] = (size + trace.size, count + 1)
+    return totals
+
+def take_memory_snapshot():
+    """tracemalloc snapshot without tracemalloc's own allocations"""
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+    ))
+
+def memory_statistics(snapshot, group_by, limit, base=None):
+    """Top allocation sites (or tools) of a snapshot, or of its difference from base"""
+    if group_by == 'tool':
+        totals = allocations_by_tool(snapshot)
+        base_totals = allocations_by_tool(base) if base is not None else {}
+        rows = []
+        for tool_name in set(totals) | set(base_totals):
+            size, count = totals.get(tool_name, (0, 0))
+            row = {'tool': tool_name, 'size_kb': round(size / 1024, 1), 'count': count}
+            if base is not None:
+                base_size, base_count = base_totals.get(tool_name, (0, 0))
+                row['size_diff_kb'] = round((size - base_size) / 1024, 1)
+                row['count_diff'] = count - base_count
+            rows.append(row)
+        key = 'size_diff_kb' if base is not None else 'size_kb'
+        rows.sort(key=lambda row: abs(row[key]), reverse=True)
+        return rows[:limit]
+
+    if base is not None:
+        stats = snapshot.compare_to(base, group_by)
+    else:
+        stats = snapshot.statistics(group_by)
+    rows = []
+    for stat in stats[:limit]:
+        frames = stat.traceback.format() if group_by == 'traceback' else None
+        frame = stat.traceback[0]
+        row = {
+            'location': f'{os.path.basename(frame.filename)}:{frame.lineno}' if group_by != 'filename'
+                        else frame.filename,
+            'size_kb': round(stat.size / 1024, 1),
+            'count': stat.count
+        }
+        if base is not None:
+            row['size_diff_kb'] = round(stat.size_diff / 1024, 1)
+            row['count_diff'] = stat.count_diff
+        if frames:
+            row['traceback'] = frames
+        rows.append(row)
+    return rows
+
+def redact_blobs(value):
+    """Replace large strings and lists (PDFs, texts, embeddings) by their hash and size"""
+    if isinstance(value, str) and len(value) > RECORDER_CONFIG['blob_chars']:
+        digest = hashlib.sha256(value.encode('utf-8', 'surrogatepass')).hexdigest()[:16]
+        return {'$blob': digest, 'type': 'str', 'len': len(value)}
+    if isinstance(value, list):
+        if len(value) > RECORDER_CONFIG['blob_items']:
+            digest = hashlib.sha256(encode_json(value)).hexdigest()[:16]
+            return {'$blob': digest, 'type': 'list', 'len': len(value)}
+        return [redact_blobs(item) for item in value]
+    if isinstance(value, dict):
+        return {key: redact_blobs(item) for key, item in value.items()}
+    return value
+
+class CallRecorder:
+    """
+    Appends tool call records to a JSONL file from a background thread
+
+    Request threads only put a small dict on a bounded queue (dropped when
+    full); the writer gathers records for up to flush_interval seconds and
+    appends each batch with a single write, so pre-fork workers can share
+    the file.
+    """
+
+    def __init__(self):
+        self.dropped = 0
+        self._queue = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(RECORDER_CONFIG['file'])
+
+    def record(self, entry):
+        if not self.enabled:
+            return
+        if self._thread is None or not self._thread.is_alive():
+            self._start()
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self):
+        with self._lock:
+            # Also restarts the writer in a forked worker, where the thread does not exist
+            if self._thread is None or not self._thread.is_alive():
+                self._queue = queue.Queue(RECORDER_CONFIG['queue_size'])
+                self._thread = threading.Thread(target=self._write_loop, args=(self._queue,),
+                                                name='mcp-recorder', daemon=True)
+                self._thread.start()
+
+    def _write_loop(self, records):
+        while True:
+            batch = [records.get()]
+            deadline = time.monotonic() + RECORDER_CONFIG['flush_interval']
+            # A flush request (an Event) ends the batch early
+            while len(batch) < RECORDER_CONFIG['batch_size'] and not isinstance(batch[-1], threading.Event):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(records.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            entries = [entry for entry in batch if not isinstance(entry, threading.Event)]
+            if entries:
+                self._write(entries)
+            for entry in batch:
+                if isinstance(entry, threading.Event):
+                    entry.set()
+
+    def _write(self, batch):
+        data = b''.join(encode_json(entry) + b'\n' for entry in batch)
+        try:
+            fd = os.open(RECORDER_CONFIG['file'], os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+        except OSError as e:
+            self.dropped += len(batch)
+            logger.warning('⚠️ Call recorder could not write %s: %s', RECORDER_CONFIG['file'], e)
+
+    def flush(self, timeout=5):
+        """Wait until the records queued so far are written"""
+        if self._thread is None or not self._thread.is_alive():
+            return True
+        written = threading.Event()
+        try:
+            self._queue.put(written, timeout=timeout)
+        except queue.Full:
+            return False
+        return written.wait(timeout)
+
+CALL_RECORDER = CallRecorder()
+
 def set_github_token(token):
     """Set GitHub Personal Access Token"""
     global GITHUB_TOKEN
@@ -66,17 +1458,476 @@ def github_api_request(endpoint, method='GET', data=None):
         req.add_header('Content-Type', 'application/json')
 
     try:
-        with urllib.request.urlopen(req, timeout=30) as response:
-            return json.loads(response.read().decode('utf-8'))
+        with trace_span(f'github {method}', endpoint=endpoint), GITHUB_SECONDS.time(method=method):
+            with urllib.request.urlopen(req, timeout=call_timeout(30)) as response:
+                record_github_rate_limit(response.headers)
+                return json.loads(response.read().decode('utf-8'))
     except urllib.error.HTTPError as e:
+        record_github_rate_limit(e.headers)
+        GITHUB_ERRORS.inc(status=e.code)
         error_body = e.read().decode('utf-8')
         raise Exception(f"GitHub API error {e.code}: {error_body}")
+    except (urllib.error.URLError, OSError):
+        GITHUB_ERRORS.inc(status=0)
+        raise
+
+def record_github_rate_limit(headers):
+    """Track the remaining GitHub API quota reported by a response"""
+    remaining = headers.get('X-RateLimit-Remaining') if headers is not None else None
+    if remaining is not None and remaining.isdigit():
+        GITHUB_RATE_LIMIT_REMAINING.set(int(remaining))
+
+class HTTPConnectionPool:
+    """
+    Keep-alive HTTP/1.1 connections to one server, shared by all threads
+
+    At most max_connections requests are in flight; other threads wait for a
+    free connection. Idle connections are reused newest first. A request that
+    fails on a reused connection before any response arrived is sent once
+    more on a new connection, since the server may have closed it while idle.
+    """
+
+    def __init__(self, base_url, max_connections, connect_timeout):
+        parts = urllib.parse.urlsplit(base_url)
+        self.base_url = base_url
+        self.https = parts.scheme == 'https'
+        self.host = parts.hostname
+        self.port = parts.port
+        self.base_path = parts.path.rstrip('/')
+        self.connect_timeout = connect_timeout
+        self.pid = os.getpid()
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        connection_class = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        conn = connection_class(self.host, self.port, timeout=self.connect_timeout)
+        conn.connect()
+        OLLAMA_CONNECTIONS_OPENED.inc()
+        return conn
+
+    def request(self, method, path, body=None, headers=None, timeout=60, wait=30):
+        """Send a request; return (status, headers, body bytes)"""
+        if not self._slots.acquire(timeout=wait):
+            raise TimeoutError(f'No free connection to {self.base_url} within {wait:.0f} s')
+        try:
+            retried = False
+            while True:
+                conn = None
+                if not retried:
+                    with self._lock:
+                        conn = self._idle.pop() if self._idle else None
+                reused = conn is not None
+                if conn is None:
+                    conn = self._connect()
+                try:
+                    conn.sock.settimeout(timeout)
+                    conn.request(method, self.base_path + path, body=body, headers=headers or {})
+                    response = conn.getresponse()
+                    data = response.read()
+                except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                    conn.close()
+                    if reused:
+                        retried = True
+                        continue
+                    raise
+                except BaseException:
+                    conn.close()
+                    raise
+
+                if response.will_close:
+                    conn.close()
+                else:
+                    with self._lock:
+                        self._idle.append(conn)
+                return response.status, response.headers, data
+        finally:
+            self._slots.release()
+
+    def close(self):
+        """Close the idle connections"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+_ollama_pool = None
+_ollama_pool_lock = threading.Lock()
+
+def get_ollama_pool():
+    """Return the connection pool for OLLAMA_API_URL (created lazily, again after a fork)"""
+    global _ollama_pool
+    with _ollama_pool_lock:
+        pool = _ollama_pool
+        if pool is None or pool.base_url != OLLAMA_API_URL or pool.pid != os.getpid():
+            if pool is not None and pool.pid == os.getpid():
+                pool.close()
+            _ollama_pool = pool = HTTPConnectionPool(
+                OLLAMA_API_URL,
+                max_connections=OLLAMA_CONFIG['max_connections'],
+                connect_timeout=OLLAMA_CONFIG['connect_timeout']
+            )
+        return pool
+
+def ollama_request(endpoint, payload, timeout=None):
+    """POST a JSON payload to the Ollama API and return the decoded response"""
+    body = json.dumps(payload).encode('utf-8')
+    try:
+        with trace_span(f'ollama {endpoint}'), OLLAMA_SECONDS.time(endpoint=endpoint):
+            status, headers, data = get_ollama_pool().request(
+                'POST', endpoint, body=body,
+                headers={'Content-Type': 'application/json'},
+                timeout=timeout or OLLAMA_CONFIG['read_timeout'],
+                wait=call_timeout(OLLAMA_CONFIG['pool_wait'])
+            )
+        if status >= 400:
+            # Same error as urllib raised before the pool, so callers can tell rejected input apart
+            raise urllib.error.HTTPError(f'{OLLAMA_API_URL}{endpoint}', status,
+                                         data.decode('utf-8', 'replace')[:200], headers, None)
+        return json.loads(data.decode('utf-8'))
+    except Exception:
+        OLLAMA_ERRORS.inc(endpoint=endpoint)
+        raise
+
+def estimate_tokens(text):
+    """Rough token count of a text, for packing embedding batches"""
+    return len(text) // EMBEDDING_CONFIG['chars_per_token'] + 1
+
+def embedding_batches(texts, batch_size=None, max_tokens=None):
+    """Group text indexes into /api/embed requests by count and estimated token budget"""
+    batch_size = batch_size or EMBEDDING_CONFIG['batch_size']
+    max_tokens = max_tokens or EMBEDDING_CONFIG['max_batch_tokens']
+    batch, tokens = [], 0
+    for index, text in enumerate(texts):
+        cost = estimate_tokens(text)
+        if batch and (len(batch) >= batch_size or tokens + cost > max_tokens):
+            yield batch
+            batch, tokens = [], 0
+        batch.append(index)
+        tokens += cost
+    if batch:
+        yield batch
+
+class EmbeddingScheduler:
+    """
+    Server-wide limit on embedding requests in flight, adapted AIMD-style
+
+    Every request that reaches the provider holds a slot. The limit grows by
+    about one slot per limit's worth of fast responses and is halved (at most
+    once per decrease_interval) when a request fails or its time per text
+    exceeds latency_tolerance times the best seen recently, so Ollama is kept
+    busy without building a queue. Calls in flight share the limit fairly:
+    one call may hold at most limit / active calls slots, so a second upload
+    is not starved by the first.
+    """
+
+    def __init__(self):
+        self.limit = float(EMBEDDING_SCHEDULER_CONFIG['initial_limit'])
+        self.in_flight = 0
+        self.baseline = None          # Best recent seconds per text
+        self._slots = {}              # owner -> slots held
+        self._waiting = {}            # owner -> threads waiting for a slot
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def _share(self):
+        owners = set(self._slots) | set(self._waiting)
+        return max(1, math.ceil(int(self.limit) / max(1, len(owners))))
+
+    def acquire(self, owner=None):
+        """Wait for a slot; the wait ends early when the call is cancelled or out of time"""
+        with self._cond:
+            self._waiting[owner] = self._waiting.get(owner, 0) + 1
+            try:
+                while self.in_flight >= int(self.limit) or self._slots.get(owner, 0) >= self._share():
+                    # call_timeout raises once the call is cancelled or past its deadline
+                    self._cond.wait(call_timeout(0.5))
+                self.in_flight += 1
+                self._slots[owner] = self._slots.get(owner, 0) + 1
+            finally:
+                self._waiting[owner] -= 1
+                if not self._waiting[owner]:
+                    del self._waiting[owner]
+
+    def release(self, owner=None, seconds=None, texts=1, failed=False):
+        """Free a slot and adapt the limit to how the request went"""
+        with self._cond:
+            self.in_flight -= 1
+            self._slots[owner] -= 1
+            if not self._slots[owner]:
+                del self._slots[owner]
+            if seconds is not None:
+                self._observe(seconds / max(1, texts), failed, saturated=self.in_flight + 1 >= int(self.limit))
+            self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def slot(self, owner=None, texts=1):
+        """Hold a slot for one provider request; yields a dict where the caller sets 'failed'"""
+        self.acquire(owner)
+        outcome = {'failed': False}
+        started = time.perf_counter()
+        try:
+            yield outcome
+        except RequestAborted:
+            self.release(owner)
+            raise
+        except Exception:
+            self.release(owner, time.perf_counter() - started, texts, failed=True)
+            raise
+        self.release(owner, time.perf_counter() - started, texts, failed=outcome['failed'])
+
+    def _observe(self, per_text, failed, saturated):
+        config = EMBEDDING_SCHEDULER_CONFIG
+        if not failed:
+            if self.baseline is None or per_text < self.baseline:
+                self.baseline = per_text
+            else:
+                # Forget slowly, so a slower model or busier host becomes the new normal
+                self.baseline += (per_text - self.baseline) * 0.01
+        if failed or per_text > self.baseline * config['latency_tolerance']:
+            now = time.monotonic()
+            if now - self._last_decrease >= config['decrease_interval']:
+                self._last_decrease = now
+                self.limit = max(config['min_limit'], self.limit * config['backoff'])
+        elif saturated:
+            # Grow only while the limit is what holds requests back
+            self.limit = min(config['max_limit'], self.limit + 1 / self.limit)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'limit': round(self.limit, 2),
+                'in_flight': self.in_flight,
+                'waiting': sum(self._waiting.values()),
+                'calls': len(set(self._slots) | set(self._waiting)),
+                'baseline_ms_per_text': round(self.baseline * 1000, 2) if self.baseline is not None else None
+            }
+
+EMBEDDING_SCHEDULER = EmbeddingScheduler()
+EMBEDDING_CONCURRENCY_LIMIT.set_function(lambda: int(EMBEDDING_SCHEDULER.limit))
+EMBEDDING_REQUESTS_IN_FLIGHT.set_function(lambda: EMBEDDING_SCHEDULER.in_flight)
+
+def embed_texts(texts, provider=None):
+    """
+    Embeddings for many texts: from the cache, the rest from the embedding provider
+
+    Returns (embeddings, errors): embeddings[i] is the vector of texts[i] or
+    None, and errors maps the index of every failed text to its error.
+    Identical texts are embedded once; the provider is called within a
+    slot of EMBEDDING_SCHEDULER, shared fairly between the calls running.
+    """
+    provider = provider or get_embedding_provider()
+    keys = [embedding_cache_key(provider.identity, text) for text in texts]
+    embeddings = EMBEDDING_CACHE.get_many(keys)
+    errors = {}
+
+    # Positions of every text still missing, grouped by key
+    missing = OrderedDict()
+    for i, (key, embedding) in enumerate(zip(keys, embeddings)):
+        if embedding is None:
+            missing.setdefault(key, []).append(i)
+    if not missing:
+        return embeddings, errors
+
+    pending = [texts[positions[0]] for positions in missing.values()]
+    with EMBEDDING_SCHEDULER.slot(current_request_context(), len(pending)) as outcome:
+        vectors, request_errors = provider.embed(pending)
+        # Not a single vector: the provider is down or overloaded (a rejected text fails alone)
+        outcome['failed'] = len(request_errors) == len(pending)
+    fresh = {}
+    for n, (key, positions) in enumerate(missing.items()):
+        if vectors[n] is not None:
+            fresh[key] = vectors[n]
+        for i in positions:
+            if vectors[n] is None:
+                errors[i] = request_errors[n]
+            else:
+                embeddings[i] = vectors[n]
+    EMBEDDING_CACHE.put_many(provider.identity, fresh)
+    return embeddings, errors
+
+def request_embeddings(texts, model):
+    """
+    Generate embeddings with as few Ollama requests as possible
+
+    Same result as embed_texts. A request Ollama rejects as bad input
+    (400, 413, 422) is split in halves until the offending texts are
+    isolated; when Ollama cannot be reached, lacks the model or is
+    overloaded, every text of the request fails at once.
+    """
+    embeddings = [None] * len(texts)
+    errors = {}
+
+    def embed(indexes):
+        try:
+            result = ollama_request('/api/embed', {
+                'model': model,
+                'input': [texts[i] for i in indexes]
+            }, timeout=call_timeout(OLLAMA_CONFIG['read_timeout']))
+            vectors = result.get('embeddings') or []
+            if len(vectors) != len(indexes) or not all(vectors):
+                raise ValueError(f'Ollama returned {len(vectors)} embeddings for {len(indexes)} texts')
+        except RequestAborted:
+            raise
+        except (urllib.error.HTTPError, ValueError) as e:
+            if isinstance(e, urllib.error.HTTPError) and e.code not in EMBEDDING_CONFIG['split_statuses']:
+                # 404 model not found, 5xx overloaded: every half would fail the same way
+                for i in indexes:
+                    errors[i] = str(e)
+            elif len(indexes) > 1:
+                middle = len(indexes) // 2
+                embed(indexes[:middle])
+                embed(indexes[middle:])
+            else:
+                errors[indexes[0]] = str(e)
+            return
+        except Exception as e:
+            # Connection refused, timeout: retrying halves would only multiply the wait
+            for i in indexes:
+                errors[i] = str(e)
+            return
+        for i, vector in zip(indexes, vectors):
+            embeddings[i] = vector
+
+    for indexes in embedding_batches(texts):
+        embed(indexes)
+    return embeddings, errors
+
+class EmbeddingProvider:
+    """
+    Turns texts into vectors; subclasses register under their name
+
+    embed() returns (embeddings, errors) like embed_texts. identity names
+    the vector space (provider and model): vectors of different identities
+    must not be compared.
+    """
+
+    name = None
+    default_model = None
+
+    def __init__(self, model=None):
+        self.configured_model = model
+        self.model = model or self.default_model
+
+    @property
+    def identity(self):
+        return f'{self.name}:{self.model}'
+
+    def embed(self, texts):
+        raise NotImplementedError
+
+class OllamaEmbeddingProvider(EmbeddingProvider):
+    """Ollama /api/embed over the pooled connections"""
+
+    name = 'ollama'
+    default_model = 'nomic-embed-text'
+
+    def embed(self, texts):
+        return request_embeddings(texts, self.model)
+
+class SentenceTransformerEmbeddingProvider(EmbeddingProvider):
+    """
+    In-process CPU model (sentence-transformers), loaded once per process
+
+    Saves the HTTP round trip per batch on small deployments. Encoding is
+    serialized: the model already uses every core for one batch.
+    """
+
+    name = 'sentence_transformers'
+    default_model = 'all-MiniLM-L6-v2'
+
+    def __init__(self, model=None):
+        super().__init__(model)
+        self._model = None
+        self._load_lock = threading.Lock()
+        self._encode_lock = threading.Lock()
+
+    def _load(self):
+        with self._load_lock:
+            if self._model is None:
+                try:
+                    from sentence_transformers import SentenceTransformer
+                except ImportError:
+                    raise RuntimeError('sentence-transformers is not installed: pip install sentence-transformers')
+                logger.info('🧠 Loading embedding model %s', self.model)
+                self._model = SentenceTransformer(self.model, device='cpu')
+            return self._model
+
+    def embed(self, texts):
+        try:
+            model = self._load()
+            with self._encode_lock, trace_span('local_embedding', texts=len(texts)):
+                vectors = model.encode(texts, batch_size=EMBEDDING_CONFIG['batch_size'],
+                                       normalize_embeddings=True, convert_to_numpy=True)
+            return [vector.tolist() for vector in vectors], {}
+        except Exception as e:
+            return [None] * len(texts), dict.fromkeys(range(len(texts)), str(e))
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """
+    Deterministic feature hashing of words and word pairs (model 'hashing-<dimensions>')
+
+    No model and no network: for tests and benchmarks. Texts sharing words
+    get similar vectors, but there is no semantic understanding.
+    """
+
+    name = 'hashing'
+    default_model = 'hashing-256'
+
+    def __init__(self, model=None):
+        super().__init__(model)
+        prefix, _, dimensions = self.model.partition('-')
+        if prefix != 'hashing' or not dimensions.isdigit() or int(dimensions) < 1:
+            raise ValueError(f"Hashing model must look like 'hashing-256', got '{self.model}'")
+        self.dimensions = int(dimensions)
+
+    def vector(self, text):
+        words = re.findall(r'\w+', unicodedata.normalize('NFC', text).lower())
+        vector = [0.0] * self.dimensions
+        for feature in itertools.chain(words, map(' '.join, zip(words, words[1:]))):
+            value = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'little')
+            # One bit picks the sign, so unrelated features cancel out instead of piling up
+            vector[value % self.dimensions] += 1.0 if value >> 63 else -1.0
+        norm = sum(x * x for x in vector) ** 0.5
+        return [x / norm for x in vector] if norm else vector
+
+    def embed(self, texts):
+        return [self.vector(text) for text in texts], {}
+
+EMBEDDING_PROVIDERS = {
+    provider.name: provider
+    for provider in (OllamaEmbeddingProvider, SentenceTransformerEmbeddingProvider, HashingEmbeddingProvider)
+}
+
+_embedding_provider = None
+_embedding_provider_lock = threading.Lock()
+
+def get_embedding_provider():
+    """Provider chosen by EMBEDDING_CONFIG (kept, with its loaded model, while the config is unchanged)"""
+    global _embedding_provider
+    name, model = EMBEDDING_CONFIG['provider'], EMBEDDING_CONFIG['model']
+    with _embedding_provider_lock:
+        provider = _embedding_provider
+        if provider is None or provider.name != name or provider.configured_model != model:
+            if name not in EMBEDDING_PROVIDERS:
+                raise ValueError(f"Unknown embedding provider '{name}'. Use one of: {', '.join(EMBEDDING_PROVIDERS)}")
+            _embedding_provider = provider = EMBEDDING_PROVIDERS[name](model)
+        return provider
+
+def connect_embeddings_db():
+    """Open a connection to the embeddings database"""
+    # Wait for locks instead of failing when several workers write at once
+    return sqlite3.connect(EMBEDDINGS_DB_PATH, timeout=30, factory=TimedConnection)
 
 def init_database():
     """Initialize SQLite database"""
     # Initialize embeddings database
-    conn = sqlite3.connect(EMBEDDINGS_DB_PATH)
+    conn = connect_embeddings_db()
     cursor = conn.cursor()
+
+    # WAL lets readers in other processes proceed while one process writes
+    cursor.execute('PRAGMA journal_mode=WAL')
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS documents (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -99,31 +1950,104 @@ def init_database():
         # Columns already exist
         pass
 
+    # Embedding space of every row, so vectors of different models are never compared
+    try:
+        cursor.execute("ALTER TABLE documents ADD COLUMN embedding_provider TEXT")
+        cursor.execute("ALTER TABLE documents ADD COLUMN embedding_model TEXT")
+        cursor.execute("ALTER TABLE documents ADD COLUMN embedding_dimensions INTEGER")
+        # Rows written before these columns were embedded by Ollama nomic-embed-text
+        cursor.execute("""
+            UPDATE documents SET embedding_provider = 'ollama', embedding_model = 'nomic-embed-text',
+                                 embedding_dimensions = length(embedding) / 4
+        """)
+        print("✅ Added embedding provider columns to documents table")
+    except sqlite3.OperationalError:
+        # Columns already exist
+        pass
+
     # Create index for better query performance
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_documents_source ON documents(source_file, chunk_index)")
 
+    # Background jobs (see JobManager)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            tool TEXT NOT NULL,
+            label TEXT,
+            status TEXT NOT NULL,
+            progress REAL DEFAULT 0,
+            total REAL,
+            message TEXT,
+            result TEXT,
+            error TEXT,
+            cancel_requested INTEGER DEFAULT 0,
+            owner_pid INTEGER,
+            created_at TEXT NOT NULL,
+            started_at TEXT,
+            finished_at TEXT,
+            updated_at TEXT
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, created_at)")
+
+    # Persistent tier of EmbeddingCache
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS embedding_cache (
+            key TEXT PRIMARY KEY,
+            model TEXT NOT NULL,
+            dimensions INTEGER NOT NULL,
+            embedding BLOB NOT NULL,
+            used_at REAL NOT NULL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_embedding_cache_used ON embedding_cache(used_at)")
+
     conn.commit()
     conn.close()
     print(f"📦 Embeddings database initialized: {EMBEDDINGS_DB_PATH}")
 
+def write_json_atomic(path, data, indent=2):
+    """Write JSON via a temporary file so readers never see a half-written file"""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=indent, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def _crm_files_state():
+    """Identify the current version of the CRM files on disk"""
+    state = []
+    for name in ('crm_users.json', 'crm_tickets.json'):
+        try:
+            st = os.stat(os.path.join(CRM_DATA_DIR, name))
+            state.append((st.st_ino, st.st_mtime_ns, st.st_size))
+        except OSError:
+            state.append(None)
+    return tuple(state)
+
+def refresh_crm_data():
+    """Reload CRM data if another process changed the files since the last load"""
+    if _crm_files_state() != CRM_FILES_STATE:
+        load_crm_data()
+
 def load_crm_data():
     """Load CRM data from JSON files"""
-    global CRM_USERS, CRM_TICKETS
+    global CRM_USERS, CRM_TICKETS, CRM_FILES_STATE
 
     users_file = os.path.join(CRM_DATA_DIR, 'crm_users.json')
     tickets_file = os.path.join(CRM_DATA_DIR, 'crm_tickets.json')
+    CRM_FILES_STATE = _crm_files_state()
 
     try:
         if os.path.exists(users_file):
             with open(users_file, 'r', encoding='utf-8') as f:
                 data = json.load(f)
                 CRM_USERS = data.get('users', [])
-            print(f"✅ Loaded {len(CRM_USERS)} users from CRM")
+            logger.info('✅ Loaded %s users from CRM', len(CRM_USERS))
         else:
-            print(f"⚠️  CRM users file not found: {users_file}")
+            logger.warning('⚠️ CRM users file not found: %s', users_file)
             CRM_USERS = []
     except Exception as e:
-        print(f"❌ Failed to load CRM users: {str(e)}")
+        logger.error('❌ Failed to load CRM users: %s', e)
         CRM_USERS = []
 
     try:
@@ -131,26 +2055,27 @@ def load_crm_data():
             with open(tickets_file, 'r', encoding='utf-8') as f:
                 data = json.load(f)
                 CRM_TICKETS = data.get('tickets', [])
-            print(f"✅ Loaded {len(CRM_TICKETS)} tickets from CRM")
+            logger.info('✅ Loaded %s tickets from CRM', len(CRM_TICKETS))
         else:
-            print(f"⚠️  CRM tickets file not found: {tickets_file}")
+            logger.warning('⚠️ CRM tickets file not found: %s', tickets_file)
             CRM_TICKETS = []
     except Exception as e:
-        print(f"❌ Failed to load CRM tickets: {str(e)}")
+        logger.error('❌ Failed to load CRM tickets: %s', e)
         CRM_TICKETS = []
 
 def save_crm_data():
     """Save CRM data back to JSON files"""
+    global CRM_FILES_STATE
+
     users_file = os.path.join(CRM_DATA_DIR, 'crm_users.json')
     tickets_file = os.path.join(CRM_DATA_DIR, 'crm_tickets.json')
 
     try:
-        with open(users_file, 'w', encoding='utf-8') as f:
-            json.dump({'users': CRM_USERS}, f, indent=2, ensure_ascii=False)
-        with open(tickets_file, 'w', encoding='utf-8') as f:
-            json.dump({'tickets': CRM_TICKETS}, f, indent=2, ensure_ascii=False)
+        write_json_atomic(users_file, {'users': CRM_USERS})
+        write_json_atomic(tickets_file, {'tickets': CRM_TICKETS})
+        CRM_FILES_STATE = _crm_files_state()
     except Exception as e:
-        print(f"❌ Failed to save CRM data: {str(e)}")
+        logger.error('❌ Failed to save CRM data: %s', e)
 
 # Task management storage
 def init_task_storage():
@@ -197,8 +2122,7 @@ def load_tasks():
 def save_tasks(data):
     """Save tasks to JSON file"""
     tasks_file = os.path.join(CRM_DATA_DIR, 'tasks.json')
-    with open(tasks_file, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+    write_json_atomic(tasks_file, data)
 
 def load_team_members():
     """Load team members from JSON file"""
@@ -213,16 +2137,57 @@ def update_team_workload(member_id, increment=1):
     """Update team member workload counter"""
     team_members_file = os.path.join(CRM_DATA_DIR, 'team_members.json')
     try:
-        team_data = load_team_members()
-        member = next((m for m in team_data['members'] if m['id'] == member_id), None)
-
-        if member:
-            member['current_workload'] = max(0, member.get('current_workload', 0) + increment)
+        with DATA_LOCK:
+            team_data = load_team_members()
+            member = next((m for m in team_data['members'] if m['id'] == member_id), None)
 
-            with open(team_members_file, 'w', encoding='utf-8') as f:
-                json.dump(team_data, f, indent=2, ensure_ascii=False)
+            if member:
+                member['current_workload'] = max(0, member.get('current_workload', 0) + increment)
+                write_json_atomic(team_members_file, team_data)
     except Exception as e:
-        print(f"⚠️ Failed to update workload for {member_id}: {str(e)}")
+        logger.warning('⚠️ Failed to update workload for %s: %s', member_id, e)
+
+# Wire formats for embeddings in tool arguments and results
+EMBEDDING_ENCODINGS = ('json', 'float32_b64', 'float16_b64')
+
+def encode_embedding(embedding, encoding='json'):
+    """Encode an embedding for a tool result: a float list, or base64 of little-endian floats"""
+    if encoding == 'json':
+        return embedding
+    if encoding == 'float32_b64':
+        packed = struct.pack(f'<{len(embedding)}f', *embedding)
+    elif encoding == 'float16_b64':
+        try:
+            packed = struct.pack(f'<{len(embedding)}e', *embedding)
+        except (struct.error, OverflowError):
+            raise ValueError('Embedding values are out of float16 range, use float32_b64')
+    else:
+        raise ValueError(f"Unknown embedding encoding '{encoding}'. Use one of: {', '.join(EMBEDDING_ENCODINGS)}")
+    return base64.b64encode(packed).decode('ascii')
+
+def decode_embedding(value, encoding=None):
+    """Decode an embedding argument (float list or base64 string) into a list of floats"""
+    if isinstance(value, list):
+        if not value or not all(isinstance(x, (int, float)) and not isinstance(x, bool) for x in value):
+            raise ValueError('Embedding must be a non-empty list of numbers')
+        return [float(x) for x in value]
+
+    if not isinstance(value, str):
+        raise ValueError('Embedding must be a list of numbers or a base64 string')
+
+    encoding = encoding or 'float32_b64'
+    sizes = {'float32_b64': ('f', 4), 'float16_b64': ('e', 2)}
+    if encoding not in sizes:
+        raise ValueError(f"Unknown embedding encoding '{encoding}' for a base64 embedding")
+    code, size = sizes[encoding]
+
+    try:
+        packed = base64.b64decode(value, validate=True)
+    except ValueError:
+        raise ValueError('Embedding is not valid base64')
+    if not packed or len(packed) % size:
+        raise ValueError(f'Embedding size {len(packed)} bytes does not match {encoding}')
+    return list(struct.unpack(f'<{len(packed) // size}{code}', packed))
 
 # Database helper utilities
 def _serialize_embedding(embedding):
@@ -248,15 +2213,176 @@ def _cosine_similarity(vec1, vec2):
 
     return dot_product / (magnitude1 * magnitude2)
 
+def embedding_cache_key(model, text):
+    """Cache key of a text: texts differing only in Unicode form or whitespace share it"""
+    normalized = ' '.join(unicodedata.normalize('NFC', text).split())
+    return hashlib.sha256(f'{model}\0{normalized}'.encode('utf-8', 'surrogatepass')).hexdigest()
+
+class EmbeddingCache:
+    """
+    Two-tier cache of computed embeddings
+
+    The memory tier is an LRU of float32 blobs bounded by memory_bytes; the
+    SQLite tier (table embedding_cache) survives restarts and is shared by
+    pre-fork workers. The model is part of the key, so vectors of another
+    model are never returned.
+    """
+
+    # Per-entry overhead of the key string and the OrderedDict slot
+    ENTRY_OVERHEAD = 200
+
+    def __init__(self):
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self._inserts = 0
+
+    def get_many(self, keys):
+        """Cached vectors for keys (None where missing)"""
+        results = [None] * len(keys)
+        missing = {}
+        with self._lock:
+            for i, key in enumerate(keys):
+                blob = self._memory.get(key)
+                if blob is None:
+                    missing.setdefault(key, []).append(i)
+                else:
+                    self._memory.move_to_end(key)
+                    results[i] = blob
+        EMBEDDING_CACHE_LOOKUPS.inc(len(keys) - sum(map(len, missing.values())), result='memory')
+
+        found = self._load(list(missing)) if missing and EMBEDDING_CACHE_CONFIG['sqlite'] else {}
+        for key, blob in found.items():
+            self._remember(key, blob)
+            for i in missing[key]:
+                results[i] = blob
+        EMBEDDING_CACHE_LOOKUPS.inc(sum(len(missing[key]) for key in found), result='sqlite')
+        EMBEDDING_CACHE_LOOKUPS.inc(sum(len(positions) for key, positions in missing.items() if key not in found),
+                                    result='miss')
+        return [_deserialize_embedding(blob) if blob is not None else None for blob in results]
+
+    def put_many(self, model, vectors):
+        """Store {key: vector} computed with model"""
+        if not vectors:
+            return
+        blobs = {key: _serialize_embedding(vector) for key, vector in vectors.items()}
+        for key, blob in blobs.items():
+            self._remember(key, blob)
+        if EMBEDDING_CACHE_CONFIG['sqlite']:
+            self._store(model, blobs)
+
+    def _remember(self, key, blob):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return
+            self._memory[key] = blob
+            self.bytes += len(blob) + self.ENTRY_OVERHEAD
+            while self.bytes > EMBEDDING_CACHE_CONFIG['memory_bytes'] and self._memory:
+                _, evicted = self._memory.popitem(last=False)
+                self.bytes -= len(evicted) + self.ENTRY_OVERHEAD
+
+    def _load(self, keys):
+        found = {}
+        try:
+            conn = connect_embeddings_db()
+            try:
+                # Stay below SQLite's limit on bound parameters
+                for start in range(0, len(keys), 500):
+                    part = keys[start:start + 500]
+                    placeholders = ','.join('?' * len(part))
+                    rows = conn.execute(f'SELECT key, embedding FROM embedding_cache WHERE key IN ({placeholders})',
+                                        part).fetchall()
+                    found.update(rows)
+                    if rows:
+                        # Recently used rows survive pruning
+                        placeholders = ','.join('?' * len(rows))
+                        conn.execute(f'UPDATE embedding_cache SET used_at = ? WHERE key IN ({placeholders})',
+                                     [time.time()] + [key for key, _ in rows])
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.warning('⚠️ Embedding cache lookup failed: %s', e)
+        return found
+
+    def _store(self, model, blobs):
+        now = time.time()
+        try:
+            conn = connect_embeddings_db()
+            try:
+                conn.executemany(
+                    'INSERT OR REPLACE INTO embedding_cache (key, model, dimensions, embedding, used_at) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    [(key, model, len(blob) // 4, blob, now) for key, blob in blobs.items()]
+                )
+                self._inserts += len(blobs)
+                if self._inserts >= EMBEDDING_CACHE_CONFIG['prune_every']:
+                    self._inserts = 0
+                    conn.execute(
+                        'DELETE FROM embedding_cache WHERE key IN (SELECT key FROM embedding_cache '
+                        'ORDER BY used_at DESC LIMIT -1 OFFSET ?)',
+                        (EMBEDDING_CACHE_CONFIG['sqlite_max_rows'],)
+                    )
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.warning('⚠️ Embedding cache write failed: %s', e)
+
+    def stats(self):
+        """Entry counts, memory use and lookups by result"""
+        lookups = {json.loads(labels)[0]: count for labels, count in EMBEDDING_CACHE_LOOKUPS.snapshot().items()}
+        total = sum(lookups.values())
+        stats = {
+            'memory_entries': len(self._memory),
+            'memory_bytes': self.bytes,
+            'memory_limit_bytes': EMBEDDING_CACHE_CONFIG['memory_bytes'],
+            'lookups': lookups,
+            'hit_rate': round((total - lookups.get('miss', 0)) / total, 4) if total else None
+        }
+        if EMBEDDING_CACHE_CONFIG['sqlite']:
+            conn = connect_embeddings_db()
+            try:
+                stats['sqlite_models'] = {model: count for model, count in conn.execute(
+                    'SELECT model, COUNT(*) FROM embedding_cache GROUP BY model')}
+            finally:
+                conn.close()
+        return stats
+
+    def clear(self, model=None):
+        """Drop cached vectors (of one model, or all); return the number of SQLite rows deleted"""
+        with self._lock:
+            # Memory keys do not reveal their model: drop the whole tier
+            self._memory.clear()
+            self.bytes = 0
+        if not EMBEDDING_CACHE_CONFIG['sqlite']:
+            return 0
+        conn = connect_embeddings_db()
+        try:
+            if model:
+                deleted = conn.execute('DELETE FROM embedding_cache WHERE model = ?', (model,)).rowcount
+            else:
+                deleted = conn.execute('DELETE FROM embedding_cache').rowcount
+            conn.commit()
+            return deleted
+        finally:
+            conn.close()
+
+EMBEDDING_CACHE = EmbeddingCache()
+EMBEDDING_CACHE_BYTES.set_function(lambda: EMBEDDING_CACHE.bytes)
+
 class EmbeddingsDatabase:
     """Helper class for embeddings database operations"""
 
     @staticmethod
     def save_document_with_embedding(content, embedding, source_file='manual_entry',
                                      source_type='manual', chunk_index=0,
-                                     page_number=None, total_chunks=1, metadata='{}'):
-        """Save document with embedding to database"""
-        conn = sqlite3.connect(EMBEDDINGS_DB_PATH)
+                                     page_number=None, total_chunks=1, metadata='{}',
+                                     provider=None):
+        """Save document with embedding (computed by provider, default: the configured one) to database"""
+        provider = provider or get_embedding_provider()
+        conn = connect_embeddings_db()
         cursor = conn.cursor()
 
         # Convert embedding to binary format
@@ -265,10 +2391,12 @@ class EmbeddingsDatabase:
         cursor.execute('''
             INSERT INTO documents
             (content, embedding, source_file, source_type, chunk_index,
-             page_number, total_chunks, metadata)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+             page_number, total_chunks, metadata,
+             embedding_provider, embedding_model, embedding_dimensions)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         ''', (content, embedding_blob, source_file, source_type,
-              chunk_index, page_number, total_chunks, metadata))
+              chunk_index, page_number, total_chunks, metadata,
+              provider.name, provider.model, len(embedding)))
 
         doc_id = cursor.lastrowid
         conn.commit()
@@ -277,108 +2405,1037 @@ class EmbeddingsDatabase:
         return doc_id
 
     @staticmethod
-    def search_similar_documents(query_embedding, limit=5):
-        """Search for similar documents using cosine similarity"""
-        conn = sqlite3.connect(EMBEDDINGS_DB_PATH)
+    def search_similar_documents(query_embedding, limit=5, provider=None):
+        """
+        Search for similar documents using cosine similarity
+
+        Only documents embedded in the query's space (provider, model and
+        dimensions) are compared. Returns (results, skipped), skipped counting
+        the other documents by 'provider:model/dimensions'.
+        """
+        provider = provider or get_embedding_provider()
+        space = (provider.name, provider.model, len(query_embedding))
+        conn = connect_embeddings_db()
         cursor = conn.cursor()
 
         # Fetch all documents
-        cursor.execute('''
-            SELECT id, content, embedding, source_file, source_type,
-                   chunk_index, page_number, total_chunks, metadata
-            FROM documents
-        ''')
+        with trace_span('db_fetch') as span:
+            cursor.execute('''
+                SELECT id, content, embedding, source_file, source_type,
+                       chunk_index, page_number, total_chunks, metadata,
+                       embedding_provider, embedding_model, embedding_dimensions
+                FROM documents
+            ''')
+            rows = cursor.fetchall()
+            span['rows'] = len(rows)
+        conn.close()
 
         results = []
+        skipped = {}
         query_emb_array = query_embedding
 
-        for row in cursor.fetchall():
-            doc_id, content, emb_blob, src_file, src_type, chunk_idx, page_num, total, meta = row
-
-            # Deserialize embedding
-            doc_embedding = _deserialize_embedding(emb_blob)
-
-            # Calculate cosine similarity
-            similarity = _cosine_similarity(query_emb_array, doc_embedding)
-
-            results.append({
-                'id': doc_id,
-                'content': content,
-                'similarity': similarity,
-                'source_file': src_file,
-                'source_type': src_type,
-                'chunk_index': chunk_idx,
-                'page_number': page_num,
-                'total_chunks': total,
-                'metadata': meta
-            })
+        with trace_span('scoring', documents=len(rows)):
+            for row in rows:
+                doc_id, content, emb_blob, src_file, src_type, chunk_idx, page_num, total, meta = row[:9]
 
-        conn.close()
+                # Vectors of another model are meaningless next to the query
+                if row[9:] != space:
+                    label = f'{row[9]}:{row[10]}/{row[11]}'
+                    skipped[label] = skipped.get(label, 0) + 1
+                    continue
+
+                # Deserialize embedding
+                doc_embedding = _deserialize_embedding(emb_blob)
+
+                # Calculate cosine similarity
+                similarity = _cosine_similarity(query_emb_array, doc_embedding)
+
+                results.append({
+                    'id': doc_id,
+                    'content': content,
+                    'similarity': similarity,
+                    'source_file': src_file,
+                    'source_type': src_type,
+                    'chunk_index': chunk_idx,
+                    'page_number': page_num,
+                    'total_chunks': total,
+                    'metadata': meta
+                })
 
         # Sort by similarity descending
-        results.sort(key=lambda x: x['similarity'], reverse=True)
+        with trace_span('ranking', limit=limit):
+            results.sort(key=lambda x: x['similarity'], reverse=True)
 
-        return results[:limit]
+        return results[:limit], skipped
 
     @staticmethod
     def count_documents():
         """Get total document count"""
-        conn = sqlite3.connect(EMBEDDINGS_DB_PATH)
+        conn = connect_embeddings_db()
         cursor = conn.cursor()
         cursor.execute('SELECT COUNT(*) FROM documents')
         count = cursor.fetchone()[0]
         conn.close()
         return count
 
+class JobContext(RequestContext):
+    """Context of a tool call running as a background job: progress goes to the jobs table"""
+
+    def __init__(self, manager, job_id):
+        super().__init__(request_id=job_id, progress_token=job_id, notify=self._record_progress)
+        self.manager = manager
+        self.job_id = job_id
+        self.latest = None
+        self._last_write = 0
+        self._last_poll = 0
+
+    def _record_progress(self, message):
+        params = message['params']
+        self.latest = params
+        # Throttled: chunk loops report far more often than anyone polls
+        now = time.monotonic()
+        if now - self._last_write >= JOB_CONFIG['progress_interval']:
+            self._last_write = now
+            self.manager.update_progress(self.job_id, params)
+
+    def is_cancelled(self):
+        """Check for cancellation, including cancel_job calls served by other processes"""
+        if not self.cancel_event.is_set():
+            now = time.monotonic()
+            if now - self._last_poll >= JOB_CONFIG['progress_interval']:
+                self._last_poll = now
+                if self.manager.cancel_requested(self.job_id):
+                    self.cancel_event.set()
+        return super().is_cancelled()
+
+class JobManager:
+    """
+    Runs long tool calls in the background and tracks them in the jobs table
+
+    Job rows live in the embeddings database, so their status survives a
+    restart and is visible to every pre-fork worker. Jobs that were queued
+    or running when their process died are marked as interrupted.
+    """
+
+    FINISHED_STATUSES = ('succeeded', 'failed', 'cancelled', 'interrupted')
+
+    def __init__(self):
+        self._executor = None
+        self._lock = threading.Lock()
+        self._futures = {}   # job_id -> Future of jobs owned by this process
+        self._contexts = {}  # job_id -> JobContext of jobs owned by this process
+
+    def _get_executor(self):
+        # Created lazily so that pre-fork workers each start their own threads
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=JOB_CONFIG['workers'],
+                    thread_name_prefix='mcp-job'
+                )
+            return self._executor
+
+    @staticmethod
+    def _now():
+        return datetime.now().isoformat(timespec='seconds')
+
+    def _execute(self, sql, params=()):
+        conn = connect_embeddings_db()
+        try:
+            cursor = conn.execute(sql, params)
+            conn.commit()
+            return cursor.rowcount
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _row_to_job(row):
+        job = dict(row)
+        job['job_id'] = job.pop('id')
+        job['cancel_requested'] = bool(job['cancel_requested'])
+        if job['result'] is not None:
+            job['result'] = json.loads(job['result'])
+        return job
+
+    def submit(self, handler, tool_name, arguments, run=None, cleanup=None):
+        """Queue a tool call and return its job record
+
+        run replaces the registered tool handler (called with the arguments);
+        cleanup is called once the job is over, whether or not it ran.
+        """
+        job_id = uuid.uuid4().hex
+        arguments = {key: value for key, value in arguments.items() if key != 'async'}
+        now = self._now()
+        self._execute('''
+            INSERT INTO jobs (id, tool, label, status, owner_pid, created_at, updated_at)
+            VALUES (?, ?, ?, 'queued', ?, ?, ?)
+        ''', (job_id, tool_name, arguments.get('filename'), os.getpid(), now, now))
+
+        context = JobContext(self, job_id)
+        executor = self._get_executor()
+        # Registered under the lock so _run cannot finish before the job is tracked
+        with self._lock:
+            self._contexts[job_id] = context
+            self._futures[job_id] = executor.submit(self._run, handler, tool_name, arguments, context,
+                                                    run, cleanup)
+        return self.get(job_id)
+
+    def queue_depth(self):
+        """Jobs submitted by this process that have not started yet"""
+        with self._lock:
+            return sum(1 for future in self._futures.values() if not future.running() and not future.done())
+
+    def _run(self, handler, tool_name, arguments, context, run=None, cleanup=None):
+        job_id = context.job_id
+        result = error = None
+        run = run or TOOL_REGISTRY[tool_name].bind(handler)
+
+        if self.cancel_requested(job_id):
+            status = 'cancelled'
+        else:
+            self._execute("UPDATE jobs SET status = 'running', started_at = ?, updated_at = ? WHERE id = ?",
+                          (self._now(), self._now(), job_id))
+            token = _request_context.set(context)
+            log_token = _log_fields.set({'tool': tool_name, 'request_id': f'job:{job_id}', 'sampled': True})
+            try:
+                result = run(arguments)
+                if context.is_cancelled() or self.cancel_requested(job_id):
+                    status = 'cancelled'
+                elif isinstance(result, dict) and result.get('success') is False:
+                    status = 'failed'
+                    error = result.get('error')
+                else:
+                    status = 'succeeded'
+            except Exception as e:
+                status = 'failed'
+                error = str(e)
+            finally:
+                _request_context.reset(token)
+                _log_fields.reset(log_token)
+
+        if cleanup is not None:
+            cleanup()
+        self._finish(job_id, status, result=result, error=error, progress=context.latest)
+        with self._lock:
+            self._futures.pop(job_id, None)
+            self._contexts.pop(job_id, None)
+
+    def _finish(self, job_id, status, result=None, error=None, progress=None):
+        progress = progress or {}
+        now = self._now()
+        self._execute('''
+            UPDATE jobs
+            SET status = ?, result = ?, error = ?, finished_at = ?, updated_at = ?,
+                progress = COALESCE(?, progress), total = COALESCE(?, total),
+                message = COALESCE(?, message)
+            WHERE id = ?
+        ''', (status, json.dumps(result, ensure_ascii=False) if result is not None else None,
+              error, now, now, progress.get('progress'), progress.get('total'),
+              progress.get('message'), job_id))
+
+    def update_progress(self, job_id, params):
+        """Store the latest progress report of a running job"""
+        self._execute('UPDATE jobs SET progress = ?, total = ?, message = ?, updated_at = ? WHERE id = ?',
+                      (params.get('progress'), params.get('total'), params.get('message'),
+                       self._now(), job_id))
+
+    def cancel_requested(self, job_id):
+        """Check the cancellation flag of a job"""
+        conn = connect_embeddings_db()
+        try:
+            row = conn.execute('SELECT cancel_requested FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        finally:
+            conn.close()
+        return bool(row and row[0])
+
+    def get(self, job_id):
+        """Return a job record, or None if it does not exist"""
+        conn = connect_embeddings_db()
+        conn.row_factory = sqlite3.Row
+        try:
+            row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        finally:
+            conn.close()
+        return self._row_to_job(row) if row else None
+
+    def list(self, status=None, tool=None, limit=20):
+        """Return the most recent jobs, optionally filtered"""
+        query = 'SELECT * FROM jobs'
+        conditions, params = [], []
+        if status:
+            conditions.append('status = ?')
+            params.append(status)
+        if tool:
+            conditions.append('tool = ?')
+            params.append(tool)
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY created_at DESC, rowid DESC LIMIT ?'
+        params.append(limit)
+
+        conn = connect_embeddings_db()
+        conn.row_factory = sqlite3.Row
+        try:
+            rows = conn.execute(query, params).fetchall()
+        finally:
+            conn.close()
+        jobs = [self._row_to_job(row) for row in rows]
+        # Listings stay small: results are fetched per job with get_job_status
+        for job in jobs:
+            job.pop('result')
+        return jobs
+
+    def cancel(self, job_id):
+        """Request cancellation of a job; returns the updated record or None"""
+        job = self.get(job_id)
+        if job is None or job['status'] in self.FINISHED_STATUSES:
+            return job
+
+        self._execute('UPDATE jobs SET cancel_requested = 1, updated_at = ? WHERE id = ?',
+                      (self._now(), job_id))
+        with self._lock:
+            future = self._futures.get(job_id)
+            context = self._contexts.get(job_id)
+
+        if future is not None and future.cancel():
+            # Never started: finish it here since _run will not
+            self._finish(job_id, 'cancelled')
+            with self._lock:
+                self._futures.pop(job_id, None)
+                self._contexts.pop(job_id, None)
+        elif context is not None:
+            context.cancel()
+        # Jobs owned by another worker process notice the flag at their next check
+        return self.get(job_id)
+
+    def mark_interrupted(self, owner_pid=None):
+        """Mark unfinished jobs (of one process, or all) as interrupted"""
+        query = '''
+            UPDATE jobs SET status = 'interrupted', error = ?, finished_at = ?, updated_at = ?
+            WHERE status IN ('queued', 'running')
+        '''
+        now = self._now()
+        params = ['Server stopped before the job finished', now, now]
+        if owner_pid is not None:
+            query += ' AND owner_pid = ?'
+            params.append(owner_pid)
+        return self._execute(query, params)
+
+    def recover(self):
+        """Clean up after a restart: interrupt orphaned jobs and purge old ones"""
+        interrupted = self.mark_interrupted()
+        cutoff = (datetime.now() - timedelta(days=JOB_CONFIG['retention_days'])).isoformat(timespec='seconds')
+        purged = self._execute(
+            f"DELETE FROM jobs WHERE status IN ({', '.join('?' * len(self.FINISHED_STATUSES))}) AND finished_at < ?",
+            (*self.FINISHED_STATUSES, cutoff)
+        )
+        if interrupted or purged:
+            logger.info('🧹 Jobs: %s marked interrupted, %s old jobs purged', interrupted, purged)
+
+JOB_MANAGER = JobManager()
+JOBS_QUEUED.set_function(JOB_MANAGER.queue_depth)
+
+class ToolSpec:
+    """Registered MCP tool: handler, schema and the metadata used by dispatch"""
+
+    def __init__(self, name, handler, description, input_schema, timeout, concurrency,
+                 cacheable, mutates, admin=False):
+        self.name = name
+        self.handler = handler
+        self.description = description
+        self.input_schema = input_schema
+        self.timeout = timeout            # Default deadline in seconds (None: no deadline)
+        self.concurrency = concurrency    # Admission control class (None: unlimited)
+        self.cacheable = cacheable        # Same arguments give the same result for a while
+        self.mutates = mutates            # Changes stored state
+        self.admin = admin                # Needs the admin token; not listed in tools/list
+
+    def bind(self, handler):
+        """Handler method of a server instance (looked up by name, so overrides apply)"""
+        return getattr(handler, self.handler.__name__)
+
+    def schema(self):
+        """Tool description as sent in tools/list"""
+        return {
+            'name': self.name,
+            'description': self.description,
+            'inputSchema': self.input_schema
+        }
+
+# Registered tools, in tools/list order: name -> ToolSpec
+TOOL_REGISTRY = {}
+
+# Tool profiles: named subsets of the catalogue a client can select (no profile: every tool)
+TOOL_PROFILES = {
+    'support': [
+        'get_ticket', 'list_user_tickets', 'create_ticket', 'update_ticket', 'list_users',
+        'semantic_search'
+    ],
+    'dev-assistant': [
+        'get_repo', 'search_code', 'create_issue', 'list_issues', 'list_commits', 'get_repo_content',
+        'get_pull_request', 'get_pr_files', 'git_status', 'git_branch', 'git_diff', 'git_pr_status',
+        'semantic_search'
+    ],
+    'team': [
+        'create_task', 'list_tasks', 'update_task', 'get_task', 'get_team_workload',
+        'search_similar_tasks', 'list_users'
+    ],
+    'rag': [
+        'create_embedding', 'save_document', 'search_similar', 'semantic_search', 'process_pdf',
+        'process_text_chunks', 'get_job_status', 'cancel_job', 'list_jobs'
+    ]
+}
+
+# Serialized tools/list catalogue per profile, dropped whenever a tool is registered
+_tools_list_cache = {}
+
+def mcp_tool(name, description, input_schema, timeout=30, concurrency=None, cacheable=False,
+             mutates=False, admin=False):
+    """Register a handler method as an MCP tool"""
+    def decorator(func):
+        TOOL_REGISTRY[name] = ToolSpec(name, func, description, input_schema, timeout, concurrency,
+                                       cacheable, mutates, admin)
+        _tools_list_cache.clear()
+        return func
+    return decorator
+
+def normalize_profile(name):
+    """Validate a profile name; None (or 'all') selects every tool"""
+    if not name or name == 'all':
+        return None
+    if name not in TOOL_PROFILES:
+        available = ', '.join(['all'] + list(TOOL_PROFILES))
+        raise ValueError(f"Unknown tool profile '{name}'. Available profiles: {available}")
+    return name
+
+def profile_allows(profile, tool_name):
+    """Check whether a tool is exposed in a profile"""
+    return profile is None or tool_name in TOOL_PROFILES[profile]
+
+def make_session_id(profile):
+    """Stateless session id: the profile travels inside it, so any worker can serve the session"""
+    return f"{profile or 'all'}.{uuid.uuid4().hex}"
+
+def tools_list_catalogue(profile=None):
+    """Return (tool schemas, their serialized JSON, ETag) of a profile, computed once per registry state"""
+    catalogue = _tools_list_cache.get(profile)
+    if catalogue is None:
+        tools = [spec.schema() for spec in TOOL_REGISTRY.values()
+                 if not spec.admin and profile_allows(profile, spec.name)]
+        body = encode_json(tools)
+        etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+        catalogue = (tools, body, etag)
+        _tools_list_cache[profile] = catalogue
+    return catalogue
+
+def etag_matches(if_none_match, etag):
+    """Check an If-None-Match header against an ETag (weak comparison)"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate == '*' or candidate.removeprefix('W/') == etag:
+            return True
+    return False
+
+class ConcurrencyLimiter:
+    """Bounds the number of concurrent tool calls per concurrency class"""
+
+    def __init__(self, limits):
+        self.limits = limits
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def _semaphore(self, name):
+        limit = self.limits.get(name) if name else None
+        if not limit:
+            return None
+        with self._lock:
+            if name not in self._semaphores:
+                self._semaphores[name] = threading.BoundedSemaphore(limit)
+            return self._semaphores[name]
+
+    @contextlib.contextmanager
+    def slot(self, name, timeout):
+        """Hold a slot of the class for the duration of a call, or raise ServerBusy"""
+        semaphore = self._semaphore(name)
+        if semaphore is None:
+            yield
+            return
+        if not semaphore.acquire(timeout=timeout):
+            raise ServerBusy(f'Too many concurrent {name} calls, retry later')
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+TOOL_LIMITER = ConcurrencyLimiter(CONCURRENCY_CONFIG['limits'])
+
 class MCPServerHandler(BaseHTTPRequestHandler):
-    
-    def log(self, message):
-        """Custom logging"""
-        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        print(f'[{timestamp}] {message}')
-    
+
+    # Persistent connections: every response carries Content-Length (or chunked framing)
+    protocol_version = 'HTTP/1.1'
+    # Socket timeout; an idle keep-alive connection is closed after this many seconds
+    timeout = HTTP_CONFIG['idle_timeout']
+    # Tool profile of the request being served, and a session id issued by initialize
+    profile = None
+    session_id = None
+    # Result format requested with the X-MCP-Result-Format header (tools/call _meta.resultFormat wins)
+    result_format = None
+    # Trace every tools/call of the request (X-MCP-Trace header; _meta.trace traces a single call)
+    trace_requested = False
+
+    def log(self, message, *args, level=None):
+        """Log a server event; args are formatted by the log writer thread, not the request thread"""
+        if level is None:
+            level = next((marker_level for marker, marker_level in LOG_LEVEL_MARKERS
+                          if message.startswith(marker)), logging.INFO)
+        logger.log(level, message, *args)
+
+    def handle(self):
+        """Serve requests on one connection until it is closed"""
+        self.requests_on_connection = 0
+        super().handle()
+
+    def parse_request(self):
+        """Parse request line and headers, tracking per-connection usage"""
+        # Until the body is read, an error response must close the connection
+        self.body_consumed = False
+        if not super().parse_request():
+            return False
+
+        self.requests_on_connection += 1
+        try:
+            content_length = self.content_length()
+        except HTTPRequestError as e:
+            # The body cannot be delimited, so the connection cannot be reused
+            self.close_connection = True
+            self.send_error(e.status, str(e))
+            return False
+        has_body = 'Transfer-Encoding' in self.headers or (content_length or 0) > 0
+        self.body_consumed = not has_body
+        return True
+
+    def content_length(self):
+        """Content-Length of the request as a non-negative int (None without the header)"""
+        value = self.headers.get('Content-Length')
+        if value is None:
+            return None
+        value = value.strip()
+        # int() would also take '+5', '-1' and '1_000'
+        if not (value.isascii() and value.isdigit()):
+            raise HTTPRequestError(400, 'Invalid Content-Length')
+        return int(value)
+
+    def send_response(self, code, message=None):
+        """Send status line and connection management headers"""
+        super().send_response(code, message)
+
+        if self.should_close_connection():
+            self.send_header('Connection', 'close')
+        elif self.request_version == 'HTTP/1.1':
+            self.send_header('Keep-Alive', f"timeout={HTTP_CONFIG['idle_timeout']}")
+
+    def should_close_connection(self):
+        """Decide whether this response is the last one on the connection"""
+        if self.close_connection or not getattr(self, 'body_consumed', False):
+            return True
+        if getattr(self, 'requests_on_connection', 0) >= HTTP_CONFIG['max_requests_per_connection']:
+            return True
+        # Free the worker for connections waiting in the accept queue
+        pending = getattr(self.server, 'pending', None)
+        return pending is not None and pending.qsize() > 0
+
+    def send_error(self, code, message=None, explain=None):
+        """Send an error as a JSON-RPC body with explicit Content-Length"""
+        self.log_error("code %d, message %s", code, message)
+
+        body = json.dumps({
+            'jsonrpc': '2.0',
+            'id': None,
+            'error': {
+                'code': -32000,
+                'message': message or self.responses.get(code, ('Error',))[0]
+            }
+        }, ensure_ascii=False).encode('utf-8')
+
+        # Exception text may not be latin-1, so it goes into the body, not the status line
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+
+        if self.command != 'HEAD' and code >= 200 and code not in (204, 304):
+            self.wfile.write(body)
+
+    def iter_body(self, limit, block_size=64 * 1024):
+        """Yield the request body (Content-Length or chunked framing) in blocks of at most block_size bytes"""
+        transfer_encoding = self.headers.get('Transfer-Encoding', '').lower()
+
+        if transfer_encoding:
+            if transfer_encoding != 'chunked':
+                raise HTTPRequestError(501, f'Unsupported Transfer-Encoding: {transfer_encoding}')
+
+            total = 0
+            while True:
+                size_line = self.rfile.readline(1024)
+                try:
+                    size = int(size_line.split(b';', 1)[0].strip(), 16)
+                except ValueError:
+                    raise HTTPRequestError(400, 'Malformed chunked body')
+
+                if size == 0:
+                    # Skip optional trailers up to the final empty line
+                    while self.rfile.readline(1024) not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+
+                total += size
+                if total > limit:
+                    raise HTTPRequestError(413, f'Request body exceeds {limit} bytes')
+                remaining = size
+                while remaining:
+                    block = self.rfile.read(min(remaining, block_size))
+                    if not block:
+                        raise HTTPRequestError(400, 'Request body ended early')
+                    remaining -= len(block)
+                    yield block
+                self.rfile.readline(3)  # CRLF after chunk data
+
+            self.body_consumed = True
+            return
+
+        content_length = self.content_length()
+        if content_length is None:
+            raise HTTPRequestError(411, 'Content-Length required')
+        if content_length > limit:
+            raise HTTPRequestError(413, f'Request body exceeds {limit} bytes')
+
+        remaining = content_length
+        while remaining:
+            block = self.rfile.read(min(remaining, block_size))
+            if not block:
+                raise HTTPRequestError(400, 'Request body ended early')
+            remaining -= len(block)
+            yield block
+        self.body_consumed = True
+
+    def read_body(self):
+        """Read the whole request body framed by Content-Length or chunked transfer coding"""
+        limit = HTTP_CONFIG['max_body_bytes']
+        return b''.join(self.iter_body(limit, block_size=limit))
+
+    def decode_body(self, body):
+        """Undo Content-Encoding (gzip/deflate) of a request body"""
+        encoding = self.headers.get('Content-Encoding', '').strip().lower()
+        if encoding in ('', 'identity'):
+            return body
+
+        decoded = decompress_body(body, encoding, HTTP_CONFIG['max_decompressed_bytes'])
+        self.log(f"🗜️ Request body {encoding}: {len(body)} → {len(decoded)} bytes")
+        return decoded
+
+    def send_body(self, status, body, headers=None, content_type='application/json'):
+        """Send a response body, compressed when it is large and the client accepts it"""
+        headers = dict(headers or {})
+        headers['Vary'] = 'Accept-Encoding'
+
+        encoding = None
+        if len(body) >= HTTP_CONFIG['compress_min_bytes']:
+            encoding = choose_content_encoding(self.headers.get('Accept-Encoding'))
+        if encoding:
+            body = compress_body(body, encoding)
+            headers['Content-Encoding'] = encoding
+            if 'ETag' in headers and not headers['ETag'].startswith('W/'):
+                # Same entity, different bytes: only weakly equal to the identity response
+                headers['ETag'] = 'W/' + headers['ETag']
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+
+        self.wfile.write(body)
+
+    def send_json(self, status, payload, headers=None):
+        """Send a JSON response with Content-Length framing"""
+        self.send_body(status, encode_json(payload), headers)
+
+    def send_tools_list(self, request_id):
+        """Send the pre-serialized tools/list response, or 304 if the client's copy is current"""
+        tools, body, etag = tools_list_catalogue(self.profile)
+
+        if etag_matches(self.headers.get('If-None-Match'), etag):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Vary', 'Accept-Encoding')
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.send_header('Access-Control-Expose-Headers', 'ETag')
+            self.end_headers()
+            self.log(f"✅ Tool catalogue unchanged (304)")
+            return
+
+        # Only the id differs between responses; the catalogue bytes are reused as they are
+        payload = b''.join([
+            b'{"jsonrpc":"2.0","id":', encode_json(request_id),
+            b',"result":{"tools":', body, b'}}'
+        ])
+        self.send_body(200, payload, {
+            'ETag': etag,
+            'Cache-Control': 'no-cache',
+            'Access-Control-Expose-Headers': 'ETag'
+        })
+        self.log(f"✅ Response sent successfully")
+
+    def wants_event_stream(self, request):
+        """Use SSE when the client accepts it and asked for progress on a tool call"""
+        if 'text/event-stream' not in self.headers.get('Accept', ''):
+            return False
+
+        calls = request if isinstance(request, list) else [request]
+        for call in calls:
+            if not isinstance(call, dict) or call.get('method') != 'tools/call':
+                continue
+            params = call.get('params')
+            meta = params.get('_meta') if isinstance(params, dict) else None
+            if isinstance(meta, dict) and meta.get('progressToken') is not None:
+                return True
+        return False
+
+    def start_event_stream(self):
+        """Send headers for a Server-Sent Events response"""
+        self.stream_lock = threading.Lock()
+        self.stream_broken = False
+        self.stream_chunked = self.request_version == 'HTTP/1.1'
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        if self.stream_chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            # HTTP/1.0 has no chunked coding: the end of the stream is the end of the connection
+            self.send_header('Connection', 'close')
+        self.end_headers()
+
+    def send_event(self, message):
+        """Write one JSON-RPC message as an SSE event"""
+        data = b'event: message\ndata: ' + encode_json(message) + b'\n\n'
+        with self.stream_lock:
+            if self.stream_broken:
+                return
+            try:
+                if self.stream_chunked:
+                    data = f'{len(data):X}\r\n'.encode('ascii') + data + b'\r\n'
+                self.wfile.write(data)
+                self.wfile.flush()
+            except OSError:
+                # Client went away: nothing more is sent and the call has nobody to answer
+                self.stream_broken = True
+                self.close_connection = True
+                context = _request_context.get()
+                if context is not None:
+                    context.cancel()
+
+    def end_event_stream(self):
+        """Terminate the SSE response"""
+        with self.stream_lock:
+            if self.stream_chunked and not self.stream_broken:
+                try:
+                    self.wfile.write(b'0\r\n\r\n')
+                except OSError:
+                    self.close_connection = True
+
+    def serve_event_stream(self, request):
+        """Execute the request while streaming progress notifications, then the response"""
+        self.start_event_stream()
+        token = _event_stream.set(self.send_event)
+        try:
+            if isinstance(request, list):
+                response = self.handle_batch_request(request)
+            else:
+                response = self.handle_mcp_request(request)
+        except Exception as e:
+            self.log(f"❌ Error: {str(e)}")
+            response = self._error_response(None, -32603, f'Internal error: {str(e)}')
+        finally:
+            _event_stream.reset(token)
+
+        if response is not None:
+            self.send_event(response)
+        self.end_event_stream()
+        self.log(f"✅ Event stream completed")
+
+    def do_GET(self):
+        """Serve /metrics; server-initiated SSE streams are not offered (Streamable HTTP allows 405)"""
+        if urllib.parse.urlsplit(self.path).path == METRICS_CONFIG['path']:
+            self.send_body(200, collect_metrics().encode('utf-8'),
+                           content_type='text/plain; version=0.0.4; charset=utf-8')
+            return
+
+        self.send_response(405)
+        self.send_header('Allow', 'POST, OPTIONS')
+        self.send_header('Content-Length', '0')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+
     def do_POST(self):
         """Handle POST requests"""
-        content_length = int(self.headers['Content-Length'])
-        post_data = self.rfile.read(content_length)
-        
+        with HTTP_IN_FLIGHT.track():
+            self.handle_post()
+
+    def handle_post(self):
+        """Route a POST to the upload endpoint or the JSON-RPC endpoint"""
+        if urllib.parse.urlsplit(self.path).path == UPLOAD_CONFIG['path']:
+            self.handle_upload()
+            return
+
+        try:
+            post_data = self.decode_body(self.read_body())
+        except HTTPRequestError as e:
+            self.log(f"❌ Bad request body: {str(e)}")
+            # Whatever is left of the body cannot be skipped reliably
+            self.body_consumed = False
+            self.send_error(e.status, str(e))
+            return
+
         try:
             request = json.loads(post_data.decode('utf-8'))
-            self.log(f"📨 Received request: {request.get('method')}")
-            
-            response = self.handle_mcp_request(request)
-            
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.end_headers()
-            
-            self.wfile.write(json.dumps(response).encode('utf-8'))
+        except ValueError as e:
+            self.log(f"❌ Invalid JSON: {str(e)}")
+            self.send_json(400, self._error_response(None, -32700, f'Parse error: {str(e)}'))
+            return
+
+        try:
+            self.profile = self.resolve_profile()
+        except ValueError as e:
+            self.log(f"❌ {str(e)}")
+            self.send_json(400, self._error_response(None, -32602, str(e)))
+            return
+        self.session_id = None
+        self.result_format = self.headers.get('X-MCP-Result-Format')
+        self.trace_requested = self.headers.get('X-MCP-Trace', '').strip().lower() in ('1', 'true', 'yes')
+
+        if self.wants_event_stream(request):
+            self.log(f"📡 Streaming response with progress notifications")
+            self.serve_event_stream(request)
+            return
+
+        if isinstance(request, dict) and request.get('method') == 'tools/list' and 'id' in request:
+            self.log(f"📨 Received request: tools/list")
+            REQUESTS_TOTAL.inc(method='tools/list')
+            with REQUEST_SECONDS.time(method='tools/list'):
+                self.send_tools_list(request['id'])
+            return
+
+        try:
+            if isinstance(request, list):
+                self.log(f"📨 Received batch: {len(request)} requests")
+                response = self.handle_batch_request(request)
+            else:
+                self.log(f"📨 Received request: {request.get('method')}")
+                response = self.handle_mcp_request(request)
+
+            if response is None:
+                # Batch made only of notifications: nothing to return
+                self.send_response(202)
+                self.send_header('Content-Length', '0')
+                self.send_header('Access-Control-Allow-Origin', '*')
+                self.end_headers()
+                self.log(f"✅ Notifications accepted")
+                return
+
+            headers = None
+            if self.session_id:
+                headers = {'Mcp-Session-Id': self.session_id, 'Access-Control-Expose-Headers': 'Mcp-Session-Id'}
+            self.send_json(200, response, headers)
             self.log(f"✅ Response sent successfully")
-            
+
         except Exception as e:
             self.log(f"❌ Error: {str(e)}")
             self.send_error(500, str(e))
-    
+
+    def is_admin(self):
+        """Whether the request carries the configured admin token"""
+        token = ADMIN_CONFIG['token']
+        supplied = self.headers.get('X-MCP-Admin-Token') if getattr(self, 'headers', None) else None
+        return bool(token and supplied) and hmac.compare_digest(supplied.encode('utf-8'), token.encode('utf-8'))
+
+    def resolve_profile(self):
+        """Tool profile of this request: X-MCP-Profile header, ?profile= or the Mcp-Session-Id"""
+        name = self.headers.get('X-MCP-Profile')
+        if not name:
+            query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+            name = (query.get('profile') or [None])[0]
+        if not name:
+            session_id = self.headers.get('Mcp-Session-Id')
+            if session_id:
+                name = session_id.rsplit('.', 1)[0]
+        return normalize_profile(name)
+
+    def handle_upload(self):
+        """
+        Ingest a raw document body: POST /upload
+
+        The body is a PDF (application/pdf) or text (text/plain, text/markdown)
+        named by the X-Filename header. It is streamed to a temporary file in
+        bounded blocks and pdfplumber reads it from there, so neither the raw
+        body nor a base64 copy is held in memory (the extracted text and its
+        chunks still are). Query options: chunk_size, chunk_overlap, async=1
+        (run as a background job).
+        """
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+        content_type = self.headers.get('Content-Type', '').split(';', 1)[0].strip().lower()
+        tool_name = UPLOAD_CONFIG['content_types'].get(content_type)
+
+        try:
+            if tool_name is None:
+                raise HTTPRequestError(415, f"Unsupported upload Content-Type: {content_type or 'none'} "
+                                            f"(send the raw document as {', '.join(UPLOAD_CONFIG['content_types'])})")
+            try:
+                self.profile = self.resolve_profile()
+                arguments = {
+                    'filename': self.upload_filename(tool_name),
+                    'chunk_size': int((query.get('chunk_size') or [1000])[0]),
+                    'chunk_overlap': int((query.get('chunk_overlap') or [200])[0])
+                }
+            except ValueError as e:
+                raise HTTPRequestError(400, str(e))
+            if not profile_allows(self.profile, tool_name):
+                raise HTTPRequestError(403, f"Tool '{tool_name}' is not available in profile '{self.profile}'")
+
+            path, size = self.receive_upload(os.path.splitext(arguments['filename'])[1])
+        except HTTPRequestError as e:
+            self.log(f"❌ Upload rejected: {str(e)}")
+            # Whatever is left of the body cannot be skipped reliably
+            self.body_consumed = False
+            self.send_error(e.status, str(e))
+            return
+
+        self.log(f"📥 Received upload {arguments['filename']}: {size} bytes → {tool_name}")
+
+        def remove_upload():
+            with contextlib.suppress(OSError):
+                os.unlink(path)
+
+        run = functools.partial(self.ingest_upload, tool_name, path)
+
+        if (query.get('async') or [''])[0].lower() in ('1', 'true', 'yes'):
+            job = JOB_MANAGER.submit(self, tool_name, arguments, run=run, cleanup=remove_upload)
+            self.log(f"🧵 Started job {job['job_id']} for uploaded {arguments['filename']}")
+            self.send_json(202, {
+                'success': True,
+                'job_id': job['job_id'],
+                'status': job['status'],
+                'tool': tool_name,
+                'bytes': size,
+                'message': 'Job started. Poll get_job_status for progress and result.'
+            })
+            return
+
+        # Same bookkeeping as tools/call; X-MCP-Request-Id makes the upload cancellable
+        self.trace_requested = self.headers.get('X-MCP-Trace', '').strip().lower() in ('1', 'true', 'yes')
+        with self.tool_call(self.headers.get('X-MCP-Request-Id'), tool_name, arguments, {}) as call:
+            try:
+                result = self.run_tool(call, TOOL_REGISTRY[tool_name], functools.partial(run, arguments))
+            except ServerBusy as e:
+                call.status = 'aborted'
+                self.send_error(503, str(e))
+                return
+            except RequestAborted as e:
+                call.status = 'aborted'
+                self.log(f"🛑 Upload {arguments['filename']} stopped: {str(e)}")
+                self.send_json(504 if isinstance(e, DeadlineExceeded) else 409,
+                               {'success': False, 'error': str(e), 'code': e.code, 'partial': e.data})
+                return
+            except Exception as e:
+                self.log(f"❌ Error: {str(e)}")
+                self.send_error(500, str(e))
+                return
+            finally:
+                remove_upload()
+
+            self.log("✨ Upload result: %s", LazyPreview(result), level=logging.DEBUG)
+            self.send_json(200, result)
+
+    def upload_filename(self, tool_name):
+        """Document name from the X-Filename header (percent-encoded for non-ASCII names)"""
+        filename = urllib.parse.unquote(self.headers.get('X-Filename', '')).strip()
+        # Only the base name is kept: it labels chunks, it is never used as a path
+        filename = re.split(r'[\\/]', filename)[-1]
+        if not filename:
+            filename = 'document.pdf' if tool_name == 'process_pdf' else 'document.txt'
+        return filename
+
+    def receive_upload(self, suffix):
+        """Stream the request body into a temporary file; return (path, size)"""
+        limit = HTTP_CONFIG['max_upload_bytes']
+        block_size = HTTP_CONFIG['upload_block_bytes']
+        blocks = self.iter_body(limit, block_size)
+
+        encoding = self.headers.get('Content-Encoding', '').strip().lower()
+        if encoding not in ('', 'identity'):
+            blocks = iter_decompressed(blocks, encoding, limit, block_size)
+
+        fd, path = tempfile.mkstemp(prefix='mcp-upload-', suffix=suffix[:16], dir=UPLOAD_CONFIG['dir'])
+        size = 0
+        try:
+            with os.fdopen(fd, 'wb') as upload:
+                for block in blocks:
+                    upload.write(block)
+                    size += len(block)
+        except BaseException:
+            os.unlink(path)
+            raise
+        return path, size
+
+    def ingest_upload(self, tool_name, path, args):
+        """Run the ingestion tool on an uploaded file"""
+        if tool_name == 'process_pdf':
+            return self.process_pdf_file(path, args['filename'], args['chunk_size'], args['chunk_overlap'])
+
+        # Chunking needs the whole text, but only one copy of it
+        with open(path, encoding='utf-8', errors='replace') as upload:
+            text = upload.read()
+        return self.tool_process_text_chunks(dict(args, text=text))
+
     def do_OPTIONS(self):
         """Handle CORS preflight"""
         self.send_response(200)
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Content-Encoding, If-None-Match, X-MCP-Profile, Mcp-Session-Id, X-MCP-Result-Format, X-MCP-Trace, X-MCP-Admin-Token, X-Filename, X-MCP-Request-Id')
+        self.send_header('Content-Length', '0')
         self.end_headers()
-    
+
     def handle_mcp_request(self, request):
         """Process MCP JSON-RPC request"""
         method = request.get('method')
+        label = method if method in METRIC_METHODS else 'other'
+        REQUESTS_TOTAL.inc(method=label)
+        with REQUEST_SECONDS.time(method=label):
+            return self.dispatch_mcp_request(request)
+
+    def dispatch_mcp_request(self, request):
+        """Route a JSON-RPC request to the handler of its method"""
+        method = request.get('method')
         request_id = request.get('id')
         
         if method == 'initialize':
-            return self.handle_initialize(request_id)
+            return self.handle_initialize(request_id, request.get('params') or {})
         elif method == 'tools/list':
             return self.handle_tools_list(request_id)
         elif method == 'tools/call':
             return self.handle_tools_call(request_id, request.get('params', {}))
+        elif method == 'notifications/cancelled':
+            self.handle_cancelled(request.get('params') or {})
+            return None
         else:
             return {
                 'jsonrpc': '2.0',
@@ -389,8 +3446,127 @@ class MCPServerHandler(BaseHTTPRequestHandler):
                 }
             }
     
-    def handle_initialize(self, request_id):
+    def handle_batch_request(self, requests):
+        """
+        Process a JSON-RPC 2.0 batch
+
+        Calls run concurrently on the shared batch pool, except calls to tools
+        that mutate state: those run one after another in batch order.
+        Identical calls to cacheable tools are executed once. initialize
+        members run first, before anything else is dispatched, so every call
+        of the batch sees the same profile. Each call gets its own response
+        (or error) in request order; notifications get none. Returns None when
+        there is nothing to send back.
+        """
+        if not requests:
+            return self._error_response(None, -32600, 'Invalid Request: empty batch')
+
+        if len(requests) > BATCH_CONFIG['max_size']:
+            return self._error_response(
+                None, -32600, f"Invalid Request: batch exceeds {BATCH_CONFIG['max_size']} calls"
+            )
+
+        # initialize changes the profile the other calls are checked against: settle it before they run
+        initialized = {}
+        for position, request in enumerate(requests):
+            if isinstance(request, dict) and request.get('method') == 'initialize':
+                initialized[position] = future = Future()
+                future.set_result(self._run_batch_call(request))
+
+        executor = get_batch_executor()
+        slots = []       # error response, or (request, future, index in the mutating sequence)
+        mutating = []    # tool calls that change state, in batch order
+        shared = {}      # params of a cacheable call -> future of its first occurrence
+        for position, request in enumerate(requests):
+            if not isinstance(request, dict) or not isinstance(request.get('method'), str):
+                slots.append(self._error_response(None, -32600, 'Invalid Request'))
+                continue
+
+            if position in initialized:
+                slots.append((request, initialized[position], None))
+                continue
+
+            spec = self.batch_tool_spec(request)
+            if spec is not None and spec.mutates:
+                slots.append((request, None, len(mutating)))
+                mutating.append(request)
+                continue
+
+            dedup_key = None
+            if spec is not None and spec.cacheable:
+                dedup_key = json.dumps(request['params'], sort_keys=True, default=str)
+                if dedup_key in shared:
+                    slots.append((request, shared[dedup_key], None))
+                    continue
+
+            # Copy the context so calls can reach the event stream of this HTTP request
+            future = executor.submit(contextvars.copy_context().run, self._run_batch_call, request)
+            if dedup_key is not None:
+                shared[dedup_key] = future
+            slots.append((request, future, None))
+
+        sequence = None
+        if mutating:
+            sequence = executor.submit(contextvars.copy_context().run, self._run_batch_sequence, mutating)
+
+        responses = []
+        for slot in slots:
+            if not isinstance(slot, tuple):
+                responses.append(slot)
+                continue
+
+            request, future, index = slot
+            response = sequence.result()[index] if index is not None else future.result()
+            # Requests without an id are notifications
+            if 'id' in request:
+                if response is not None and response.get('id') != request['id']:
+                    # Shared result of a duplicate call
+                    response = dict(response, id=request['id'])
+                responses.append(response)
+
+        return responses or None
+
+    def batch_tool_spec(self, request):
+        """Registered tool targeted by a batch member, if it is a well-formed tools/call"""
+        params = request.get('params')
+        if request.get('method') != 'tools/call' or not isinstance(params, dict):
+            return None
+        return TOOL_REGISTRY.get(params.get('name'))
+
+    def _run_batch_sequence(self, requests):
+        """Execute state-changing calls from a batch one after another"""
+        return [self._run_batch_call(request) for request in requests]
+
+    def _run_batch_call(self, request):
+        """Execute one call from a batch, keeping failures local to that call"""
+        try:
+            return self.handle_mcp_request(request)
+        except Exception as e:
+            self.log(f"❌ Batch call failed: {str(e)}")
+            return self._error_response(request.get('id'), -32603, f'Internal error: {str(e)}')
+
+    def _error_response(self, request_id, code, message):
+        """Build a JSON-RPC error response"""
+        return {
+            'jsonrpc': '2.0',
+            'id': request_id,
+            'error': {
+                'code': code,
+                'message': message
+            }
+        }
+
+    def handle_initialize(self, request_id, params=None):
         """Handle initialize request"""
+        params = params or {}
+        if params.get('profile') is not None:
+            try:
+                self.profile = normalize_profile(params['profile'])
+            except ValueError as e:
+                return self._error_response(request_id, -32602, str(e))
+
+        # Clients send it back as Mcp-Session-Id to keep the profile on later requests
+        self.session_id = make_session_id(self.profile)
         return {
             'jsonrpc': '2.0',
             'id': request_id,
@@ -402,699 +3578,17 @@ class MCPServerHandler(BaseHTTPRequestHandler):
                 'serverInfo': {
                     'name': 'Python HTTP MCP Server',
                     'version': '2.0.0'
+                },
+                '_meta': {
+                    'profile': self.profile or 'all',
+                    'sessionId': self.session_id
                 }
             }
         }
     
     def handle_tools_list(self, request_id):
         """Return list of available tools"""
-        tools = [
-            {
-                'name': 'create_embedding',
-                'description': 'Generate embeddings for text using Ollama nomic-embed-text model',
-                'inputSchema': {
-                    'type': 'object',
-                    'properties': {
-                        'text': {
-                            'type': 'string',
-                            'description': 'Text to generate embeddings for'
-                        }
-                    },
-                    'required': ['text']
-                }
-            },
-            {
-                'name': 'save_document',
-                'description': 'Save a document with its embedding and source citation info to the database. Automatically generates embedding if not provided.',
-                'inputSchema': {
-                    'type': 'object',
-                    'properties': {
-                        'content': {
-                            'type': 'string',
-                            'description': 'Document content to save'
-                        },
-                        'source_file': {
-                            'type': 'string',
-                            'description': 'Source filename (e.g., "api_guide.pdf")',
-                            'default': 'manual_entry'
-                        },
-                        'source_type': {
-                            'type': 'string',
-                            'description': 'File type: pdf, txt, or manual',
-                            'default': 'manual'
-                        },
-                        'chunk_index': {
-                            'type': 'integer',
-                            'description': 'Chunk position in document (0-based)',
-                            'default': 0
-                        },
-                        'page_number': {
-                            'type': 'integer',
-                            'description': 'Page number in PDF (optional)'
-                        },
-                        'total_chunks': {
-                            'type': 'integer',
-                            'description': 'Total number of chunks from this source',
-                            'default': 1
-                        },
-                        'metadata': {
-                            'type': 'string',
-                            'description': 'JSON metadata (author, title, date, etc.)',
-                            'default': '{}'
-                        }
-                    },
-                    'required': ['content']
-                }
-            },
-            {
-                'name': 'search_similar',
-                'description': 'Search for similar documents using cosine similarity',
-                'inputSchema': {
-                    'type': 'object',
-                    'properties': {
-                        'query': {
-                            'type': 'string',
-                            'description': 'Query text to search for similar documents'
-                        },
-                        'limit': {
-                            'type': 'integer',
-                            'description': 'Maximum number of results to return (default: 5)',
-                            'default': 5
-                        }
-                    },
-                    'required': ['query']
-                }
-            },
-            {
-                'name': 'semantic_search',
-                'description': 'Search for relevant document chunks from remote MCP server using semantic similarity. Use this to find context from indexed documents to answer questions.',
-                'inputSchema': {
-                    'type': 'object',
-                    'properties': {
-                        'query': {
-                            'type': 'string',
-                            'description': 'Question or query text to search for relevant document chunks'
-                        },
-                        'limit': {
-                            'type': 'integer',
-                            'description': 'Maximum number of relevant chunks to return (default: 3)',
-                            'default': 3
-                        },
-                        'threshold': {
-                            'type': 'number',
-                            'description': 'Minimum similarity score (0.0-1.0). Only return documents with similarity >= threshold (default: 0.7)',
-                            'default': 0.7
-                        },
-                        'compare_mode': {
-                            'type': 'boolean',
-                            'description': 'If true, return both unfiltered and filtered results for comparison (default: false)',
-                            'default': False
-                        }
-                    },
-                    'required': ['query']
-                }
-            },
-            {
-                'name': 'process_pdf',
-                'description': 'Process a PDF file: extract text, chunk it, and save chunks with embeddings',
-                'inputSchema': {
-                    'type': 'object',
-                    'properties': {
-                        'pdf_base64': {
-                            'type': 'string',
-                            'description': 'Base64-encoded PDF file content'
-                        },
-                        'filename': {
-                            'type': 'string',
-                            'description': 'Original filename of the PDF'
-                        },
-                        'chunk_size': {
-                            'type': 'integer',
-                            'description': 'Characters per chunk (default: 1000)',
-                            'default': 1000
-                        },
-                        'chunk_overlap': {
-                            'type': 'integer',
-                            'description': 'Overlap between chunks (default: 200)',
-                            'default': 200
-                        }
-                    },
-                    'required': ['pdf_base64', 'filename']
-                }
-            },
-            {
-                'name': 'process_text_chunks',
-                'description': 'Process extracted text: chunk it and save chunks with embeddings (for client-side PDF extraction)',
-                'inputSchema': {
-                    'type': 'object',
-                    'properties': {
-                        'text': {
-                            'type': 'string',
-                            'description': 'Extracted text content to process'
-                        },
-                        'filename': {
-                            'type': 'string',
-                            'description': 'Original filename for metadata'
-                        },
-                        'chunk_size': {
-                            'type': 'integer',
-                            'description': 'Characters per chunk (default: 1000)',
-                            'default': 1000
-                        },
-                        'chunk_overlap': {
-                            'type': 'integer',
-                            'description': 'Overlap between chunks (default: 200)',
-                            'default': 200
-                        }
-                    },
-                    'required': ['text', 'filename']
-                }
-            },
-            {
-                'name': 'get_repo',
-                'description': 'Get detailed information about a GitHub repository. Owner defaults to Golgoroth22 if not specified.',
-                'inputSchema': {
-                    'type': 'object',
-                    'properties': {
-                        'owner': {
-                            'type': 'string',
-                            'description': 'Repository owner (default: Golgoroth22)',
-                            'default': 'Golgoroth22'
-                        },
-                        'repo': {
-                            'type': 'string',
-                            'description': 'Repository name'
-                        }
-                    },
-                    'required': ['repo']
-                }
-            },
-            {
-                'name': 'search_code',
-                'description': 'Search for code across GitHub repositories',
-                'inputSchema': {
-                    'type': 'object',
-                    'properties': {
-                        'query': {
-                            'type': 'string',
-                            'description': 'Search query using GitHub search syntax'
-                        },
-                        'max_results': {
-                            'type': 'integer',
-                            'description': 'Maximum number of results to return (default: 5)',
-                            'default': 5
-                        }
-                    },
-                    'required': ['query']
-                }
-            },
-            {
-                'name': 'create_issue',
-                'description': 'Create a new issue in a GitHub repository. Owner defaults to Golgoroth22 if not specified.',
-                'inputSchema': {
-                    'type': 'object',
-                    'properties': {
-                        'owner': {
-                            'type': 'string',
-                            'description': 'Repository owner (default: Golgoroth22)',
-                            'default': 'Golgoroth22'
-                        },
-                        'repo': {
-                            'type': 'string',
-                            'description': 'Repository name'
-                        },
-                        'title': {
-                            'type': 'string',
-                            'description': 'Issue title'
-                        },
-                        'body': {
-                            'type': 'string',
-                            'description': 'Issue description (markdown supported)'
-                        }
-                    },
-                    'required': ['repo', 'title', 'body']
-                }
-            },
-            {
-                'name': 'list_issues',
-                'description': 'List issues from a GitHub repository. Owner defaults to Golgoroth22 if not specified.',
-                'inputSchema': {
-                    'type': 'object',
-                    'properties': {
-                        'owner': {
-                            'type': 'string',
-                            'description': 'Repository owner (default: Golgoroth22)',
-                            'default': 'Golgoroth22'
-                        },
-                        'repo': {
-                            'type': 'string',
-                            'description': 'Repository name'
-                        },
-                        'state': {
-                            'type': 'string',
-                            'description': 'Filter by state: open, closed, or all (default: open)',
-                            'default': 'open'
-                        }
-                    },
-                    'required': ['repo']
-                }
-            },
-            {
-                'name': 'list_commits',
-                'description': 'List commit history from a GitHub repository. Owner defaults to Golgoroth22 if not specified.',
-                'inputSchema': {
-                    'type': 'object',
-                    'properties': {
-                        'owner': {
-                            'type': 'string',
-                            'description': 'Repository owner (default: Golgoroth22)',
-                            'default': 'Golgoroth22'
-                        },
-                        'repo': {
-                            'type': 'string',
-                            'description': 'Repository name'
-                        },
-                        'max_results': {
-                            'type': 'integer',
-                            'description': 'Maximum number of commits to return (default: 10)',
-                            'default': 10
-                        }
-                    },
-                    'required': ['repo']
-                }
-            },
-            {
-                'name': 'get_repo_content',
-                'description': 'Get file contents or directory listing from a GitHub repository. Owner defaults to Golgoroth22 if not specified.',
-                'inputSchema': {
-                    'type': 'object',
-                    'properties': {
-                        'owner': {
-                            'type': 'string',
-                            'description': 'Repository owner (default: Golgoroth22)',
-                            'default': 'Golgoroth22'
-                        },
-                        'repo': {
-                            'type': 'string',
-                            'description': 'Repository name'
-                        },
-                        'path': {
-                            'type': 'string',
-                            'description': 'File or directory path in the repository'
-                        }
-                    },
-                    'required': ['repo', 'path']
-                }
-            },
-            {
-                'name': 'get_pull_request',
-                'description': 'Get pull request details including title, description, state, author, and metadata. Owner defaults to Golgoroth22 if not specified.',
-                'inputSchema': {
-                    'type': 'object',
-                    'properties': {
-                        'owner': {
-                            'type': 'string',
-                            'description': 'Repository owner (default: Golgoroth22)',
-                            'default': 'Golgoroth22'
-                        },
-                        'repo': {
-                            'type': 'string',
-                            'description': 'Repository name'
-                        },
-                        'pr_number': {
-                            'type': 'integer',
-                            'description': 'Pull request number'
-                        }
-                    },
-                    'required': ['repo', 'pr_number']
-                }
-            },
-            {
-                'name': 'get_pr_files',
-                'description': 'Get list of files changed in a pull request with diffs. Includes filename, status, additions, deletions, and patch content. Owner defaults to Golgoroth22 if not specified.',
-                'inputSchema': {
-                    'type': 'object',
-                    'properties': {
-                        'owner': {
-                            'type': 'string',
-                            'description': 'Repository owner (default: Golgoroth22)',
-                            'default': 'Golgoroth22'
-                        },
-                        'repo': {
-                            'type': 'string',
-                            'description': 'Repository name'
-                        },
-                        'pr_number': {
-                            'type': 'integer',
-                            'description': 'Pull request number'
-                        },
-                        'max_files': {
-                            'type': 'integer',
-                            'description': 'Maximum number of files to return (default: 30, prevents overload)',
-                            'default': 30
-                        }
-                    },
-                    'required': ['repo', 'pr_number']
-                }
-            },
-            {
-                'name': 'git_status',
-                'description': 'Get current git repository status: modified files, staged files, untracked files, current branch, ahead/behind remote',
-                'inputSchema': {
-                    'type': 'object',
-                    'properties': {
-                        'repo_path': {
-                            'type': 'string',
-                            'description': f'Path to git repository (default: {GIT_DEFAULT_REPO_PATH})',
-                            'default': GIT_DEFAULT_REPO_PATH
-                        }
-                    },
-                    'required': []
-                }
-            },
-            {
-                'name': 'git_branch',
-                'description': 'List all local and remote branches, showing which is currently active',
-                'inputSchema': {
-                    'type': 'object',
-                    'properties': {
-                        'repo_path': {
-                            'type': 'string',
-                            'description': f'Path to git repository (default: {GIT_DEFAULT_REPO_PATH})',
-                            'default': GIT_DEFAULT_REPO_PATH
-                        },
-                        'include_remote': {
-                            'type': 'boolean',
-                            'description': 'Include remote branches (default: true)',
-                            'default': True
-                        }
-                    },
-                    'required': []
-                }
-            },
-            {
-                'name': 'git_diff',
-                'description': 'Get diff for files (unstaged or staged changes)',
-                'inputSchema': {
-                    'type': 'object',
-                    'properties': {
-                        'repo_path': {
-                            'type': 'string',
-                            'description': f'Path to git repository (default: {GIT_DEFAULT_REPO_PATH})',
-                            'default': GIT_DEFAULT_REPO_PATH
-                        },
-                        'filepath': {
-                            'type': 'string',
-                            'description': 'Optional: specific file path to diff (omit for all changes)'
-                        },
-                        'staged': {
-                            'type': 'boolean',
-                            'description': 'If true, show staged changes; if false, show unstaged (default: false)',
-                            'default': False
-                        },
-                        'max_lines': {
-                            'type': 'integer',
-                            'description': 'Maximum lines of diff output (default: 500)',
-                            'default': 500
-                        }
-                    },
-                    'required': []
-                }
-            },
-            {
-                'name': 'git_pr_status',
-                'description': 'Check pull request status for current branch by combining local git info with GitHub API. Returns current branch, related PRs, and whether PRs are open.',
-                'inputSchema': {
-                    'type': 'object',
-                    'properties': {
-                        'repo_path': {
-                            'type': 'string',
-                            'description': f'Path to git repository (default: {GIT_DEFAULT_REPO_PATH})',
-                            'default': GIT_DEFAULT_REPO_PATH
-                        }
-                    },
-                    'required': []
-                }
-            },
-            {
-                'name': 'get_ticket',
-                'description': 'Get ticket details by ticket ID including status, priority, description, and full history',
-                'inputSchema': {
-                    'type': 'object',
-                    'properties': {
-                        'ticket_id': {
-                            'type': 'integer',
-                            'description': 'Ticket ID to retrieve'
-                        }
-                    },
-                    'required': ['ticket_id']
-                }
-            },
-            {
-                'name': 'list_user_tickets',
-                'description': 'List all tickets for a specific user with optional status filtering (open, in_progress, resolved, closed, or all)',
-                'inputSchema': {
-                    'type': 'object',
-                    'properties': {
-                        'user_id': {
-                            'type': 'integer',
-                            'description': 'User ID to get tickets for'
-                        },
-                        'status': {
-                            'type': 'string',
-                            'description': 'Filter by status: open, in_progress, resolved, closed, or all (default: all)',
-                            'default': 'all'
-                        }
-                    },
-                    'required': ['user_id']
-                }
-            },
-            {
-                'name': 'create_ticket',
-                'description': 'Create a new support ticket for a user with title, description, priority, and category',
-                'inputSchema': {
-                    'type': 'object',
-                    'properties': {
-                        'user_id': {
-                            'type': 'integer',
-                            'description': 'User ID creating the ticket'
-                        },
-                        'title': {
-                            'type': 'string',
-                            'description': 'Short ticket title summarizing the issue'
-                        },
-                        'description': {
-                            'type': 'string',
-                            'description': 'Detailed description of the problem'
-                        },
-                        'priority': {
-                            'type': 'string',
-                            'description': 'Priority level: low, medium, high, or critical (default: medium)',
-                            'default': 'medium'
-                        },
-                        'category': {
-                            'type': 'string',
-                            'description': 'Category: authentication, features, troubleshooting, or other (default: other)',
-                            'default': 'other'
-                        }
-                    },
-                    'required': ['user_id', 'title', 'description']
-                }
-            },
-            {
-                'name': 'update_ticket',
-                'description': 'Update ticket status, add notes to history, or reassign to support agent',
-                'inputSchema': {
-                    'type': 'object',
-                    'properties': {
-                        'ticket_id': {
-                            'type': 'integer',
-                            'description': 'Ticket ID to update'
-                        },
-                        'status': {
-                            'type': 'string',
-                            'description': 'New status: open, in_progress, resolved, or closed (optional)'
-                        },
-                        'note': {
-                            'type': 'string',
-                            'description': 'Note to add to ticket history (optional)'
-                        },
-                        'assigned_to': {
-                            'type': 'string',
-                            'description': 'Assign ticket to support agent (optional)'
-                        }
-                    },
-                    'required': ['ticket_id']
-                }
-            },
-            {
-                'name': 'list_users',
-                'description': 'List all available users from CRM database',
-                'inputSchema': {
-                    'type': 'object',
-                    'properties': {}
-                }
-            },
-            # Task management tools
-            {
-                'name': 'create_task',
-                'description': 'Create a new task ONLY when user explicitly requests it. ALWAYS ask user for priority (low/medium/high) if not specified in their message.',
-                'inputSchema': {
-                    'type': 'object',
-                    'properties': {
-                        'title': {
-                            'type': 'string',
-                            'description': 'Brief task title (max 100 chars)'
-                        },
-                        'description': {
-                            'type': 'string',
-                            'description': 'Detailed task description'
-                        },
-                        'priority': {
-                            'type': 'string',
-                            'enum': ['low', 'medium', 'high'],
-                            'description': 'Task priority level - REQUIRED, must ask user if not specified'
-                        },
-                        'assignee': {
-                            'type': 'string',
-                            'description': 'Team member ID (optional)'
-                        },
-                        'related_ticket_id': {
-                            'type': 'integer',
-                            'description': 'Link to support ticket (optional)'
-                        },
-                        'tags': {
-                            'type': 'array',
-                            'items': {'type': 'string'},
-                            'description': 'Task tags for categorization'
-                        }
-                    },
-                    'required': ['title', 'description', 'priority']
-                }
-            },
-            {
-                'name': 'list_tasks',
-                'description': 'List tasks with filtering by status, priority, assignee',
-                'inputSchema': {
-                    'type': 'object',
-                    'properties': {
-                        'status': {
-                            'type': 'string',
-                            'enum': ['todo', 'in_progress', 'done', 'all'],
-                            'default': 'all'
-                        },
-                        'priority': {
-                            'type': 'string',
-                            'enum': ['low', 'medium', 'high', 'all'],
-                            'default': 'all'
-                        },
-                        'assignee': {
-                            'type': 'string',
-                            'description': 'Filter by assignee ID'
-                        },
-                        'limit': {
-                            'type': 'integer',
-                            'default': 10
-                        }
-                    }
-                }
-            },
-            {
-                'name': 'update_task',
-                'description': 'Update task status, priority, assignee, or add notes',
-                'inputSchema': {
-                    'type': 'object',
-                    'properties': {
-                        'task_id': {
-                            'type': 'integer'
-                        },
-                        'status': {
-                            'type': 'string',
-                            'enum': ['todo', 'in_progress', 'done']
-                        },
-                        'priority': {
-                            'type': 'string',
-                            'enum': ['low', 'medium', 'high']
-                        },
-                        'assignee': {
-                            'type': 'string'
-                        },
-                        'note': {
-                            'type': 'string',
-                            'description': 'Add note to history'
-                        }
-                    },
-                    'required': ['task_id']
-                }
-            },
-            {
-                'name': 'get_task',
-                'description': 'Get full task details including history and linked ticket',
-                'inputSchema': {
-                    'type': 'object',
-                    'properties': {
-                        'task_id': {
-                            'type': 'integer'
-                        }
-                    },
-                    'required': ['task_id']
-                }
-            },
-            {
-                'name': 'get_team_workload',
-                'description': 'Get team members current workload and availability',
-                'inputSchema': {
-                    'type': 'object',
-                    'properties': {
-                        'role_filter': {
-                            'type': 'string',
-                            'description': 'Filter by role (optional)'
-                        }
-                    }
-                }
-            },
-            {
-                'name': 'search_similar_tasks',
-                'description': 'Find similar tasks using semantic search',
-                'inputSchema': {
-                    'type': 'object',
-                    'properties': {
-                        'query': {
-                            'type': 'string',
-                            'description': 'Task description or keywords'
-                        },
-                        'limit': {
-                            'type': 'integer',
-                            'default': 5
-                        },
-                        'threshold': {
-                            'type': 'number',
-                            'default': 0.6
-                        }
-                    },
-                    'required': ['query']
-                }
-            },
-            {
-                'name': 'create_webpage',
-                'description': 'Create a simple HTML webpage with provided text content and deploy it to the web server',
-                'inputSchema': {
-                    'type': 'object',
-                    'properties': {
-                        'text': {
-                            'type': 'string',
-                            'description': 'The text content to display on the webpage'
-                        },
-                        'title': {
-                            'type': 'string',
-                            'description': 'Optional page title (defaults to first 50 chars of text)'
-                        }
-                    },
-                    'required': ['text']
-                }
-            }
-        ]
-
+        tools, body, etag = tools_list_catalogue(self.profile)
         return {
             'jsonrpc': '2.0',
             'id': request_id,
@@ -1107,106 +3601,279 @@ class MCPServerHandler(BaseHTTPRequestHandler):
         """Execute tool call"""
         tool_name = params.get('name')
         arguments = params.get('arguments', {})
+        meta = params.get('_meta') or {}
 
-        # Truncate large arguments for logging
-        log_args = arguments.copy()
-        if 'pdf_base64' in log_args and len(log_args['pdf_base64']) > 100:
-            log_args['pdf_base64'] = f"{log_args['pdf_base64'][:100]}... ({len(log_args['pdf_base64'])} chars)"
-
-        self.log(f"🔧 Calling tool: {tool_name} with args: {log_args}")
-
-        try:
-            if tool_name == 'create_embedding':
-                result = self.tool_create_embedding(arguments)
-            elif tool_name == 'save_document':
-                result = self.tool_save_document(arguments)
-            elif tool_name == 'search_similar':
-                result = self.tool_search_similar(arguments)
-            elif tool_name == 'semantic_search':
-                result = self.tool_semantic_search(arguments)
-            elif tool_name == 'process_pdf':
-                result = self.tool_process_pdf(arguments)
-            elif tool_name == 'process_text_chunks':
-                result = self.tool_process_text_chunks(arguments)
-            elif tool_name == 'get_repo':
-                result = self.tool_get_repo(arguments)
-            elif tool_name == 'search_code':
-                result = self.tool_search_code(arguments)
-            elif tool_name == 'create_issue':
-                result = self.tool_create_issue(arguments)
-            elif tool_name == 'list_issues':
-                result = self.tool_list_issues(arguments)
-            elif tool_name == 'list_commits':
-                result = self.tool_list_commits(arguments)
-            elif tool_name == 'get_repo_content':
-                result = self.tool_get_repo_content(arguments)
-            elif tool_name == 'get_pull_request':
-                result = self.tool_get_pull_request(arguments)
-            elif tool_name == 'get_pr_files':
-                result = self.tool_get_pr_files(arguments)
-            elif tool_name == 'git_status':
-                result = self.tool_git_status(arguments)
-            elif tool_name == 'git_branch':
-                result = self.tool_git_branch(arguments)
-            elif tool_name == 'git_diff':
-                result = self.tool_git_diff(arguments)
-            elif tool_name == 'git_pr_status':
-                result = self.tool_git_pr_status(arguments)
-            elif tool_name == 'get_ticket':
-                result = self.tool_get_ticket(arguments)
-            elif tool_name == 'list_user_tickets':
-                result = self.tool_list_user_tickets(arguments)
-            elif tool_name == 'create_ticket':
-                result = self.tool_create_ticket(arguments)
-            elif tool_name == 'update_ticket':
-                result = self.tool_update_ticket(arguments)
-            elif tool_name == 'list_users':
-                result = self.tool_list_users(arguments)
-            elif tool_name == 'create_task':
-                result = self.tool_create_task(arguments)
-            elif tool_name == 'list_tasks':
-                result = self.tool_list_tasks(arguments)
-            elif tool_name == 'update_task':
-                result = self.tool_update_task(arguments)
-            elif tool_name == 'get_task':
-                result = self.tool_get_task(arguments)
-            elif tool_name == 'get_team_workload':
-                result = self.tool_get_team_workload(arguments)
-            elif tool_name == 'search_similar_tasks':
-                result = self.tool_search_similar_tasks(arguments)
-            elif tool_name == 'create_webpage':
-                result = self.tool_create_webpage(arguments)
-            else:
-                raise ValueError(f'Unknown tool: {tool_name}')
-            
-            self.log(f"✨ Tool result: {json.dumps(result, ensure_ascii=False)[:100]}...")
-            
-            return {
-                'jsonrpc': '2.0',
-                'id': request_id,
-                'result': {
-                    'content': [
-                        {
-                            'type': 'text',
-                            'text': json.dumps(result, indent=2, ensure_ascii=False)
-                        }
-                    ]
+        with self.tool_call(request_id, tool_name, arguments, meta) as call:
+            # Large arguments (PDFs, document texts) are summarized, not logged
+            self.log("🔧 Calling tool: %s with args: %s", tool_name, LazyPreview(arguments, limit=300))
+            try:
+                spec = TOOL_REGISTRY.get(tool_name)
+                if spec is None:
+                    raise ValueError(f'Unknown tool: {tool_name}')
+                if spec.admin:
+                    if not self.is_admin():
+                        raise ValueError(f"Tool '{tool_name}' requires the admin token")
+                elif not profile_allows(self.profile, tool_name):
+                    raise ValueError(f"Tool '{tool_name}' is not available in profile '{self.profile}'")
+                # Checked before the tool runs: a tool that changes state must not run for a response it cannot send
+                result_format = self.resolve_result_format(meta.get('resultFormat'))
+
+                is_async = arguments.get('async') and tool_name in JOB_CONFIG['async_tools']
+                if meta.get('profile'):
+                    call.profiler = self.call_profiler(tool_name, meta['profile'], is_async)
+
+                if is_async:
+                    result = self.start_job(tool_name, arguments)
+                else:
+                    result = self.run_tool(call, spec, functools.partial(spec.bind(self), arguments))
+
+                self.log("✨ Tool result: %s", LazyPreview(result), level=logging.DEBUG)
+
+                with trace_span('serialization') as span:
+                    tool_result = self.build_tool_result(result, result_format)
+                    if (call.trace is not None or CALL_RECORDER.enabled) and 'structuredContent' in tool_result:
+                        # structuredContent is encoded with the response; encode it here too so the cost shows
+                        call.result_bytes = span['bytes'] = len(encode_json(tool_result['structuredContent']))
+                    elif CALL_RECORDER.enabled:
+                        call.result_bytes = len(tool_result['content'][0]['text'].encode('utf-8'))
+                if call.profiler is not None:
+                    tool_result.setdefault('_meta', {})['profile'] = call.profiler.save()
+                if call.trace is not None:
+                    call.trace.finish()
+                    tool_result.setdefault('_meta', {})['trace'] = call.trace.summary()
+
+                return {
+                    'jsonrpc': '2.0',
+                    'id': request_id,
+                    'result': tool_result
                 }
-            }
-        except Exception as e:
-            self.log(f"❌ Tool error: {str(e)}")
-            return {
-                'jsonrpc': '2.0',
-                'id': request_id,
-                'error': {
-                    'code': -32000,
+            except RequestAborted as e:
+                call.status = 'aborted'
+                self.log(f"🛑 Tool {tool_name} stopped: {str(e)}")
+                error = {
+                    'code': e.code,
                     'message': str(e)
                 }
-            }
+                if e.data is not None:
+                    error['data'] = e.data
+                return {
+                    'jsonrpc': '2.0',
+                    'id': request_id,
+                    'error': error
+                }
+            except Exception as e:
+                call.status = 'error'
+                self.log(f"❌ Tool error: {str(e)}")
+                return {
+                    'jsonrpc': '2.0',
+                    'id': request_id,
+                    'error': {
+                        'code': -32000,
+                        'message': str(e)
+                    }
+                }
+
+    @contextlib.contextmanager
+    def tool_call(self, request_id, tool_name, arguments, meta):
+        """
+        Context of one tool call, shared by tools/call and the upload endpoint
+
+        Sets the RequestContext (deadline, and cancellation through
+        ACTIVE_CALLS), the log fields and the trace for the block; when it
+        exits, the call is counted in the tool metrics, TOOL_MEMORY and the
+        call recorder. Yields the ToolCall for the caller to fill in.
+        """
+        log_token = _log_fields.set({'tool': tool_name, 'request_id': request_id,
+                                     'sampled': log_sampled(tool_name)})
+
+        deadline_seconds = self.call_deadline_seconds(tool_name, meta)
+        context = RequestContext(
+            request_id=request_id,
+            progress_token=meta.get('progressToken'),
+            notify=_event_stream.get(),
+            deadline=time.monotonic() + deadline_seconds if deadline_seconds is not None else None
+        )
+        context_token = _request_context.set(context)
+        call_key = self.call_key(request_id)
+        if call_key is not None:
+            with ACTIVE_CALLS_LOCK:
+                ACTIVE_CALLS.setdefault(call_key, []).append(context)
+
+        tool_label = tool_name if isinstance(tool_name, str) and tool_name in TOOL_REGISTRY else 'unknown'
+        rss_before = current_rss_bytes()
+        peak_before = peak_rss_bytes()
+        trace = None
+        if meta.get('trace') or getattr(self, 'trace_requested', False):
+            trace = Trace(f'tools/call {tool_label}', tool=tool_label)
+        trace_token = _trace.set(trace)
+        trace_parent_token = _trace_parent.set(trace.root.span_id if trace else None)
+        call = ToolCall(tool_label, context, trace)
+        started = time.perf_counter()
+        TOOL_IN_FLIGHT.inc(tool=tool_label)
+        try:
+            yield call
+        finally:
+            status = call.status
+            if call.profiler is not None:
+                call.profiler.stop()
+            if trace is not None:
+                trace.finish(error=None if status in ('ok', 'failed') else status)
+                export_trace(trace)
+            _trace_parent.reset(trace_parent_token)
+            _trace.reset(trace_token)
+            TOOL_MEMORY.record(tool_label, current_rss_bytes() - rss_before, peak_rss_bytes() - peak_before)
+            TOOL_IN_FLIGHT.dec(tool=tool_label)
+            if CALL_RECORDER.enabled:
+                elapsed = time.perf_counter() - started
+                CALL_RECORDER.record({
+                    't': round(time.time() - elapsed, 3),
+                    'tool': tool_name,
+                    'args': redact_blobs(arguments),
+                    'ms': round(elapsed * 1000, 2),
+                    'bytes': call.result_bytes,
+                    'status': status,
+                    'profile': self.profile,
+                    # Replays skip calls that change state unless asked to
+                    'mutates': tool_label != 'unknown' and TOOL_REGISTRY[tool_label].mutates
+                })
+            TOOL_CALLS_TOTAL.inc(tool=tool_label, status=status)
+            TOOL_SECONDS.observe(time.perf_counter() - started, tool=tool_label)
+            _request_context.reset(context_token)
+            _log_fields.reset(log_token)
+            if call_key is not None:
+                with ACTIVE_CALLS_LOCK:
+                    contexts = ACTIVE_CALLS.get(call_key, [])
+                    if context in contexts:
+                        contexts.remove(context)
+                    if not contexts:
+                        ACTIVE_CALLS.pop(call_key, None)
+
+    def run_tool(self, call, spec, run):
+        """
+        Run a tool inside tool_call() under its concurrency class; set call.status
+
+        A cancelled or timed out call raises its RequestAborted carrying
+        whatever partial result the tool returned.
+        """
+        with TOOL_LIMITER.slot(spec.concurrency, call_timeout(CONCURRENCY_CONFIG['wait_seconds'])):
+            if call.profiler is not None:
+                call.profiler.start()
+            result = run()
+
+        aborted = call.context.abort_error()
+        if aborted is not None:
+            # Whatever the tool returned is partial work; report it with the error
+            aborted.data = result
+            raise aborted
+
+        call.status = 'failed' if isinstance(result, dict) and result.get('success') is False else 'ok'
+        return result
+
+    def build_tool_result(self, result, result_format=None):
+        """
+        Build the tools/call result in the requested format
 
+        structuredContent carries the result object itself, so it is encoded
+        only once, together with the response envelope. The text block mirrors
+        it as compact JSON for clients that read content[0].text.
+        """
+        result_format = self.resolve_result_format(result_format)
+
+        content = []
+        if result_format != 'structured':
+            content.append({
+                'type': 'text',
+                'text': json.dumps(result, ensure_ascii=False, separators=(',', ':'))
+            })
+
+        tool_result = {'content': content}
+        if result_format != 'text':
+            # structuredContent must be an object
+            tool_result['structuredContent'] = result if isinstance(result, dict) else {'result': result}
+        return tool_result
+
+    def resolve_result_format(self, result_format=None):
+        """Result format of a call: _meta.resultFormat, the X-MCP-Result-Format header or the default"""
+        result_format = result_format or self.result_format or RESULT_CONFIG['default_format']
+        if result_format not in RESULT_CONFIG['formats']:
+            raise ValueError(f"Unknown resultFormat '{result_format}'. "
+                             f"Use one of: {', '.join(RESULT_CONFIG['formats'])}")
+        return result_format
+
+    def call_profiler(self, tool_name, options, is_async=False):
+        """Profiler for _meta.profile (true, or {"sort": ..., "top": ...}); admin only"""
+        if not self.is_admin():
+            raise ValueError('Profiling a call requires the admin token')
+        if is_async:
+            raise ValueError('Background job calls cannot be profiled')
+        options = options if isinstance(options, dict) else {}
+        return CallProfiler(tool_name, sort=options.get('sort', 'cumulative'), top=options.get('top'))
+
+    def call_deadline_seconds(self, tool_name, meta):
+        """Deadline of a tool call in seconds: _meta.deadlineMs or the tool's registered timeout"""
+        deadline_ms = meta.get('deadlineMs')
+        if isinstance(deadline_ms, (int, float)) and not isinstance(deadline_ms, bool) and deadline_ms > 0:
+            return min(deadline_ms / 1000, DEADLINE_CONFIG['max_seconds'])
+        spec = TOOL_REGISTRY.get(tool_name)
+        return spec.timeout if spec is not None else None
+
+    def call_key(self, request_id):
+        """
+        Key of a call in ACTIVE_CALLS; request ids are only unique per client
+
+        The client is the MCP session (Mcp-Session-Id), or else the connection
+        (host and port): behind a reverse proxy every client has the same host.
+        """
+        if request_id is None:
+            return None
+        headers = getattr(self, 'headers', None)
+        session_id = headers.get('Mcp-Session-Id') if headers else None
+        scope = ('session', session_id) if session_id else ('connection', getattr(self, 'client_address', None))
+        return (scope, json.dumps(request_id))
+
+    def handle_cancelled(self, params):
+        """Handle notifications/cancelled: stop the referenced in-progress call"""
+        call_key = self.call_key(params.get('requestId'))
+        with ACTIVE_CALLS_LOCK:
+            contexts = list(ACTIVE_CALLS.get(call_key, ())) if call_key is not None else []
+
+        if not contexts:
+            # Already finished, unknown, or served by another worker process
+            self.log(f"🛑 Cancellation for unknown request {params.get('requestId')!r} ignored")
+            return
+
+        # A client reusing an id for calls still in flight cannot say which one it means
+        for context in contexts:
+            context.cancel()
+        self.log(f"🛑 Cancelled request {params.get('requestId')!r}: {params.get('reason', 'no reason given')}")
+
+    @mcp_tool(
+        'create_embedding',
+        description='Generate embeddings for text with the configured embedding model (default: Ollama nomic-embed-text)',
+        input_schema={
+            'type': 'object',
+            'properties': {
+                'text': {
+                    'type': 'string',
+                    'description': 'Text to generate embeddings for'
+                },
+                'encoding': {
+                    'type': 'string',
+                    'enum': ['json', 'float32_b64', 'float16_b64'],
+                    'description': 'Result format: float list (json, default) or base64 of little-endian float32/float16 values',
+                    'default': 'json'
+                }
+            },
+            'required': ['text']
+        },
+        timeout=60,
+        concurrency='embedding',
+        cacheable=True
+    )
     def tool_create_embedding(self, args):
-        """Generate embeddings using Ollama"""
+        """Generate embeddings with the configured provider"""
         text = args.get('text', '')
+        encoding = args.get('encoding', 'json')
 
         if not text:
             return {
@@ -1214,40 +3881,35 @@ class MCPServerHandler(BaseHTTPRequestHandler):
                 'error': 'Text is required'
             }
 
-        self.log(f"🔮 Generating embedding for text: {text[:50]}...")
-
-        try:
-            # Call Ollama API to generate embeddings
-            url = f"{OLLAMA_API_URL}/api/embeddings"
-            data = {
-                'model': 'nomic-embed-text',
-                'prompt': text
+        if encoding not in EMBEDDING_ENCODINGS:
+            return {
+                'success': False,
+                'error': f"Unknown encoding '{encoding}'. Use one of: {', '.join(EMBEDDING_ENCODINGS)}"
             }
 
-            req = urllib.request.Request(
-                url,
-                data=json.dumps(data).encode('utf-8'),
-                headers={'Content-Type': 'application/json'}
-            )
-
-            with urllib.request.urlopen(req, timeout=60) as response:
-                result = json.loads(response.read().decode('utf-8'))
+        self.log(f"🔮 Generating embedding for text: {text[:50]}...")
 
-            embedding = result.get('embedding', [])
+        try:
+            provider = get_embedding_provider()
+            embeddings, errors = embed_texts([text], provider)
+            embedding = embeddings[0]
 
             if not embedding:
-                self.log(f"❌ No embedding returned from Ollama")
+                self.log(f"❌ No embedding returned by {provider.identity}: {errors.get(0)}")
                 return {
                     'success': False,
-                    'error': 'No embedding generated'
+                    'error': f'Failed to generate embedding: {errors.get(0)}'
                 }
 
             self.log(f"✨ Embedding generated: {len(embedding)} dimensions")
 
             return {
                 'success': True,
-                'embedding': embedding,
-                'dimensions': len(embedding)
+                'embedding': encode_embedding(embedding, encoding),
+                'encoding': encoding,
+                'dimensions': len(embedding),
+                'provider': provider.name,
+                'model': provider.model
             }
 
         except Exception as e:
@@ -1257,6 +3919,62 @@ class MCPServerHandler(BaseHTTPRequestHandler):
                 'error': f'Failed to generate embedding: {str(e)}'
             }
 
+    @mcp_tool(
+        'save_document',
+        description='Save a document with its embedding and source citation info to the database. Automatically generates embedding if not provided.',
+        input_schema={
+            'type': 'object',
+            'properties': {
+                'content': {
+                    'type': 'string',
+                    'description': 'Document content to save'
+                },
+                'source_file': {
+                    'type': 'string',
+                    'description': 'Source filename (e.g., "api_guide.pdf")',
+                    'default': 'manual_entry'
+                },
+                'source_type': {
+                    'type': 'string',
+                    'description': 'File type: pdf, txt, or manual',
+                    'default': 'manual'
+                },
+                'chunk_index': {
+                    'type': 'integer',
+                    'description': 'Chunk position in document (0-based)',
+                    'default': 0
+                },
+                'page_number': {
+                    'type': 'integer',
+                    'description': 'Page number in PDF (optional)'
+                },
+                'total_chunks': {
+                    'type': 'integer',
+                    'description': 'Total number of chunks from this source',
+                    'default': 1
+                },
+                'metadata': {
+                    'type': 'string',
+                    'description': 'JSON metadata (author, title, date, etc.)',
+                    'default': '{}'
+                },
+                'embedding': {
+                    'type': ['array', 'string'],
+                    'items': {'type': 'number'},
+                    'description': 'Precomputed embedding of the content (skips generating one)'
+                },
+                'embedding_encoding': {
+                    'type': 'string',
+                    'enum': ['json', 'float32_b64', 'float16_b64'],
+                    'description': 'Encoding of a base64 embedding (default: float32_b64)'
+                }
+            },
+            'required': ['content']
+        },
+        timeout=60,
+        concurrency='embedding',
+        mutates=True
+    )
     def tool_save_document(self, args):
         """Save document with embedding to local database"""
         content = args.get('content', '').strip()
@@ -1277,17 +3995,23 @@ class MCPServerHandler(BaseHTTPRequestHandler):
         self.log(f"💾 Saving document locally: {content[:50]}...")
 
         try:
-            # 1. Generate embedding using local Ollama
-            embedding_result = self.tool_create_embedding({'text': content})
+            # 1. Use the client's embedding, or generate one using local Ollama
+            if args.get('embedding') is not None:
+                try:
+                    embedding = decode_embedding(args['embedding'], args.get('embedding_encoding'))
+                except ValueError as e:
+                    return {'success': False, 'error': str(e), 'document_id': None}
+            else:
+                embedding_result = self.tool_create_embedding({'text': content})
 
-            if not embedding_result.get('success'):
-                return {
-                    'success': False,
-                    'error': f"Failed to generate embedding: {embedding_result.get('error')}",
-                    'document_id': None
-                }
+                if not embedding_result.get('success'):
+                    return {
+                        'success': False,
+                        'error': f"Failed to generate embedding: {embedding_result.get('error')}",
+                        'document_id': None
+                    }
 
-            embedding = embedding_result['embedding']
+                embedding = embedding_result['embedding']
 
             # 2. Save to local database
             doc_id = EmbeddingsDatabase.save_document_with_embedding(
@@ -1320,46 +4044,93 @@ class MCPServerHandler(BaseHTTPRequestHandler):
                 'document_id': None
             }
 
+    @mcp_tool(
+        'search_similar',
+        description='Search for similar documents using cosine similarity',
+        input_schema={
+            'type': 'object',
+            'properties': {
+                'query': {
+                    'type': 'string',
+                    'description': 'Query text to search for similar documents (required without query_embedding)'
+                },
+                'limit': {
+                    'type': 'integer',
+                    'description': 'Maximum number of results to return (default: 5)',
+                    'default': 5
+                },
+                'query_embedding': {
+                    'type': ['array', 'string'],
+                    'items': {'type': 'number'},
+                    'description': 'Precomputed embedding of the query (skips generating one; query is then optional)'
+                },
+                'embedding_encoding': {
+                    'type': 'string',
+                    'enum': ['json', 'float32_b64', 'float16_b64'],
+                    'description': 'Encoding of a base64 query_embedding (default: float32_b64)'
+                }
+            }
+        },
+        timeout=60,
+        concurrency='embedding',
+        cacheable=True
+    )
     def tool_search_similar(self, args):
         """Search for similar documents using cosine similarity in local database"""
         query = args.get('query', '').strip()
         limit = args.get('limit', 5)
 
-        if not query:
+        if not query and args.get('query_embedding') is None:
             return {
                 'success': False,
-                'error': 'Query is required',
+                'error': 'query or query_embedding is required',
                 'documents': []
             }
 
         self.log(f"🔍 Searching locally for: {query[:50]}... (limit={limit})")
 
         try:
-            # 1. Generate query embedding
-            embedding_result = self.tool_create_embedding({'text': query})
-
-            if not embedding_result.get('success'):
-                return {
-                    'success': False,
-                    'error': f"Failed to generate query embedding: {embedding_result.get('error')}",
-                    'documents': []
-                }
+            # 1. Use the client's query embedding, or generate one
+            if args.get('query_embedding') is not None:
+                with trace_span('embedding', source='client'):
+                    try:
+                        query_embedding = decode_embedding(args['query_embedding'], args.get('embedding_encoding'))
+                    except ValueError as e:
+                        return {'success': False, 'error': str(e), 'documents': []}
+            else:
+                with trace_span('embedding', source='server', provider=get_embedding_provider().identity):
+                    embedding_result = self.tool_create_embedding({'text': query})
+
+                if not embedding_result.get('success'):
+                    return {
+                        'success': False,
+                        'error': f"Failed to generate query embedding: {embedding_result.get('error')}",
+                        'documents': []
+                    }
 
-            query_embedding = embedding_result['embedding']
+                query_embedding = embedding_result['embedding']
 
             # 2. Search database
-            results = EmbeddingsDatabase.search_similar_documents(
+            results, skipped = EmbeddingsDatabase.search_similar_documents(
                 query_embedding=query_embedding,
                 limit=limit
             )
 
             self.log(f"✅ Found {len(results)} similar documents")
 
-            return {
+            response = {
                 'success': True,
                 'count': len(results),
                 'documents': results
             }
+            if skipped:
+                # Mixed index: some documents were embedded by another provider or model
+                provider = get_embedding_provider()
+                self.log(f"⚠️ Skipped documents from other embedding models: {skipped}")
+                response['skipped_documents'] = skipped
+                response['warning'] = (f"{sum(skipped.values())} documents were embedded with another model "
+                                       f"than {provider.identity} and were not searched; re-index them")
+            return response
 
         except Exception as e:
             self.log(f"❌ Search failed: {str(e)}")
@@ -1371,6 +4142,48 @@ class MCPServerHandler(BaseHTTPRequestHandler):
                 'documents': []
             }
 
+    @mcp_tool(
+        'semantic_search',
+        description='Search for relevant document chunks from remote MCP server using semantic similarity. Use this to find context from indexed documents to answer questions.',
+        input_schema={
+            'type': 'object',
+            'properties': {
+                'query': {
+                    'type': 'string',
+                    'description': 'Question or query text to search for relevant document chunks '
+                                   '(required unless query_embedding is given)'
+                },
+                'limit': {
+                    'type': 'integer',
+                    'description': 'Maximum number of relevant chunks to return (default: 3)',
+                    'default': 3
+                },
+                'threshold': {
+                    'type': 'number',
+                    'description': 'Minimum similarity score (0.0-1.0). Only return documents with similarity >= threshold (default: 0.7)',
+                    'default': 0.7
+                },
+                'compare_mode': {
+                    'type': 'boolean',
+                    'description': 'If true, return both unfiltered and filtered results for comparison (default: false)',
+                    'default': False
+                },
+                'query_embedding': {
+                    'type': ['array', 'string'],
+                    'items': {'type': 'number'},
+                    'description': 'Precomputed embedding of the query (skips generating one; query is then optional)'
+                },
+                'embedding_encoding': {
+                    'type': 'string',
+                    'enum': ['json', 'float32_b64', 'float16_b64'],
+                    'description': 'Encoding of a base64 query_embedding (default: float32_b64)'
+                }
+            }
+        },
+        timeout=60,
+        concurrency='embedding',
+        cacheable=True
+    )
     def tool_semantic_search(self, args):
         """Search for relevant chunks from local database with threshold filtering"""
         query = args.get('query', '').strip()
@@ -1378,10 +4191,10 @@ class MCPServerHandler(BaseHTTPRequestHandler):
         threshold = float(args.get('threshold', SEMANTIC_SEARCH_CONFIG['default_threshold']))
         compare_mode = args.get('compare_mode', False)
 
-        if not query:
+        if not query and args.get('query_embedding') is None:
             return {
                 'success': False,
-                'error': 'Query is required',
+                'error': 'query or query_embedding is required',
                 'documents': []
             }
 
@@ -1395,6 +4208,8 @@ class MCPServerHandler(BaseHTTPRequestHandler):
             # Get raw search results (request more to have buffer for filtering)
             raw_results = self.tool_search_similar({
                 'query': query,
+                'query_embedding': args.get('query_embedding'),
+                'embedding_encoding': args.get('embedding_encoding'),
                 'limit': limit * 2
             })
 
@@ -1405,12 +4220,17 @@ class MCPServerHandler(BaseHTTPRequestHandler):
 
             self.log(f"🔍 Retrieved {len(documents)} documents from local database")
 
-            # Apply threshold filtering and add citations
-            filtered_documents = []
-            for doc in documents:
+            # Apply threshold filtering
+            with trace_span('filtering', threshold=threshold) as span:
                 # Convert similarity to float for comparison (might be string from DB)
-                similarity = float(doc.get('similarity', 0))
-                if similarity >= threshold:
+                filtered_documents = [
+                    doc for doc in documents if float(doc.get('similarity', 0)) >= threshold
+                ][:limit]
+                span['kept'] = len(filtered_documents)
+
+            # Add citations
+            with trace_span('citation_formatting'):
+                for doc in filtered_documents:
                     # Add formatted citation
                     doc['citation'] = self.format_citation(doc)
 
@@ -1424,11 +4244,6 @@ class MCPServerHandler(BaseHTTPRequestHandler):
                         'formatted': doc['citation']
                     }
 
-                    filtered_documents.append(doc)
-
-                    if len(filtered_documents) >= limit:
-                        break
-
             self.log(f"✅ After threshold filtering: {len(filtered_documents)} documents pass (threshold={threshold:.2f})")
 
             # Generate sources summary
@@ -1438,6 +4253,7 @@ class MCPServerHandler(BaseHTTPRequestHandler):
                 sources[src] = sources.get(src, 0) + 1
 
             sources_summary = []
+            mixed_index = {key: raw_results[key] for key in ('skipped_documents', 'warning') if key in raw_results}
             for src, count in sources.items():
                 if count == 1:
                     word = 'фрагмент'
@@ -1463,7 +4279,8 @@ class MCPServerHandler(BaseHTTPRequestHandler):
                         'documents': filtered_documents
                     },
                     'source': 'local_database',
-                    'sources_summary': sources_summary
+                    'sources_summary': sources_summary,
+                    **mixed_index
                 }
             else:
                 # Return filtered results only
@@ -1474,7 +4291,8 @@ class MCPServerHandler(BaseHTTPRequestHandler):
                     'threshold': threshold,
                     'isFiltered': True,
                     'source': 'local_database',
-                    'sources_summary': sources_summary
+                    'sources_summary': sources_summary,
+                    **mixed_index
                 }
 
         except Exception as e:
@@ -1487,6 +4305,42 @@ class MCPServerHandler(BaseHTTPRequestHandler):
                 'documents': []
             }
 
+    @mcp_tool(
+        'process_pdf',
+        description='Process a PDF file: extract text, chunk it, and save chunks with embeddings',
+        input_schema={
+            'type': 'object',
+            'properties': {
+                'pdf_base64': {
+                    'type': 'string',
+                    'description': 'Base64-encoded PDF file content'
+                },
+                'filename': {
+                    'type': 'string',
+                    'description': 'Original filename of the PDF'
+                },
+                'chunk_size': {
+                    'type': 'integer',
+                    'description': 'Characters per chunk (default: 1000)',
+                    'default': 1000
+                },
+                'chunk_overlap': {
+                    'type': 'integer',
+                    'description': 'Overlap between chunks (default: 200)',
+                    'default': 200
+                },
+                'async': {
+                    'type': 'boolean',
+                    'description': 'Run as a background job and return a job_id at once (poll with get_job_status)',
+                    'default': False
+                }
+            },
+            'required': ['pdf_base64', 'filename']
+        },
+        timeout=None,
+        concurrency='ingestion',
+        mutates=True
+    )
     def tool_process_pdf(self, args):
         """Process PDF: extract text, chunk, and save with embeddings locally"""
         pdf_base64 = args.get('pdf_base64', '')
@@ -1503,26 +4357,55 @@ class MCPServerHandler(BaseHTTPRequestHandler):
         self.log(f"📄 Processing PDF locally: {filename}")
 
         try:
-            import base64
             import io
 
             # Decode base64
             pdf_bytes = base64.b64decode(pdf_base64)
+        except Exception as e:
+            self.log(f"❌ Failed to decode PDF: {str(e)}")
+            return {
+                'success': False,
+                'error': f'Failed to process PDF: {str(e)}'
+            }
+
+        with io.BytesIO(pdf_bytes) as pdf_file:
+            return self.process_pdf_file(pdf_file, filename, chunk_size, chunk_overlap)
 
+    def process_pdf_file(self, pdf_file, filename, chunk_size, chunk_overlap):
+        """Extract text from a PDF (file path or binary file object), chunk it and save with embeddings"""
+        try:
             # Extract text using pdfplumber (if available)
             try:
                 import pdfplumber
 
-                with io.BytesIO(pdf_bytes) as pdf_file:
-                    with pdfplumber.open(pdf_file) as pdf:
-                        text_parts = []
-                        for page in pdf.pages:
-                            text_parts.append(page.extract_text() or '')
-
-                        extracted_text = '\n\n'.join(text_parts)
+                with pdfplumber.open(pdf_file) as pdf:
+                    text_parts = []
+                    total_pages = len(pdf.pages)
+                    for page_number, page in enumerate(pdf.pages, start=1):
+                        if is_cancelled():
+                            self.log(f"🛑 PDF processing cancelled at page {page_number}/{total_pages}")
+                            return {
+                                'success': False,
+                                'cancelled': True,
+                                'error': 'Cancelled during text extraction',
+                                'chunks_saved': 0
+                            }
+                        text_parts.append(page.extract_text() or '')
+                        # pdf.pages keeps every parsed page (chars, layout objects) until the document closes
+                        release = getattr(page, 'close', None) or page.flush_cache
+                        release()
+                        report_progress(page_number, total_pages,
+                                        f"Extracted page {page_number}/{total_pages}")
+
+                    extracted_text = '\n\n'.join(text_parts)
+                    # Only the joined copy is needed from here on
+                    text_parts.clear()
 
                 self.log(f"✅ Extracted {len(extracted_text)} characters from PDF")
 
+                # Chunk progress continues after the extraction phase
+                next_progress_phase()
+
                 # Process extracted text
                 return self.tool_process_text_chunks({
                     'text': extracted_text,
@@ -1547,13 +4430,53 @@ class MCPServerHandler(BaseHTTPRequestHandler):
                 'error': f'Failed to process PDF: {str(e)}'
             }
 
+    @mcp_tool(
+        'process_text_chunks',
+        description='Process extracted text: chunk it and save chunks with embeddings (for client-side PDF extraction)',
+        input_schema={
+            'type': 'object',
+            'properties': {
+                'text': {
+                    'type': 'string',
+                    'description': 'Extracted text content to process'
+                },
+                'filename': {
+                    'type': 'string',
+                    'description': 'Original filename for metadata'
+                },
+                'chunk_size': {
+                    'type': 'integer',
+                    'description': 'Characters per chunk (default: 1000)',
+                    'default': 1000
+                },
+                'chunk_overlap': {
+                    'type': 'integer',
+                    'description': 'Overlap between chunks (default: 200)',
+                    'default': 200
+                },
+                'async': {
+                    'type': 'boolean',
+                    'description': 'Run as a background job and return a job_id at once (poll with get_job_status)',
+                    'default': False
+                }
+            },
+            'required': ['text', 'filename']
+        },
+        timeout=None,
+        concurrency='ingestion',
+        mutates=True
+    )
     def tool_process_text_chunks(self, args):
         """Process extracted text: chunk and save with embeddings locally (with parallel processing)"""
         text = args.get('text', '').strip()
         filename = args.get('filename', 'document.txt')
         chunk_size = args.get('chunk_size', 1000)
         chunk_overlap = args.get('chunk_overlap', 200)
-        max_workers = args.get('max_workers', 4)  # Number of parallel threads
+        # Only a hint: the embedding scheduler decides how many requests really run
+        max_workers = args.get('max_workers')
+        if not isinstance(max_workers, int) or isinstance(max_workers, bool):
+            max_workers = EMBEDDING_SCHEDULER_CONFIG['max_limit']
+        max_workers = max(1, min(max_workers, EMBEDDING_SCHEDULER_CONFIG['max_limit']))
 
         if not text:
             return {
@@ -1571,7 +4494,7 @@ class MCPServerHandler(BaseHTTPRequestHandler):
 
         self.log(f"📝 Processing text chunks locally: {filename} (type={source_type})")
         self.log(f"📊 Text length: {len(text)} characters")
-        self.log(f"⚡ Using {max_workers} parallel workers")
+        self.log(f"⚡ Up to {max_workers} parallel embedding requests")
 
         try:
             import time
@@ -1583,73 +4506,119 @@ class MCPServerHandler(BaseHTTPRequestHandler):
 
             self.log(f"✂️ Created {total_chunks} chunks")
 
-            # 2. Process chunks in parallel
+            # 2. Embed chunks in batches (one Ollama request each), several batches in parallel
+            batches = list(embedding_batches(chunks))
             saved_count = 0
             failed_count = 0
-            lock = threading.Lock()  # For thread-safe counter updates
-
-            def process_chunk(chunk_data):
-                """Process a single chunk (generate embedding and save)"""
-                i, chunk_content = chunk_data
-                try:
-                    # Generate embedding
-                    emb_result = self.tool_create_embedding({'text': chunk_content})
-
-                    if not emb_result.get('success'):
-                        self.log(f"⚠️ Failed to embed chunk {i+1}/{total_chunks}: {emb_result.get('error')}")
-                        return False, i
-
-                    embedding = emb_result['embedding']
-
-                    # Save to database
-                    doc_id = EmbeddingsDatabase.save_document_with_embedding(
-                        content=chunk_content,
-                        embedding=embedding,
-                        source_file=filename,
-                        source_type=source_type,
-                        chunk_index=i,
-                        page_number=None,
-                        total_chunks=total_chunks,
-                        metadata='{}'
-                    )
+            failed_chunks = []
+            cancelled = False
 
-                    return True, i
+            provider = get_embedding_provider()
+            self.log(f"📦 {len(batches)} embedding requests for {total_chunks} chunks ({provider.identity})")
 
+            def process_batch(indexes):
+                """Embed a batch of chunks and save them; return [(chunk index, saved)]"""
+                # A batch starting after cancellation is skipped, even before the loop below notices
+                check_cancelled()
+                try:
+                    embeddings, errors = embed_texts([chunks[i] for i in indexes], provider)
+                except RequestAborted:
+                    raise
                 except Exception as e:
-                    self.log(f"❌ Error processing chunk {i+1}: {str(e)}")
-                    return False, i
-
-            # Use ThreadPoolExecutor for parallel processing
+                    embeddings, errors = [None] * len(indexes), dict.fromkeys(range(len(indexes)), str(e))
+
+                outcomes = []
+                for position, (i, embedding) in enumerate(zip(indexes, embeddings)):
+                    if embedding is None:
+                        self.log(f"⚠️ Failed to embed chunk {i+1}/{total_chunks}: {errors.get(position)}")
+                        outcomes.append((i, False))
+                        continue
+                    try:
+                        # Save to database
+                        EmbeddingsDatabase.save_document_with_embedding(
+                            content=chunks[i],
+                            embedding=embedding,
+                            source_file=filename,
+                            source_type=source_type,
+                            chunk_index=i,
+                            page_number=None,
+                            total_chunks=total_chunks,
+                            metadata='{}',
+                            provider=provider
+                        )
+                        outcomes.append((i, True))
+                    except Exception as e:
+                        self.log(f"❌ Error saving chunk {i+1}: {str(e)}")
+                        outcomes.append((i, False))
+                return outcomes
+
+            def count(future):
+                """Add the outcomes of a finished batch to the totals"""
+                nonlocal saved_count, failed_count
+                try:
+                    outcomes = future.result()
+                except RequestAborted:
+                    # Deadline or cancellation hit the embedding request: the batch is skipped, not saved
+                    return
+
+                for chunk_index, success in outcomes:
+                    if success:
+                        saved_count += 1
+                    else:
+                        failed_count += 1
+                        failed_chunks.append(chunk_index)
+
+                    # Log progress every 10 chunks or on last chunk
+                    if (saved_count + failed_count) % 10 == 0 or (saved_count + failed_count) == total_chunks:
+                        self.log(f"💾 Progress: {saved_count}/{total_chunks} chunks saved...")
+
+                    # Saved chunks are already searchable, so streaming clients can use them
+                    report_progress(saved_count + failed_count, total_chunks,
+                                    f"{saved_count}/{total_chunks} chunks saved, {failed_count} failed")
+
+            counted = set()
             with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                # Submit all tasks
-                futures = {
-                    executor.submit(process_chunk, (i, chunk)): i
-                    for i, chunk in enumerate(chunks)
-                }
+                # Each batch runs in a copy of the call context so embedding requests honour its deadline
+                futures = [
+                    executor.submit(contextvars.copy_context().run, process_batch, indexes)
+                    for indexes in batches
+                ]
 
-                # Process completed tasks
                 for future in as_completed(futures):
-                    success, chunk_index = future.result()
-
-                    with lock:
-                        if success:
-                            saved_count += 1
-                        else:
-                            failed_count += 1
+                    count(future)
+                    counted.add(future)
+
+                    if is_cancelled():
+                        # Drop batches not started yet
+                        cancelled = True
+                        for pending in futures:
+                            pending.cancel()
+                        break
 
-                        # Log progress every 10 chunks or on last chunk
-                        if (saved_count + failed_count) % 10 == 0 or (saved_count + failed_count) == total_chunks:
-                            self.log(f"💾 Progress: {saved_count}/{total_chunks} chunks saved...")
+            # Leaving the executor waited for the batches already running: their chunks are saved too
+            for future in futures:
+                if future not in counted and not future.cancelled():
+                    count(future)
+            skipped_count = total_chunks - saved_count - failed_count
 
             processing_time = time.time() - start_time
 
-            self.log(f"🎉 Processing complete: {saved_count} chunks saved, {failed_count} failed in {processing_time:.2f}s")
+            if cancelled:
+                self.log(f"🛑 Processing cancelled: {saved_count} chunks saved, {skipped_count} skipped")
+            else:
+                self.log(f"🎉 Processing complete: {saved_count} chunks saved, {failed_count} failed in {processing_time:.2f}s")
             self.log(f"⚡ Average speed: {processing_time/total_chunks:.2f}s per chunk")
 
             return {
                 'success': True,
+                'cancelled': cancelled,
                 'chunks_saved': saved_count,
                 'chunks_failed': failed_count,
+                # Not embedded because the call was cancelled or ran out of time
+                'chunks_skipped': skipped_count,
+                'failed_chunk_indexes': sorted(failed_chunks),
+                'total_chunks': total_chunks,
+                'embedding_requests': len(batches),
                 'total_characters': len(text),
                 'filename': filename,
                 'chunk_size': chunk_size,
@@ -1668,6 +4637,322 @@ class MCPServerHandler(BaseHTTPRequestHandler):
                 'chunks_saved': 0
             }
 
+    def start_job(self, tool_name, args):
+        """Run a tool call as a background job"""
+        job = JOB_MANAGER.submit(self, tool_name, args)
+        self.log(f"🧵 Started job {job['job_id']} for {tool_name}")
+        return {
+            'success': True,
+            'job_id': job['job_id'],
+            'status': job['status'],
+            'tool': tool_name,
+            'message': 'Job started. Poll get_job_status for progress and result.'
+        }
+
+    @mcp_tool(
+        'get_job_status',
+        description='Get status, progress and result of a background job',
+        input_schema={
+            'type': 'object',
+            'properties': {
+                'job_id': {
+                    'type': 'string',
+                    'description': 'Job ID returned by a tool called with async=true'
+                }
+            },
+            'required': ['job_id']
+        },
+        timeout=10
+    )
+    def tool_get_job_status(self, args):
+        """Get status, progress and result of a background job"""
+        job_id = args.get('job_id')
+        if not job_id:
+            return {'success': False, 'error': 'job_id is required'}
+
+        job = JOB_MANAGER.get(job_id)
+        if job is None:
+            return {'success': False, 'error': f'Job {job_id} not found'}
+
+        return {'success': True, 'job': job}
+
+    @mcp_tool(
+        'cancel_job',
+        description='Cancel a queued or running background job (work already saved is kept)',
+        input_schema={
+            'type': 'object',
+            'properties': {
+                'job_id': {
+                    'type': 'string',
+                    'description': 'Job ID to cancel'
+                }
+            },
+            'required': ['job_id']
+        },
+        timeout=10,
+        mutates=True
+    )
+    def tool_cancel_job(self, args):
+        """Cancel a queued or running background job"""
+        job_id = args.get('job_id')
+        if not job_id:
+            return {'success': False, 'error': 'job_id is required'}
+
+        job = JOB_MANAGER.cancel(job_id)
+        if job is None:
+            return {'success': False, 'error': f'Job {job_id} not found'}
+
+        self.log(f"🛑 Cancellation requested for job {job_id} (status: {job['status']})")
+        return {'success': True, 'job': job}
+
+    @mcp_tool(
+        'list_jobs',
+        description='List recent background jobs, newest first',
+        input_schema={
+            'type': 'object',
+            'properties': {
+                'status': {
+                    'type': 'string',
+                    'enum': ['queued', 'running', 'succeeded', 'failed', 'cancelled', 'interrupted'],
+                    'description': 'Filter by status (optional)'
+                },
+                'tool': {
+                    'type': 'string',
+                    'description': 'Filter by tool name (optional)'
+                },
+                'limit': {
+                    'type': 'integer',
+                    'description': 'Maximum number of jobs to return (default: 20)',
+                    'default': 20
+                }
+            }
+        },
+        timeout=10
+    )
+    def tool_list_jobs(self, args):
+        """List recent background jobs"""
+        limit = args.get('limit', 20)
+        if not isinstance(limit, int) or isinstance(limit, bool):
+            return {'success': False, 'error': 'limit must be an integer'}
+        limit = max(1, min(limit, 100))
+        jobs = JOB_MANAGER.list(status=args.get('status'), tool=args.get('tool'), limit=limit)
+        return {'success': True, 'count': len(jobs), 'jobs': jobs}
+
+    @mcp_tool(
+        'list_call_profiles',
+        description='Admin: list saved cProfile call profiles (from tools/call _meta.profile), newest first',
+        input_schema={
+            'type': 'object',
+            'properties': {
+                'limit': {
+                    'type': 'integer',
+                    'description': 'Maximum number of profiles to return (default: 20)',
+                    'default': 20
+                }
+            }
+        },
+        timeout=10,
+        admin=True
+    )
+    def tool_list_call_profiles(self, args):
+        """List saved call profiles (cProfile output, unrelated to the tool profiles of X-MCP-Profile)"""
+        limit = max(1, min(int(args.get('limit', 20)), 100))
+        directory = profile_dir()
+        names = sorted((name for name in os.listdir(directory) if name.endswith('.prof')),
+                       reverse=True) if os.path.isdir(directory) else []
+        profiles = []
+        for name in names[:limit]:
+            st = os.stat(os.path.join(directory, name))
+            profiles.append({
+                'file': name,
+                'bytes': st.st_size,
+                'created_at': datetime.fromtimestamp(st.st_mtime).isoformat(timespec='seconds')
+            })
+        return {'success': True, 'directory': directory, 'count': len(profiles), 'profiles': profiles}
+
+    @mcp_tool(
+        'embedding_cache',
+        description='Admin: embedding cache statistics, or clear it (all models or one)',
+        input_schema={
+            'type': 'object',
+            'properties': {
+                'action': {
+                    'type': 'string',
+                    'enum': ['stats', 'clear'],
+                    'description': 'stats (default) or clear',
+                    'default': 'stats'
+                },
+                'model': {
+                    'type': 'string',
+                    'description': 'clear: only vectors of this model'
+                }
+            }
+        },
+        timeout=30,
+        admin=True
+    )
+    def tool_embedding_cache(self, args):
+        """Report or clear the embedding cache"""
+        action = args.get('action', 'stats')
+        if action == 'stats':
+            return dict({'success': True}, **EMBEDDING_CACHE.stats())
+        if action == 'clear':
+            deleted = EMBEDDING_CACHE.clear(args.get('model'))
+            self.log(f"🧹 Embedding cache cleared: {deleted} stored vectors deleted")
+            return {'success': True, 'deleted': deleted}
+        return {'success': False, 'error': f"Unknown action '{action}'. Use stats or clear"}
+
+    @mcp_tool(
+        'memory_trace',
+        description='Admin: tracemalloc control (start, stop, snapshot, diff, top) and RSS per tool call',
+        input_schema={
+            'type': 'object',
+            'properties': {
+                'action': {
+                    'type': 'string',
+                    'enum': ['status', 'start', 'stop', 'snapshot', 'diff', 'top'],
+                    'description': 'status: tracing state, RSS and per-tool memory; start/stop tracing; '
+                                   'snapshot: keep a snapshot for diff; top: largest allocators now; '
+                                   'diff: growth between two snapshots (default: first kept snapshot and now)',
+                    'default': 'status'
+                },
+                'frames': {
+                    'type': 'integer',
+                    'description': 'Traceback depth recorded by start (default: 25)'
+                },
+                'group_by': {
+                    'type': 'string',
+                    'enum': ['tool', 'lineno', 'filename', 'traceback'],
+                    'description': 'Grouping for top and diff (default: tool)',
+                    'default': 'tool'
+                },
+                'base': {
+                    'type': 'integer',
+                    'description': 'Snapshot id diff starts from (default: oldest kept)'
+                },
+                'against': {
+                    'type': 'integer',
+                    'description': 'Snapshot id diff ends at (default: a new snapshot)'
+                },
+                'limit': {
+                    'type': 'integer',
+                    'description': 'Rows returned by top and diff (default: 15)',
+                    'default': 15
+                }
+            }
+        },
+        timeout=120,
+        admin=True
+    )
+    def tool_memory_trace(self, args):
+        """Control tracemalloc and report memory use per tool"""
+        action = args.get('action', 'status')
+        group_by = args.get('group_by', 'tool')
+        limit = max(1, min(int(args.get('limit', 15)), 100))
+
+        if group_by not in ('tool', 'lineno', 'filename', 'traceback'):
+            return {'success': False, 'error': f"Unknown group_by '{group_by}'"}
+
+        if action == 'status':
+            current, peak = tracemalloc.get_traced_memory()
+            return {
+                'success': True,
+                'pid': os.getpid(),
+                'tracing': tracemalloc.is_tracing(),
+                'traced_kb': round(current / 1024, 1),
+                'traced_peak_kb': round(peak / 1024, 1),
+                'rss_kb': current_rss_bytes() // 1024,
+                'peak_rss_kb': peak_rss_bytes() // 1024,
+                'snapshots': [{'id': snapshot_id, 'taken_at': taken_at}
+                              for snapshot_id, (taken_at, _) in _memory_snapshots.items()],
+                'tools': {
+                    tool_name: {
+                        'calls': stats['calls'],
+                        'rss_delta_last_kb': stats['rss_delta_last'] // 1024,
+                        'rss_delta_max_kb': stats['rss_delta_max'] // 1024,
+                        'peak_rss_growth_max_kb': stats['peak_growth_max'] // 1024,
+                        'peak_rss_growth_total_kb': stats['peak_growth_total'] // 1024
+                    }
+                    for tool_name, stats in TOOL_MEMORY.report().items()
+                }
+            }
+
+        if action == 'start':
+            frames = max(1, min(int(args.get('frames') or MEMORY_CONFIG['default_frames']), 100))
+            if tracemalloc.is_tracing():
+                return {'success': False, 'error': 'tracemalloc is already tracing'}
+            _memory_snapshots.clear()
+            tracemalloc.start(frames)
+            self.log(f"🧠 tracemalloc started ({frames} frames)")
+            return {'success': True, 'tracing': True, 'frames': frames}
+
+        if action == 'stop':
+            tracemalloc.stop()
+            _memory_snapshots.clear()
+            self.log(f"🧠 tracemalloc stopped")
+            return {'success': True, 'tracing': False}
+
+        if not tracemalloc.is_tracing():
+            return {'success': False, 'error': "tracemalloc is not tracing; call with action 'start' first"}
+
+        if action == 'snapshot':
+            snapshot_id = next(_memory_snapshot_ids)
+            snapshot = take_memory_snapshot()
+            _memory_snapshots[snapshot_id] = (datetime.now().isoformat(timespec='seconds'), snapshot)
+            while len(_memory_snapshots) > MEMORY_CONFIG['max_snapshots']:
+                del _memory_snapshots[min(_memory_snapshots)]
+            total = sum(stat.size for stat in snapshot.statistics('filename'))
+            return {'success': True, 'snapshot_id': snapshot_id, 'traced_kb': round(total / 1024, 1)}
+
+        if action == 'top':
+            return {
+                'success': True,
+                'group_by': group_by,
+                'top': memory_statistics(take_memory_snapshot(), group_by, limit)
+            }
+
+        if action == 'diff':
+            if not _memory_snapshots:
+                return {'success': False, 'error': "No snapshot to diff from; call with action 'snapshot' first"}
+            base_id = args.get('base') or min(_memory_snapshots)
+            if base_id not in _memory_snapshots:
+                return {'success': False, 'error': f'Unknown snapshot {base_id}'}
+            against_id = args.get('against')
+            if against_id is not None and against_id not in _memory_snapshots:
+                return {'success': False, 'error': f'Unknown snapshot {against_id}'}
+            against = _memory_snapshots[against_id][1] if against_id is not None else take_memory_snapshot()
+            return {
+                'success': True,
+                'base': base_id,
+                'against': against_id or 'now',
+                'group_by': group_by,
+                'top': memory_statistics(against, group_by, limit, base=_memory_snapshots[base_id][1])
+            }
+
+        return {'success': False, 'error': f"Unknown action '{action}'"}
+
+    @mcp_tool(
+        'get_repo',
+        description='Get detailed information about a GitHub repository. Owner defaults to Golgoroth22 if not specified.',
+        input_schema={
+            'type': 'object',
+            'properties': {
+                'owner': {
+                    'type': 'string',
+                    'description': 'Repository owner (default: Golgoroth22)',
+                    'default': 'Golgoroth22'
+                },
+                'repo': {
+                    'type': 'string',
+                    'description': 'Repository name'
+                }
+            },
+            'required': ['repo']
+        },
+        timeout=60,
+        concurrency='github',
+        cacheable=True
+    )
     def tool_get_repo(self, args):
         """Get repository information from GitHub"""
         owner = args.get('owner', GITHUB_DEFAULT_OWNER)
@@ -1694,6 +4979,28 @@ class MCPServerHandler(BaseHTTPRequestHandler):
             self.log(f"❌ GitHub API error: {str(e)}")
             return {'success': False, 'error': str(e)}
 
+    @mcp_tool(
+        'search_code',
+        description='Search for code across GitHub repositories',
+        input_schema={
+            'type': 'object',
+            'properties': {
+                'query': {
+                    'type': 'string',
+                    'description': 'Search query using GitHub search syntax'
+                },
+                'max_results': {
+                    'type': 'integer',
+                    'description': 'Maximum number of results to return (default: 5)',
+                    'default': 5
+                }
+            },
+            'required': ['query']
+        },
+        timeout=60,
+        concurrency='github',
+        cacheable=True
+    )
     def tool_search_code(self, args):
         """Search code on GitHub"""
         query = args.get('query')
@@ -1726,6 +5033,36 @@ class MCPServerHandler(BaseHTTPRequestHandler):
             self.log(f"❌ GitHub API error: {str(e)}")
             return {'success': False, 'error': str(e)}
 
+    @mcp_tool(
+        'create_issue',
+        description='Create a new issue in a GitHub repository. Owner defaults to Golgoroth22 if not specified.',
+        input_schema={
+            'type': 'object',
+            'properties': {
+                'owner': {
+                    'type': 'string',
+                    'description': 'Repository owner (default: Golgoroth22)',
+                    'default': 'Golgoroth22'
+                },
+                'repo': {
+                    'type': 'string',
+                    'description': 'Repository name'
+                },
+                'title': {
+                    'type': 'string',
+                    'description': 'Issue title'
+                },
+                'body': {
+                    'type': 'string',
+                    'description': 'Issue description (markdown supported)'
+                }
+            },
+            'required': ['repo', 'title', 'body']
+        },
+        timeout=60,
+        concurrency='github',
+        mutates=True
+    )
     def tool_create_issue(self, args):
         """Create a new GitHub issue"""
         owner = args.get('owner', GITHUB_DEFAULT_OWNER)
@@ -1752,6 +5089,33 @@ class MCPServerHandler(BaseHTTPRequestHandler):
             self.log(f"❌ GitHub API error: {str(e)}")
             return {'success': False, 'error': str(e)}
 
+    @mcp_tool(
+        'list_issues',
+        description='List issues from a GitHub repository. Owner defaults to Golgoroth22 if not specified.',
+        input_schema={
+            'type': 'object',
+            'properties': {
+                'owner': {
+                    'type': 'string',
+                    'description': 'Repository owner (default: Golgoroth22)',
+                    'default': 'Golgoroth22'
+                },
+                'repo': {
+                    'type': 'string',
+                    'description': 'Repository name'
+                },
+                'state': {
+                    'type': 'string',
+                    'description': 'Filter by state: open, closed, or all (default: open)',
+                    'default': 'open'
+                }
+            },
+            'required': ['repo']
+        },
+        timeout=60,
+        concurrency='github',
+        cacheable=True
+    )
     def tool_list_issues(self, args):
         """List issues from a GitHub repository"""
         owner = args.get('owner', GITHUB_DEFAULT_OWNER)
@@ -1788,6 +5152,33 @@ class MCPServerHandler(BaseHTTPRequestHandler):
             self.log(f"❌ GitHub API error: {str(e)}")
             return {'success': False, 'error': str(e)}
 
+    @mcp_tool(
+        'list_commits',
+        description='List commit history from a GitHub repository. Owner defaults to Golgoroth22 if not specified.',
+        input_schema={
+            'type': 'object',
+            'properties': {
+                'owner': {
+                    'type': 'string',
+                    'description': 'Repository owner (default: Golgoroth22)',
+                    'default': 'Golgoroth22'
+                },
+                'repo': {
+                    'type': 'string',
+                    'description': 'Repository name'
+                },
+                'max_results': {
+                    'type': 'integer',
+                    'description': 'Maximum number of commits to return (default: 10)',
+                    'default': 10
+                }
+            },
+            'required': ['repo']
+        },
+        timeout=60,
+        concurrency='github',
+        cacheable=True
+    )
     def tool_list_commits(self, args):
         """List commits from a GitHub repository"""
         owner = args.get('owner', GITHUB_DEFAULT_OWNER)
@@ -1819,6 +5210,32 @@ class MCPServerHandler(BaseHTTPRequestHandler):
             self.log(f"❌ GitHub API error: {str(e)}")
             return {'success': False, 'error': str(e)}
 
+    @mcp_tool(
+        'get_repo_content',
+        description='Get file contents or directory listing from a GitHub repository. Owner defaults to Golgoroth22 if not specified.',
+        input_schema={
+            'type': 'object',
+            'properties': {
+                'owner': {
+                    'type': 'string',
+                    'description': 'Repository owner (default: Golgoroth22)',
+                    'default': 'Golgoroth22'
+                },
+                'repo': {
+                    'type': 'string',
+                    'description': 'Repository name'
+                },
+                'path': {
+                    'type': 'string',
+                    'description': 'File or directory path in the repository'
+                }
+            },
+            'required': ['repo', 'path']
+        },
+        timeout=60,
+        concurrency='github',
+        cacheable=True
+    )
     def tool_get_repo_content(self, args):
         """Get file content or directory listing from GitHub"""
         owner = args.get('owner', GITHUB_DEFAULT_OWNER)
@@ -1863,6 +5280,32 @@ class MCPServerHandler(BaseHTTPRequestHandler):
             self.log(f"❌ GitHub API error: {str(e)}")
             return {'success': False, 'error': str(e)}
 
+    @mcp_tool(
+        'get_pull_request',
+        description='Get pull request details including title, description, state, author, and metadata. Owner defaults to Golgoroth22 if not specified.',
+        input_schema={
+            'type': 'object',
+            'properties': {
+                'owner': {
+                    'type': 'string',
+                    'description': 'Repository owner (default: Golgoroth22)',
+                    'default': 'Golgoroth22'
+                },
+                'repo': {
+                    'type': 'string',
+                    'description': 'Repository name'
+                },
+                'pr_number': {
+                    'type': 'integer',
+                    'description': 'Pull request number'
+                }
+            },
+            'required': ['repo', 'pr_number']
+        },
+        timeout=60,
+        concurrency='github',
+        cacheable=True
+    )
     def tool_get_pull_request(self, args):
         """Get pull request details from GitHub"""
         owner = args.get('owner', GITHUB_DEFAULT_OWNER)
@@ -1916,6 +5359,37 @@ class MCPServerHandler(BaseHTTPRequestHandler):
             self.log(f"❌ Error getting PR: {str(e)}")
             return {'success': False, 'error': str(e)}
 
+    @mcp_tool(
+        'get_pr_files',
+        description='Get list of files changed in a pull request with diffs. Includes filename, status, additions, deletions, and patch content. Owner defaults to Golgoroth22 if not specified.',
+        input_schema={
+            'type': 'object',
+            'properties': {
+                'owner': {
+                    'type': 'string',
+                    'description': 'Repository owner (default: Golgoroth22)',
+                    'default': 'Golgoroth22'
+                },
+                'repo': {
+                    'type': 'string',
+                    'description': 'Repository name'
+                },
+                'pr_number': {
+                    'type': 'integer',
+                    'description': 'Pull request number'
+                },
+                'max_files': {
+                    'type': 'integer',
+                    'description': 'Maximum number of files to return (default: 30, prevents overload)',
+                    'default': 30
+                }
+            },
+            'required': ['repo', 'pr_number']
+        },
+        timeout=60,
+        concurrency='github',
+        cacheable=True
+    )
     def tool_get_pr_files(self, args):
         """Get list of files changed in a pull request"""
         owner = args.get('owner', GITHUB_DEFAULT_OWNER)
@@ -1980,6 +5454,23 @@ class MCPServerHandler(BaseHTTPRequestHandler):
             self.log(f"❌ Error getting PR files: {str(e)}")
             return {'success': False, 'error': str(e)}
 
+    @mcp_tool(
+        'git_status',
+        description='Get current git repository status: modified files, staged files, untracked files, current branch, ahead/behind remote',
+        input_schema={
+            'type': 'object',
+            'properties': {
+                'repo_path': {
+                    'type': 'string',
+                    'description': f'Path to git repository (default: {GIT_DEFAULT_REPO_PATH})',
+                    'default': GIT_DEFAULT_REPO_PATH
+                }
+            },
+            'required': []
+        },
+        concurrency='git',
+        cacheable=True
+    )
     def tool_git_status(self, args):
         """Get git status: modified, staged, untracked files"""
         repo_path = args.get('repo_path', GIT_DEFAULT_REPO_PATH)
@@ -1989,11 +5480,9 @@ class MCPServerHandler(BaseHTTPRequestHandler):
 
         try:
             # Get status
-            result = subprocess.run(
+            result = run_subprocess(
                 ['git', 'status', '--porcelain', '--branch'],
                 cwd=repo_path,
-                capture_output=True,
-                text=True,
                 timeout=10
             )
 
@@ -2058,6 +5547,28 @@ class MCPServerHandler(BaseHTTPRequestHandler):
         except Exception as e:
             return {'success': False, 'error': str(e)}
 
+    @mcp_tool(
+        'git_branch',
+        description='List all local and remote branches, showing which is currently active',
+        input_schema={
+            'type': 'object',
+            'properties': {
+                'repo_path': {
+                    'type': 'string',
+                    'description': f'Path to git repository (default: {GIT_DEFAULT_REPO_PATH})',
+                    'default': GIT_DEFAULT_REPO_PATH
+                },
+                'include_remote': {
+                    'type': 'boolean',
+                    'description': 'Include remote branches (default: true)',
+                    'default': True
+                }
+            },
+            'required': []
+        },
+        concurrency='git',
+        cacheable=True
+    )
     def tool_git_branch(self, args):
         """List all local and remote branches"""
         repo_path = args.get('repo_path', GIT_DEFAULT_REPO_PATH)
@@ -2068,22 +5579,18 @@ class MCPServerHandler(BaseHTTPRequestHandler):
 
         try:
             # Get current branch
-            current_result = subprocess.run(
+            current_result = run_subprocess(
                 ['git', 'branch', '--show-current'],
                 cwd=repo_path,
-                capture_output=True,
-                text=True,
                 timeout=10
             )
             current_branch = current_result.stdout.strip()
 
             # Get all branches
             cmd = ['git', 'branch', '-a'] if include_remote else ['git', 'branch']
-            result = subprocess.run(
+            result = run_subprocess(
                 cmd,
                 cwd=repo_path,
-                capture_output=True,
-                text=True,
                 timeout=10
             )
 
@@ -2124,6 +5631,38 @@ class MCPServerHandler(BaseHTTPRequestHandler):
         except Exception as e:
             return {'success': False, 'error': str(e)}
 
+    @mcp_tool(
+        'git_diff',
+        description='Get diff for files (unstaged or staged changes)',
+        input_schema={
+            'type': 'object',
+            'properties': {
+                'repo_path': {
+                    'type': 'string',
+                    'description': f'Path to git repository (default: {GIT_DEFAULT_REPO_PATH})',
+                    'default': GIT_DEFAULT_REPO_PATH
+                },
+                'filepath': {
+                    'type': 'string',
+                    'description': 'Optional: specific file path to diff (omit for all changes)'
+                },
+                'staged': {
+                    'type': 'boolean',
+                    'description': 'If true, show staged changes; if false, show unstaged (default: false)',
+                    'default': False
+                },
+                'max_lines': {
+                    'type': 'integer',
+                    'description': 'Maximum lines of diff output (default: 500)',
+                    'default': 500
+                }
+            },
+            'required': []
+        },
+        timeout=60,
+        concurrency='git',
+        cacheable=True
+    )
     def tool_git_diff(self, args):
         """Get diff for specified files or all changes"""
         repo_path = args.get('repo_path', GIT_DEFAULT_REPO_PATH)
@@ -2142,11 +5681,9 @@ class MCPServerHandler(BaseHTTPRequestHandler):
                 cmd.append('--')
                 cmd.append(filepath)
 
-            result = subprocess.run(
+            result = run_subprocess(
                 cmd,
                 cwd=repo_path,
-                capture_output=True,
-                text=True,
                 timeout=30
             )
 
@@ -2177,6 +5714,24 @@ class MCPServerHandler(BaseHTTPRequestHandler):
         except Exception as e:
             return {'success': False, 'error': str(e)}
 
+    @mcp_tool(
+        'git_pr_status',
+        description='Check pull request status for current branch by combining local git info with GitHub API. Returns current branch, related PRs, and whether PRs are open.',
+        input_schema={
+            'type': 'object',
+            'properties': {
+                'repo_path': {
+                    'type': 'string',
+                    'description': f'Path to git repository (default: {GIT_DEFAULT_REPO_PATH})',
+                    'default': GIT_DEFAULT_REPO_PATH
+                }
+            },
+            'required': []
+        },
+        timeout=60,
+        concurrency='git',
+        cacheable=True
+    )
     def tool_git_pr_status(self, args):
         """
         Check PR status by combining local git info with GitHub API
@@ -2189,21 +5744,17 @@ class MCPServerHandler(BaseHTTPRequestHandler):
 
         try:
             # 1. Get current branch
-            branch_result = subprocess.run(
+            branch_result = run_subprocess(
                 ['git', 'branch', '--show-current'],
                 cwd=repo_path,
-                capture_output=True,
-                text=True,
                 timeout=10
             )
             current_branch = branch_result.stdout.strip()
 
             # 2. Get remote URL to extract owner/repo
-            remote_result = subprocess.run(
+            remote_result = run_subprocess(
                 ['git', 'config', '--get', 'remote.origin.url'],
                 cwd=repo_path,
-                capture_output=True,
-                text=True,
                 timeout=10
             )
             remote_url = remote_result.stdout.strip()
@@ -2276,6 +5827,21 @@ class MCPServerHandler(BaseHTTPRequestHandler):
         except Exception as e:
             return {'success': False, 'error': str(e)}
 
+    @mcp_tool(
+        'get_ticket',
+        description='Get ticket details by ticket ID including status, priority, description, and full history',
+        input_schema={
+            'type': 'object',
+            'properties': {
+                'ticket_id': {
+                    'type': 'integer',
+                    'description': 'Ticket ID to retrieve'
+                }
+            },
+            'required': ['ticket_id']
+        },
+        cacheable=True
+    )
     def tool_get_ticket(self, args):
         """Get ticket details by ID"""
         ticket_id = args.get('ticket_id')
@@ -2284,6 +5850,8 @@ class MCPServerHandler(BaseHTTPRequestHandler):
             return {'success': False, 'error': 'ticket_id is required'}
 
         try:
+            refresh_crm_data()
+
             # Find ticket
             ticket = next((t for t in CRM_TICKETS if t['id'] == ticket_id), None)
 
@@ -2307,6 +5875,26 @@ class MCPServerHandler(BaseHTTPRequestHandler):
             self.log(f"❌ Failed to get ticket: {str(e)}")
             return {'success': False, 'error': str(e)}
 
+    @mcp_tool(
+        'list_user_tickets',
+        description='List all tickets for a specific user with optional status filtering (open, in_progress, resolved, closed, or all)',
+        input_schema={
+            'type': 'object',
+            'properties': {
+                'user_id': {
+                    'type': 'integer',
+                    'description': 'User ID to get tickets for'
+                },
+                'status': {
+                    'type': 'string',
+                    'description': 'Filter by status: open, in_progress, resolved, closed, or all (default: all)',
+                    'default': 'all'
+                }
+            },
+            'required': ['user_id']
+        },
+        cacheable=True
+    )
     def tool_list_user_tickets(self, args):
         """List tickets for a user"""
         user_id = args.get('user_id')
@@ -2316,6 +5904,8 @@ class MCPServerHandler(BaseHTTPRequestHandler):
             return {'success': False, 'error': 'user_id is required'}
 
         try:
+            refresh_crm_data()
+
             # Find user
             user = next((u for u in CRM_USERS if u['id'] == user_id), None)
             if not user:
@@ -2337,6 +5927,40 @@ class MCPServerHandler(BaseHTTPRequestHandler):
             self.log(f"❌ Failed to list tickets: {str(e)}")
             return {'success': False, 'error': str(e)}
 
+    @mcp_tool(
+        'create_ticket',
+        description='Create a new support ticket for a user with title, description, priority, and category',
+        input_schema={
+            'type': 'object',
+            'properties': {
+                'user_id': {
+                    'type': 'integer',
+                    'description': 'User ID creating the ticket'
+                },
+                'title': {
+                    'type': 'string',
+                    'description': 'Short ticket title summarizing the issue'
+                },
+                'description': {
+                    'type': 'string',
+                    'description': 'Detailed description of the problem'
+                },
+                'priority': {
+                    'type': 'string',
+                    'description': 'Priority level: low, medium, high, or critical (default: medium)',
+                    'default': 'medium'
+                },
+                'category': {
+                    'type': 'string',
+                    'description': 'Category: authentication, features, troubleshooting, or other (default: other)',
+                    'default': 'other'
+                }
+            },
+            'required': ['user_id', 'title', 'description']
+        },
+        mutates=True
+    )
+    @with_data_lock
     def tool_create_ticket(self, args):
         """Create a new ticket"""
         user_id = args.get('user_id')
@@ -2349,6 +5973,8 @@ class MCPServerHandler(BaseHTTPRequestHandler):
             return {'success': False, 'error': 'user_id, title, and description are required'}
 
         try:
+            refresh_crm_data()
+
             # Validate user exists
             user = next((u for u in CRM_USERS if u['id'] == user_id), None)
             if not user:
@@ -2396,6 +6022,34 @@ class MCPServerHandler(BaseHTTPRequestHandler):
             self.log(f"❌ Failed to create ticket: {str(e)}")
             return {'success': False, 'error': str(e)}
 
+    @mcp_tool(
+        'update_ticket',
+        description='Update ticket status, add notes to history, or reassign to support agent',
+        input_schema={
+            'type': 'object',
+            'properties': {
+                'ticket_id': {
+                    'type': 'integer',
+                    'description': 'Ticket ID to update'
+                },
+                'status': {
+                    'type': 'string',
+                    'description': 'New status: open, in_progress, resolved, or closed (optional)'
+                },
+                'note': {
+                    'type': 'string',
+                    'description': 'Note to add to ticket history (optional)'
+                },
+                'assigned_to': {
+                    'type': 'string',
+                    'description': 'Assign ticket to support agent (optional)'
+                }
+            },
+            'required': ['ticket_id']
+        },
+        mutates=True
+    )
+    @with_data_lock
     def tool_update_ticket(self, args):
         """Update ticket status or add notes"""
         ticket_id = args.get('ticket_id')
@@ -2410,6 +6064,8 @@ class MCPServerHandler(BaseHTTPRequestHandler):
             return {'success': False, 'error': 'At least one of status, note, or assigned_to is required'}
 
         try:
+            refresh_crm_data()
+
             # Find ticket
             ticket = next((t for t in CRM_TICKETS if t['id'] == ticket_id), None)
             if not ticket:
@@ -2469,12 +6125,22 @@ class MCPServerHandler(BaseHTTPRequestHandler):
             self.log(f"❌ Failed to update ticket: {str(e)}")
             return {'success': False, 'error': str(e)}
 
+    @mcp_tool(
+        'list_users',
+        description='List all available users from CRM database',
+        input_schema={
+            'type': 'object',
+            'properties': {}
+        },
+        cacheable=True
+    )
     def tool_list_users(self, args):
         """List all available users from CRM"""
         try:
             global CRM_USERS
 
-            # CRM_USERS is already loaded at server startup
+            # CRM_USERS is loaded at server startup; pick up changes made by other workers
+            refresh_crm_data()
             users = CRM_USERS
 
             self.log(f"✅ Retrieved {len(users)} users")
@@ -2490,6 +6156,44 @@ class MCPServerHandler(BaseHTTPRequestHandler):
 
     # ==================== Task Management Tools ====================
 
+    @mcp_tool(
+        'create_task',
+        description='Create a new task ONLY when user explicitly requests it. ALWAYS ask user for priority (low/medium/high) if not specified in their message.',
+        input_schema={
+            'type': 'object',
+            'properties': {
+                'title': {
+                    'type': 'string',
+                    'description': 'Brief task title (max 100 chars)'
+                },
+                'description': {
+                    'type': 'string',
+                    'description': 'Detailed task description'
+                },
+                'priority': {
+                    'type': 'string',
+                    'enum': ['low', 'medium', 'high'],
+                    'description': 'Task priority level - REQUIRED, must ask user if not specified'
+                },
+                'assignee': {
+                    'type': 'string',
+                    'description': 'Team member ID (optional)'
+                },
+                'related_ticket_id': {
+                    'type': 'integer',
+                    'description': 'Link to support ticket (optional)'
+                },
+                'tags': {
+                    'type': 'array',
+                    'items': {'type': 'string'},
+                    'description': 'Task tags for categorization'
+                }
+            },
+            'required': ['title', 'description', 'priority']
+        },
+        mutates=True
+    )
+    @with_data_lock
     def tool_create_task(self, args):
         """Create a new task"""
         title = args.get('title')
@@ -2549,6 +6253,34 @@ class MCPServerHandler(BaseHTTPRequestHandler):
             self.log(f"❌ Failed to create task: {str(e)}")
             return {'success': False, 'error': str(e)}
 
+    @mcp_tool(
+        'list_tasks',
+        description='List tasks with filtering by status, priority, assignee',
+        input_schema={
+            'type': 'object',
+            'properties': {
+                'status': {
+                    'type': 'string',
+                    'enum': ['todo', 'in_progress', 'done', 'all'],
+                    'default': 'all'
+                },
+                'priority': {
+                    'type': 'string',
+                    'enum': ['low', 'medium', 'high', 'all'],
+                    'default': 'all'
+                },
+                'assignee': {
+                    'type': 'string',
+                    'description': 'Filter by assignee ID'
+                },
+                'limit': {
+                    'type': 'integer',
+                    'default': 10
+                }
+            }
+        },
+        cacheable=True
+    )
     def tool_list_tasks(self, args):
         """List tasks with filtering"""
         status_filter = args.get('status', 'all')
@@ -2597,6 +6329,36 @@ class MCPServerHandler(BaseHTTPRequestHandler):
             self.log(f"❌ Failed to list tasks: {str(e)}")
             return {'success': False, 'error': str(e)}
 
+    @mcp_tool(
+        'update_task',
+        description='Update task status, priority, assignee, or add notes',
+        input_schema={
+            'type': 'object',
+            'properties': {
+                'task_id': {
+                    'type': 'integer'
+                },
+                'status': {
+                    'type': 'string',
+                    'enum': ['todo', 'in_progress', 'done']
+                },
+                'priority': {
+                    'type': 'string',
+                    'enum': ['low', 'medium', 'high']
+                },
+                'assignee': {
+                    'type': 'string'
+                },
+                'note': {
+                    'type': 'string',
+                    'description': 'Add note to history'
+                }
+            },
+            'required': ['task_id']
+        },
+        mutates=True
+    )
+    @with_data_lock
     def tool_update_task(self, args):
         """Update task status, priority, assignee, or add notes"""
         task_id = args.get('task_id')
@@ -2691,6 +6453,20 @@ class MCPServerHandler(BaseHTTPRequestHandler):
             self.log(f"❌ Failed to update task: {str(e)}")
             return {'success': False, 'error': str(e)}
 
+    @mcp_tool(
+        'get_task',
+        description='Get full task details including history and linked ticket',
+        input_schema={
+            'type': 'object',
+            'properties': {
+                'task_id': {
+                    'type': 'integer'
+                }
+            },
+            'required': ['task_id']
+        },
+        cacheable=True
+    )
     def tool_get_task(self, args):
         """Get full task details"""
         task_id = args.get('task_id')
@@ -2713,6 +6489,20 @@ class MCPServerHandler(BaseHTTPRequestHandler):
             self.log(f"❌ Failed to get task: {str(e)}")
             return {'success': False, 'error': str(e)}
 
+    @mcp_tool(
+        'get_team_workload',
+        description='Get team members current workload and availability',
+        input_schema={
+            'type': 'object',
+            'properties': {
+                'role_filter': {
+                    'type': 'string',
+                    'description': 'Filter by role (optional)'
+                }
+            }
+        },
+        cacheable=True
+    )
     def tool_get_team_workload(self, args):
         """Get team members' workload and availability"""
         role_filter = args.get('role_filter')
@@ -2766,6 +6556,31 @@ class MCPServerHandler(BaseHTTPRequestHandler):
             self.log(f"❌ Failed to get team workload: {str(e)}")
             return {'success': False, 'error': str(e)}
 
+    @mcp_tool(
+        'search_similar_tasks',
+        description='Find similar tasks using semantic search',
+        input_schema={
+            'type': 'object',
+            'properties': {
+                'query': {
+                    'type': 'string',
+                    'description': 'Task description or keywords'
+                },
+                'limit': {
+                    'type': 'integer',
+                    'default': 5
+                },
+                'threshold': {
+                    'type': 'number',
+                    'default': 0.6
+                }
+            },
+            'required': ['query']
+        },
+        timeout=60,
+        concurrency='embedding',
+        cacheable=True
+    )
     def tool_search_similar_tasks(self, args):
         """Search for similar tasks using semantic similarity"""
         query = args.get('query')
@@ -2776,31 +6591,25 @@ class MCPServerHandler(BaseHTTPRequestHandler):
             return {'success': False, 'error': 'query is required'}
 
         try:
-            # Get embedding for query
-            embedding_result = self.tool_create_embedding({'text': query})
-            if not embedding_result.get('success'):
-                return {'success': False, 'error': 'Failed to create query embedding'}
-
-            query_embedding = embedding_result['embedding']
-
             # Load all tasks
             data = load_tasks()
             tasks = data['tasks']
 
-            # Calculate similarity for each task (using title + description)
-            similarities = []
-            for task in tasks:
-                task_text = f"{task['title']} {task['description']}"
+            # Embed the query and every task (title + description) in as few requests as possible
+            task_texts = [f"{task['title']} {task['description']}" for task in tasks]
+            embeddings, errors = embed_texts([query] + task_texts)
+            query_embedding = embeddings[0]
+            if not query_embedding:
+                return {'success': False, 'error': f'Failed to create query embedding: {errors.get(0)}'}
 
-                # Get embedding for task
-                task_emb_result = self.tool_create_embedding({'text': task_text})
-                if not task_emb_result.get('success'):
+            # Calculate similarity for each task
+            similarities = []
+            for task, task_embedding in zip(tasks, embeddings[1:]):
+                if not task_embedding:
                     continue
 
-                task_embedding = task_emb_result['embedding']
-
                 # Calculate cosine similarity
-                similarity = self.cosine_similarity(query_embedding, task_embedding)
+                similarity = _cosine_similarity(query_embedding, task_embedding)
 
                 if similarity >= threshold:
                     similarities.append({
@@ -2824,6 +6633,25 @@ class MCPServerHandler(BaseHTTPRequestHandler):
             self.log(f"❌ Failed to search similar tasks: {str(e)}")
             return {'success': False, 'error': str(e)}
 
+    @mcp_tool(
+        'create_webpage',
+        description='Create a simple HTML webpage with provided text content and deploy it to the web server',
+        input_schema={
+            'type': 'object',
+            'properties': {
+                'text': {
+                    'type': 'string',
+                    'description': 'The text content to display on the webpage'
+                },
+                'title': {
+                    'type': 'string',
+                    'description': 'Optional page title (defaults to first 50 chars of text)'
+                }
+            },
+            'required': ['text']
+        },
+        mutates=True
+    )
     def tool_create_webpage(self, args):
         """
         Create an HTML webpage with provided text
@@ -3024,23 +6852,302 @@ class MCPServerHandler(BaseHTTPRequestHandler):
         return [c for c in chunks if c]  # Remove empty chunks
 
     def log_message(self, format, *args):
-        """Custom log format"""
-        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        print(f'[{timestamp}] {format % args}')
+        """Access log line, formatted by the log writer thread"""
+        access_logger.info(format, *args)
+
+    def log_error(self, format, *args):
+        """HTTP-level error (bad request line, timeout, error response)"""
+        access_logger.warning(format, *args)
+
+class BoundedThreadPoolHTTPServer(HTTPServer):
+    """
+    HTTPServer that serves connections on a fixed pool of worker threads
+
+    Accepted connections wait in a bounded queue. When the queue is full the
+    connection is answered with 503 immediately instead of piling up behind
+    slow tool calls (Ollama embeddings, git, GitHub API).
+    """
+
+    def __init__(self, server_address, handler_class, workers=8, queue_size=32,
+                 bind_and_activate=True):
+        self.workers = max(1, int(workers))
+        self.pending = queue.Queue(maxsize=max(1, int(queue_size)))
+        # Let the kernel backlog hold at least as many connections as our queue
+        self.request_queue_size = max(self.request_queue_size, self.pending.maxsize)
+        # Connections being answered with 503 at the same time
+        self.rejecters = threading.BoundedSemaphore(16)
+        super().__init__(server_address, handler_class, bind_and_activate)
+        CONNECTION_QUEUE_DEPTH.set_function(self.pending.qsize)
+
+        self.worker_threads = []
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, name=f'mcp-worker-{i + 1}', daemon=True)
+            thread.start()
+            self.worker_threads.append(thread)
+
+    def get_request(self):
+        """Accept a connection"""
+        request, client_address = self.socket.accept()
+        # A shared pre-fork listener is non-blocking; served connections must not be
+        request.setblocking(True)
+        return request, client_address
+
+    def process_request(self, request, client_address):
+        """Queue an accepted connection for the worker pool"""
+        try:
+            self.pending.put_nowait((request, client_address))
+        except queue.Full:
+            self._reject_overloaded(request)
+
+    def _worker_loop(self):
+        """Serve queued connections until a stop marker arrives"""
+        while True:
+            item = self.pending.get()
+            if item is None:
+                break
+
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def _reject_overloaded(self, request):
+        """Answer 503 without waiting for a worker"""
+        if not self.rejecters.acquire(blocking=False):
+            # Flooded even beyond the rejection budget: just drop the connection
+            self.shutdown_request(request)
+            return
+        threading.Thread(target=self._send_overloaded, args=(request,), daemon=True).start()
+
+    def _send_overloaded(self, request):
+        """Consume the pending request and reply 503 so the client sees a clean error"""
+        body = json.dumps({
+            'jsonrpc': '2.0',
+            'id': None,
+            'error': {
+                'code': -32000,
+                'message': 'Server is busy, please retry later'
+            }
+        }).encode('utf-8')
+        head = (
+            'HTTP/1.1 503 Service Unavailable\r\n'
+            'Content-Type: application/json\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            'Retry-After: 1\r\n'
+            'Access-Control-Allow-Origin: *\r\n'
+            'Connection: close\r\n'
+            '\r\n'
+        ).encode('ascii')
+
+        try:
+            request.settimeout(1.0)
+            # Read headers and a small body; closing with unread data would reset the connection
+            reader = request.makefile('rb')
+            content_length = 0
+            for _ in range(100):
+                line = reader.readline(8192)
+                if not line or line in (b'\r\n', b'\n'):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                if name.strip().lower() == 'content-length' and value.strip().isdigit():
+                    content_length = int(value.strip())
+            if content_length <= 1024 * 1024:
+                reader.read(content_length)
+            reader.close()
+            request.sendall(head + body)
+        except OSError:
+            pass
+        finally:
+            self.shutdown_request(request)
+            self.rejecters.release()
+
+    def server_close(self):
+        """Stop workers and close the listening socket"""
+        super().server_close()
+        for _ in self.worker_threads:
+            try:
+                self.pending.put(None, timeout=1.0)
+            except queue.Full:
+                break
+
+def create_http_server(host, port, mode=None, workers=None, queue_size=None):
+    """Build the HTTP server for the configured serving mode"""
+    mode = mode or SERVER_CONFIG['mode']
+    server_address = (host, port)
 
-def run_server(host='0.0.0.0', port=8080, github_token=None):
+    if mode == 'single':
+        return HTTPServer(server_address, MCPServerHandler)
+    if mode == 'threaded':
+        return BoundedThreadPoolHTTPServer(
+            server_address,
+            MCPServerHandler,
+            workers=workers or SERVER_CONFIG['workers'],
+            queue_size=queue_size or SERVER_CONFIG['queue_size']
+        )
+    raise ValueError(f'Unknown server mode: {mode}')
+
+def _serve_prefork_worker(listener, workers, queue_size):
+    """Serve the inherited listening socket inside a pre-fork worker process"""
+    # Ctrl+C reaches the whole process group; only the supervisor reacts to it
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # The supervisor's writer thread does not exist after fork; each worker starts its own.
+    # Rotation is not safe across processes, so every worker writes its own file.
+    log_file = LOG_CONFIG['file']
+    if log_file:
+        base, ext = os.path.splitext(log_file)
+        log_file = f'{base}.{os.getpid()}{ext}'
+    configure_logging(file=log_file)
+
+    # Any worker may receive a /metrics scrape, so each publishes its metrics for the others
+    def publish_metrics():
+        while True:
+            with contextlib.suppress(OSError):
+                publish_metrics_snapshot()
+            time.sleep(METRICS_CONFIG['snapshot_interval'])
+    threading.Thread(target=publish_metrics, name='mcp-metrics', daemon=True).start()
+
+    httpd = BoundedThreadPoolHTTPServer(
+        listener.getsockname(),
+        MCPServerHandler,
+        workers=workers,
+        queue_size=queue_size,
+        bind_and_activate=False
+    )
+    httpd.socket.close()
+    httpd.socket = listener
+
+    # shutdown() blocks until serve_forever returns, so it cannot run in the signal handler itself
+    def stop(signum, frame):
+        threading.Thread(target=httpd.shutdown, daemon=True).start()
+    signal.signal(signal.SIGTERM, stop)
+    # Signals were blocked across fork(); one sent meanwhile is delivered to the handler above now
+    signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGTERM, signal.SIGINT})
+
+    try:
+        httpd.serve_forever()
+    finally:
+        httpd.server_close()
+        CALL_RECORDER.flush(timeout=2)
+        stop_logging()
+
+def run_prefork_server(host, port, processes=None, workers=None, queue_size=None):
+    """
+    Serve with N worker processes sharing one listening socket
+
+    The supervisor binds the socket, forks the workers (each running the
+    threaded server on the inherited fd) and restarts any worker that dies
+    until it receives SIGTERM or SIGINT.
+    """
+    if not hasattr(os, 'fork'):
+        raise ValueError('prefork mode requires os.fork (not available on this platform)')
+
+    processes = processes or SERVER_CONFIG['processes'] or os.cpu_count() or 1
+    workers = workers or SERVER_CONFIG['workers']
+    queue_size = queue_size or SERVER_CONFIG['queue_size']
+
+    if not METRICS_CONFIG['snapshot_dir']:
+        METRICS_CONFIG['snapshot_dir'] = os.path.join(CRM_DATA_DIR, 'metrics')
+    os.makedirs(METRICS_CONFIG['snapshot_dir'], exist_ok=True)
+    # Snapshots of a previous run describe processes that are gone
+    for name in os.listdir(METRICS_CONFIG['snapshot_dir']):
+        with contextlib.suppress(OSError):
+            os.unlink(os.path.join(METRICS_CONFIG['snapshot_dir'], name))
+
+    listener = socket.create_server((host, port), backlog=max(128, queue_size * processes))
+    # Workers race for accept(); losers must return to select() instead of blocking
+    listener.setblocking(False)
+
+    children = {}  # pid -> start time
+    stopping = False
+
+    def spawn():
+        # Unflushed output would otherwise be written again by every child
+        sys.stdout.flush()
+        sys.stderr.flush()
+        # Until the child installs its own handlers, a SIGTERM would run the supervisor's handler there
+        signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGTERM, signal.SIGINT})
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 0
+            try:
+                _serve_prefork_worker(listener, workers, queue_size)
+            except BaseException:
+                import traceback
+                traceback.print_exc()
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+        children[pid] = time.time()
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGTERM, signal.SIGINT})
+
+    def stop(signum, frame):
+        nonlocal stopping
+        if stopping:
+            return
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(processes):
+        spawn()
+
+    logger.info('👷 Supervisor %s started workers: %s', os.getpid(), sorted(children))
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+
+        started_at = children.pop(pid, None)
+        if started_at is None:
+            continue
+        JOB_MANAGER.mark_interrupted(owner_pid=pid)
+        with contextlib.suppress(OSError):
+            os.unlink(metrics_snapshot_path(pid))
+        if stopping:
+            continue
+
+        logger.warning('⚠️ Worker %s exited with status %s, restarting', pid, status)
+        if time.time() - started_at < 1.0:
+            # Crash loop guard: do not fork as fast as the worker dies
+            time.sleep(1.0)
+        if not stopping:
+            spawn()
+
+    listener.close()
+    print('\n\n🛑 Server stopped')
+
+def run_server(host='0.0.0.0', port=8080, github_token=None, mode=None, workers=None, queue_size=None,
+               processes=None):
     """Start MCP HTTP server"""
+    configure_logging()
     init_database()
     load_crm_data()
     init_task_storage()
+    JOB_MANAGER.recover()
+    # Serialize the tool catalogues once, before any worker process is forked
+    for profile in [None] + list(TOOL_PROFILES):
+        tools_list_catalogue(profile)
 
     # Set GitHub token if provided
     if github_token:
         set_github_token(github_token)
         print(f'✅ GitHub token configured')
 
-    server_address = (host, port)
-    httpd = HTTPServer(server_address, MCPServerHandler)
+    mode = mode or SERVER_CONFIG['mode']
+    httpd = None
+    if mode != 'prefork':
+        httpd = create_http_server(host, port, mode=mode, workers=workers, queue_size=queue_size)
 
     print('=' * 70)
     print('🚀 MCP HTTP Server - Local Mode with Ollama & GitHub'.center(70))
@@ -3048,39 +7155,33 @@ def run_server(host='0.0.0.0', port=8080, github_token=None):
     print(f'Server: http://{host}:{port}')
     print(f'From Android emulator: http://10.0.2.2:{port}')
     print(f'From real device: http://<your-computer-ip>:{port}')
+    if httpd is None:
+        process_count = processes or SERVER_CONFIG['processes'] or os.cpu_count() or 1
+        print(f'Mode: pre-fork ({process_count} processes × {workers or SERVER_CONFIG["workers"]} workers)')
+    elif isinstance(httpd, BoundedThreadPoolHTTPServer):
+        print(f'Mode: threaded ({httpd.workers} workers, queue size {httpd.pending.maxsize})')
+    else:
+        print('Mode: single-threaded')
     print()
-    print('Available Tools (22):')
-    print('  🔮 create_embedding      - Generate embeddings using local Ollama')
-    print('  📝 save_document         - Save document with embeddings to local DB')
-    print('  🔍 search_similar        - Search similar documents in local DB')
-    print('  🌐 semantic_search       - Search relevant chunks from local DB')
-    print('  📄 process_pdf           - Extract text from PDF, chunk, and index locally')
-    print('  📝 process_text_chunks   - Process extracted text into chunks locally')
-    print('  📦 get_repo              - Get GitHub repository information')
-    print('  🔎 search_code           - Search code on GitHub')
-    print('  🐛 create_issue          - Create GitHub issue')
-    print('  📋 list_issues           - List GitHub issues')
-    print('  📝 list_commits          - List repository commits')
-    print('  📄 get_repo_content      - Get file content from GitHub')
-    print('  🎫 get_ticket            - Get support ticket details by ID')
-    print('  📋 list_user_tickets     - List all tickets for a user')
-    print('  ➕ create_ticket         - Create new support ticket')
-    print('  ✏️  update_ticket         - Update ticket status or add notes')
-    print('  ✅ create_task           - Create new task with priority and assignment')
-    print('  📋 list_tasks            - List tasks with filters (status, priority, assignee)')
-    print('  ✏️  update_task           - Update task status, priority, or assignee')
-    print('  📄 get_task              - Get full task details with history')
-    print('  👥 get_team_workload     - Get team members workload and availability')
-    print('  🔍 search_similar_tasks  - Find similar tasks using semantic search')
+    # Listed from the registry so the banner cannot drift from tools/list
+    tools = [spec for spec in TOOL_REGISTRY.values() if not spec.admin]
+    print(f'Available Tools ({len(tools)}):')
+    for spec in tools:
+        summary = spec.description.split('. ', 1)[0].rstrip('.')
+        if len(summary) > 60:
+            summary = summary[:57].rstrip() + '...'
+        print(f'  • {spec.name:<22} - {summary}')
+    print()
+    print('Tool profiles (X-MCP-Profile header, ?profile= or initialize params):')
+    for profile, names in TOOL_PROFILES.items():
+        print(f'  • {profile:<14} {len(names)} tools')
     print()
     print('Databases:')
     print(f'  📦 Embeddings: {EMBEDDINGS_DB_PATH}')
     print()
-    print('Ollama Integration:')
-    print(f'  • API URL: {OLLAMA_API_URL}')
-    print('  • Model: nomic-embed-text')
-    print('  • Embedding dimensions: 768')
-    print('  • Status: Local Mac instance')
+    print('Embeddings:')
+    print(f'  • Provider: {get_embedding_provider().identity}')
+    print(f'  • Ollama API URL: {OLLAMA_API_URL}')
     print()
     print('Supported File Types:')
     print('  • PDF (.pdf) - Client-side extraction via PDFBox')
@@ -3090,11 +7191,17 @@ def run_server(host='0.0.0.0', port=8080, github_token=None):
     print('Press Ctrl+C to stop')
     print('=' * 70)
     print()
-    
+
+    if httpd is None:
+        run_prefork_server(host, port, processes=processes, workers=workers, queue_size=queue_size)
+        return
+
     try:
         httpd.serve_forever()
     except KeyboardInterrupt:
         print('\n\n🛑 Server stopped')
+    finally:
+        httpd.server_close()
 
 if __name__ == '__main__':
     import sys
@@ -3102,4 +7209,22 @@ if __name__ == '__main__':
     port = int(sys.argv[1]) if len(sys.argv) > 1 else 8080
     # Get GitHub token from environment or use default from SecureData
     github_token = os.environ.get('GITHUB_TOKEN', '')
-    run_server(port=port, github_token=github_token)
+    # Serving mode and pool sizes can be tuned without editing the file
+    mode = os.environ.get('MCP_SERVER_MODE') or None
+    workers = int(os.environ['MCP_WORKERS']) if os.environ.get('MCP_WORKERS') else None
+    queue_size = int(os.environ['MCP_QUEUE_SIZE']) if os.environ.get('MCP_QUEUE_SIZE') else None
+    processes = int(os.environ['MCP_PROCESSES']) if os.environ.get('MCP_PROCESSES') else None
+    TRACE_CONFIG['export_file'] = os.environ.get('MCP_TRACE_FILE') or TRACE_CONFIG['export_file']
+    ADMIN_CONFIG['token'] = os.environ.get('MCP_ADMIN_TOKEN') or ADMIN_CONFIG['token']
+    RECORDER_CONFIG['file'] = os.environ.get('MCP_RECORD_FILE') or RECORDER_CONFIG['file']
+    EMBEDDING_CONFIG['provider'] = os.environ.get('MCP_EMBEDDING_PROVIDER') or EMBEDDING_CONFIG['provider']
+    EMBEDDING_CONFIG['model'] = os.environ.get('MCP_EMBEDDING_MODEL') or EMBEDDING_CONFIG['model']
+    # Logging: MCP_LOG_SAMPLE is a list like "get_job_status=0.1,list_jobs=0.1"
+    LOG_CONFIG['level'] = os.environ.get('MCP_LOG_LEVEL', LOG_CONFIG['level'])
+    LOG_CONFIG['format'] = os.environ.get('MCP_LOG_FORMAT', LOG_CONFIG['format'])
+    LOG_CONFIG['file'] = os.environ.get('MCP_LOG_FILE') or LOG_CONFIG['file']
+    for item in filter(None, os.environ.get('MCP_LOG_SAMPLE', '').split(',')):
+        tool_name, _, rate = item.partition('=')
+        LOG_CONFIG['sample_rates'][tool_name.strip()] = float(rate)
+    run_server(port=port, github_token=github_token, mode=mode, workers=workers, queue_size=queue_size,
+               processes=processes)
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Replay a recorded tools/call trace against an MCP server
+
+Reads the JSONL file written by the server's call recorder (MCP_RECORD_FILE)
+and sends every call as a JSON-RPC tools/call: with the recorded pacing
+(--speed 1), N times faster (--speed N) or as fast as the connections allow
+(--max). Arguments the recorder replaced by a hash are regenerated with the
+same size. Prints p50/p95/p99 latency per tool; with pacing, latency runs
+from the time a call was due, so time spent waiting for a free connection
+counts (and is also shown on its own as queue p99). Calls to tools that change
+state (GitHub issues, CRM tickets, tasks) are skipped unless
+--include-mutating is given.
+
+Usage:
+    python3 replay_trace.py calls.jsonl --url http://localhost:8080 --speed 2
+    python3 replay_trace.py calls.jsonl --max --concurrency 16 --tool semantic_search
+"""
+
+import argparse
+import http.client
+import json
+import math
+import random
+import sys
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+# Tools that change state, for traces recorded before records carried a 'mutates' flag
+MUTATING_TOOLS = {
+    'save_document', 'process_pdf', 'process_text_chunks', 'cancel_job', 'create_issue', 'create_ticket',
+    'update_ticket', 'create_task', 'update_task', 'create_webpage'
+}
+
+
+def load_trace(path, tools=None, limit=None):
+    """Read recorded calls in time order, optionally only some tools"""
+    records = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A line torn by a crash while recording
+                continue
+            if tools and record.get('tool') not in tools:
+                continue
+            records.append(record)
+    records.sort(key=lambda record: record.get('t', 0))
+    return records[:limit] if limit else records
+
+
+def is_mutating(record):
+    """Whether a recorded call changed state on the server (or beyond, e.g. on GitHub)"""
+    return bool(record.get('mutates', record.get('tool') in MUTATING_TOOLS))
+
+
+def restore_blobs(value, rng):
+    """Stand-ins of the recorded size for arguments the recorder hashed out"""
+    if isinstance(value, dict):
+        if '$blob' in value:
+            if value.get('type') == 'list':
+                return [round(rng.uniform(-1, 1), 6) for _ in range(value['len'])]
+            filler = 'lorem ipsum dolor sit amet '
+            return (filler * (value['len'] // len(filler) + 1))[:value['len']]
+        return {key: restore_blobs(item, rng) for key, item in value.items()}
+    if isinstance(value, list):
+        return [restore_blobs(item, rng) for item in value]
+    return value
+
+
+class ReplayClient:
+    """JSON-RPC client with one keep-alive connection per thread"""
+
+    def __init__(self, url, headers=None, timeout=120):
+        parts = urllib.parse.urlsplit(url)
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.netloc = parts.netloc
+        self.path = parts.path or '/'
+        self.headers = dict({'Content-Type': 'application/json'}, **(headers or {}))
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def call(self, request_id, tool_name, arguments, started=None):
+        """
+        Send one tools/call; return (latency in seconds, 'ok' | 'failed' | 'error')
+
+        Latency runs from started (a time.perf_counter() value), by default
+        the moment the request is sent.
+        """
+        body = json.dumps({
+            'jsonrpc': '2.0',
+            'id': request_id,
+            'method': 'tools/call',
+            'params': {'name': tool_name, 'arguments': arguments}
+        }, ensure_ascii=False).encode('utf-8')
+
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = self.connection_class(self.netloc, timeout=self.timeout)
+
+        if started is None:
+            started = time.perf_counter()
+        try:
+            conn.request('POST', self.path, body=body, headers=self.headers)
+            response = conn.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            self.local.conn = None
+            return time.perf_counter() - started, 'error'
+        latency = time.perf_counter() - started
+
+        if response.status != 200:
+            return latency, 'error'
+        try:
+            payload = json.loads(data)
+        except ValueError:
+            return latency, 'error'
+        if 'error' in payload:
+            return latency, 'error'
+        result = payload.get('result') or {}
+        structured = result.get('structuredContent')
+        if structured is None and result.get('content'):
+            try:
+                structured = json.loads(result['content'][0].get('text', ''))
+            except (ValueError, AttributeError):
+                structured = None
+        if isinstance(structured, dict) and structured.get('success') is False:
+            return latency, 'failed'
+        return latency, 'ok'
+
+
+def replay(records, url, speed=1.0, concurrency=8, headers=None, timeout=120, seed=0):
+    """
+    Send the recorded calls and collect their outcomes
+
+    speed=None sends as fast as the connections allow; otherwise call i is
+    due (t_i - t_0) / speed seconds after the start, and its latency is
+    measured from then rather than from when a connection got free: a slow
+    server must not get to delay the calls that would show it is slow.
+    Returns ({tool: [(latency, status, queued)]}, wall seconds); queued is
+    the time between the call being due (or submitted) and being sent.
+    """
+    rng = random.Random(seed)
+    calls = [(record['tool'], restore_blobs(record.get('args') or {}, rng)) for record in records]
+    client = ReplayClient(url, headers=headers, timeout=timeout)
+    results = {}
+    lock = threading.Lock()
+
+    def run(request_id, tool_name, arguments, due):
+        queued = time.perf_counter() - due
+        latency, status = client.call(request_id, tool_name, arguments, started=due if speed else None)
+        with lock:
+            results.setdefault(tool_name, []).append((latency, status, queued))
+
+    origin = records[0].get('t', 0) if records else 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for request_id, (record, (tool_name, arguments)) in enumerate(zip(records, calls), start=1):
+            due = time.perf_counter()
+            if speed:
+                due = start + (record.get('t', origin) - origin) / speed
+                if due > time.perf_counter():
+                    time.sleep(due - time.perf_counter())
+            pool.submit(run, request_id, tool_name, arguments, due)
+    return results, time.perf_counter() - start
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an ascending list"""
+    if not sorted_values:
+        return None
+    rank = max(0, math.ceil(p / 100 * len(sorted_values)) - 1)
+    return sorted_values[rank]
+
+
+def summarize(results, wall_seconds, records=()):
+    """Per-tool call counts and latency percentiles in milliseconds"""
+    recorded = {}
+    for record in records:
+        if record.get('ms') is not None:
+            recorded.setdefault(record['tool'], []).append(record['ms'])
+
+    def row(outcomes, recorded_ms):
+        latencies = sorted(latency * 1000 for latency, _, _ in outcomes)
+        queued = sorted(queued * 1000 for _, _, queued in outcomes)
+        statuses = [status for _, status, _ in outcomes]
+        return {
+            'calls': len(outcomes),
+            'failed': statuses.count('failed'),
+            'errors': statuses.count('error'),
+            'p50_ms': percentile(latencies, 50),
+            'p95_ms': percentile(latencies, 95),
+            'p99_ms': percentile(latencies, 99),
+            'max_ms': latencies[-1] if latencies else None,
+            'queue_p99_ms': percentile(queued, 99),
+            'recorded_p50_ms': percentile(sorted(recorded_ms), 50)
+        }
+
+    tools = {tool_name: row(outcomes, recorded.get(tool_name, []))
+             for tool_name, outcomes in sorted(results.items())}
+    everything = [outcome for outcomes in results.values() for outcome in outcomes]
+    total = row(everything, [ms for values in recorded.values() for ms in values])
+    return {
+        'tools': tools,
+        'total': total,
+        'wall_seconds': round(wall_seconds, 3),
+        'calls_per_second': round(len(everything) / wall_seconds, 2) if wall_seconds else None
+    }
+
+
+def format_summary(summary):
+    """Text table of a summary"""
+    def ms(value):
+        return f'{value:9.1f}' if value is not None else f'{"-":>9}'
+
+    lines = [f'{"tool":<28}{"calls":>7}{"failed":>8}{"errors":>8}{"p50 ms":>9}{"p95 ms":>9}'
+             f'{"p99 ms":>9}{"max ms":>9}{"queue p99":>11}{"rec p50":>9}']
+    rows = list(summary['tools'].items()) + [('ALL', summary['total'])]
+    for name, row in rows:
+        lines.append(f'{name:<28}{row["calls"]:>7}{row["failed"]:>8}{row["errors"]:>8}'
+                     f'{ms(row["p50_ms"])}{ms(row["p95_ms"])}{ms(row["p99_ms"])}{ms(row["max_ms"])}'
+                     f'  {ms(row["queue_p99_ms"])}{ms(row["recorded_p50_ms"])}')
+    lines.append(f'{summary["total"]["calls"]} calls in {summary["wall_seconds"]} s '
+                 f'({summary["calls_per_second"]} calls/s)')
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay a recorded MCP tools/call trace and report latency per tool')
+    parser.add_argument('trace', help='JSONL file written by the server (MCP_RECORD_FILE)')
+    parser.add_argument('--url', default='http://localhost:8080', help='MCP server URL (default: %(default)s)')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='Pacing: 1 = as recorded, 10 = ten times faster (default: %(default)s)')
+    parser.add_argument('--max', action='store_true', help='Ignore the recorded pacing: maximum throughput')
+    parser.add_argument('--concurrency', type=int, default=8, help='Parallel connections (default: %(default)s)')
+    parser.add_argument('--tool', action='append', help='Only replay this tool (repeatable)')
+    parser.add_argument('--limit', type=int, help='Replay only the first N calls')
+    parser.add_argument('--include-mutating', action='store_true',
+                        help='Also replay calls that change state (opens real GitHub issues, edits CRM data)')
+    parser.add_argument('--header', action='append', default=[],
+                        help='Extra request header, e.g. "X-MCP-Profile: rag" (repeatable)')
+    parser.add_argument('--timeout', type=float, default=120, help='Per-call timeout in seconds')
+    parser.add_argument('--json', action='store_true', help='Print the summary as JSON')
+    args = parser.parse_args(argv)
+
+    headers = {}
+    for header in args.header:
+        name, _, value = header.partition(':')
+        headers[name.strip()] = value.strip()
+
+    records = load_trace(args.trace, tools=args.tool)
+    if not args.include_mutating:
+        mutating = sum(1 for record in records if is_mutating(record))
+        if mutating:
+            print(f'Skipping {mutating} calls to tools that change state (--include-mutating replays them)',
+                  file=sys.stderr)
+            records = [record for record in records if not is_mutating(record)]
+    if args.limit:
+        records = records[:args.limit]
+    if not records:
+        print('No calls to replay', file=sys.stderr)
+        return 1
+
+    speed = None if args.max else args.speed
+    results, wall_seconds = replay(records, args.url, speed=speed, concurrency=args.concurrency,
+                                   headers=headers, timeout=args.timeout)
+    summary = summarize(results, wall_seconds, records)
+    print(json.dumps(summary, indent=2) if args.json else format_summary(summary))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,2393 @@
+#!/usr/bin/env python3
+"""
+Test Suite for MCP HTTP Server
+Tests JSON-RPC protocol handling, serving modes and database operations
+"""
+
+import unittest
+import json
+import os
+import tempfile
+import shutil
+import threading
+import multiprocessing
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+import urllib.error
+import http.client
+import gzip
+import zlib
+import io
+import queue
+import logging
+import tracemalloc
+import importlib.util
+from http.server import HTTPServer, ThreadingHTTPServer, BaseHTTPRequestHandler
+from unittest.mock import patch
+from concurrent.futures import ThreadPoolExecutor
+import http_mcp_server
+import replay_trace
+from http_mcp_server import (
+    MCPServerHandler,
+    BoundedThreadPoolHTTPServer,
+    create_http_server,
+    init_database
+)
+
+
+class TestMCPServerHandler(unittest.TestCase):
+    """Base class: isolated data directory for each test"""
+
+    def setUp(self):
+        """Point databases and JSON stores at a temporary directory"""
+        self.test_dir = tempfile.mkdtemp()
+        self.original_embeddings_db_path = http_mcp_server.EMBEDDINGS_DB_PATH
+        self.original_crm_data_dir = http_mcp_server.CRM_DATA_DIR
+        http_mcp_server.EMBEDDINGS_DB_PATH = os.path.join(self.test_dir, 'test_embeddings.db')
+        http_mcp_server.CRM_DATA_DIR = self.test_dir
+
+        init_database()
+        http_mcp_server.init_task_storage()
+        # Vectors cached by an earlier test must not hide a test's embedding fake
+        http_mcp_server.EMBEDDING_CACHE.clear()
+
+        # Create handler instance without calling __init__
+        self.handler = object.__new__(MCPServerHandler)
+
+    def tearDown(self):
+        """Restore paths and remove temporary data"""
+        http_mcp_server.EMBEDDINGS_DB_PATH = self.original_embeddings_db_path
+        http_mcp_server.CRM_DATA_DIR = self.original_crm_data_dir
+        shutil.rmtree(self.test_dir)
+
+
+class LiveServerMixin:
+    """Helpers for tests that talk to a real server over HTTP"""
+
+    def start_server(self, httpd):
+        """Serve in a background thread and stop on cleanup"""
+        thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+        thread.start()
+
+        def stop():
+            httpd.shutdown()
+            httpd.server_close()
+        self.addCleanup(stop)
+        return f'http://127.0.0.1:{httpd.server_address[1]}'
+
+    def post(self, url, payload, timeout=10):
+        """POST a JSON-RPC payload and return (status, parsed body)"""
+        req = urllib.request.Request(
+            url,
+            data=json.dumps(payload).encode('utf-8'),
+            headers={'Content-Type': 'application/json'}
+        )
+        try:
+            with urllib.request.urlopen(req, timeout=timeout) as response:
+                return response.status, json.loads(response.read().decode('utf-8'))
+        except urllib.error.HTTPError as e:
+            return e.code, json.loads(e.read().decode('utf-8') or 'null')
+
+
+class TestJSONRPCProtocol(TestMCPServerHandler):
+    """Test JSON-RPC 2.0 protocol handling"""
+
+    def test_initialize_request(self):
+        """Test initialize method"""
+        response = self.handler.handle_mcp_request({'jsonrpc': '2.0', 'id': 1, 'method': 'initialize'})
+
+        self.assertEqual(response['id'], 1)
+        self.assertEqual(response['result']['serverInfo']['name'], 'Python HTTP MCP Server')
+
+    def test_tools_list_request(self):
+        """Test tools/list method"""
+        response = self.handler.handle_mcp_request({'jsonrpc': '2.0', 'id': 2, 'method': 'tools/list'})
+
+        tool_names = [tool['name'] for tool in response['result']['tools']]
+        self.assertIn('semantic_search', tool_names)
+        self.assertIn('create_webpage', tool_names)
+
+    def test_unknown_method(self):
+        """Test unknown method returns error"""
+        response = self.handler.handle_mcp_request({'jsonrpc': '2.0', 'id': 3, 'method': 'unknown_method'})
+
+        self.assertEqual(response['error']['code'], -32601)
+
+    def test_tools_call_unknown_tool(self):
+        """Test tools/call with unknown tool name"""
+        response = self.handler.handle_mcp_request({
+            'jsonrpc': '2.0',
+            'id': 4,
+            'method': 'tools/call',
+            'params': {'name': 'unknown_tool', 'arguments': {}}
+        })
+
+        self.assertEqual(response['error']['code'], -32000)
+
+
+class TestBatchRequests(TestMCPServerHandler, LiveServerMixin):
+    """Test JSON-RPC 2.0 batch handling"""
+
+    def test_batch_returns_response_per_call(self):
+        """Test one payload carries every response with errors kept separate"""
+        responses = self.handler.handle_batch_request([
+            {'jsonrpc': '2.0', 'id': 'a', 'method': 'tools/call',
+             'params': {'name': 'list_tasks', 'arguments': {}}},
+            {'jsonrpc': '2.0', 'id': 'b', 'method': 'no_such_method'},
+            {'jsonrpc': '2.0', 'id': 'c', 'method': 'tools/call',
+             'params': {'name': 'get_team_workload', 'arguments': {}}}
+        ])
+
+        self.assertEqual([r['id'] for r in responses], ['a', 'b', 'c'])
+        self.assertIn('result', responses[0])
+        self.assertEqual(responses[1]['error']['code'], -32601)
+        self.assertIn('result', responses[2])
+
+    def test_batch_calls_run_concurrently(self):
+        """Test independent calls overlap instead of running one after another"""
+        barrier = threading.Barrier(3, timeout=5)
+
+        def waiting_tool(handler, args):
+            barrier.wait()
+            return {'success': True}
+
+        # Different arguments: identical calls would be executed only once
+        calls = [
+            {'jsonrpc': '2.0', 'id': i, 'method': 'tools/call',
+             'params': {'name': 'list_tasks', 'arguments': {'assignee': f'developer_{i}'}}}
+            for i in range(3)
+        ]
+        with patch.object(MCPServerHandler, 'tool_list_tasks', waiting_tool):
+            responses = self.handler.handle_batch_request(calls)
+
+        # A sequential run would break the barrier and fail every call
+        self.assertTrue(all('result' in r for r in responses))
+
+    def test_mutating_calls_run_in_order(self):
+        """Test state-changing calls never overlap and keep batch order"""
+        calls = [
+            {'jsonrpc': '2.0', 'id': i, 'method': 'tools/call',
+             'params': {'name': 'create_task', 'arguments': {'title': f'Task {i}', 'description': 'Batch'}}}
+            for i in range(4)
+        ]
+        active = []
+        original = MCPServerHandler.tool_create_task
+
+        def tracking_tool(handler, args):
+            active.append(args['title'])
+            self.assertEqual(len(active), 1)
+            time.sleep(0.05)
+            result = original(handler, args)
+            active.remove(args['title'])
+            return result
+
+        with patch.object(MCPServerHandler, 'tool_create_task', tracking_tool):
+            responses = self.handler.handle_batch_request(calls)
+
+        task_ids = [json.loads(r['result']['content'][0]['text'])['task_id'] for r in responses]
+        self.assertEqual(task_ids, sorted(task_ids))
+        stored = {t['id']: t['title'] for t in http_mcp_server.load_tasks()['tasks']}
+        self.assertEqual([stored[i] for i in task_ids], ['Task 0', 'Task 1', 'Task 2', 'Task 3'])
+
+    def test_identical_cacheable_calls_run_once(self):
+        """Test duplicate read-only calls share one execution but keep their ids"""
+        calls = []
+
+        def counting_tool(handler, args):
+            calls.append(args)
+            return {'success': True}
+
+        call = {'jsonrpc': '2.0', 'method': 'tools/call', 'params': {'name': 'list_tasks', 'arguments': {}}}
+        with patch.object(MCPServerHandler, 'tool_list_tasks', counting_tool):
+            responses = self.handler.handle_batch_request([dict(call, id=1), dict(call, id=2)])
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([r['id'] for r in responses], [1, 2])
+        self.assertEqual(responses[0]['result'], responses[1]['result'])
+
+    def test_invalid_batches(self):
+        """Test empty batches, invalid members and notifications"""
+        empty = self.handler.handle_batch_request([])
+        self.assertEqual(empty['error']['code'], -32600)
+
+        responses = self.handler.handle_batch_request([
+            42,
+            {'jsonrpc': '2.0', 'method': 'tools/list'},
+            {'jsonrpc': '2.0', 'id': 1, 'method': 'initialize'}
+        ])
+        self.assertEqual(len(responses), 2)
+        self.assertEqual(responses[0]['error']['code'], -32600)
+        self.assertEqual(responses[1]['id'], 1)
+
+        self.assertIsNone(self.handler.handle_batch_request([{'jsonrpc': '2.0', 'method': 'tools/list'}]))
+
+    def test_batch_over_http(self):
+        """Test a batch array posted to the server"""
+        url = self.start_server(BoundedThreadPoolHTTPServer(('127.0.0.1', 0), MCPServerHandler, workers=2))
+
+        status, body = self.post(url, [
+            {'jsonrpc': '2.0', 'id': 1, 'method': 'initialize'},
+            {'jsonrpc': '2.0', 'id': 2, 'method': 'tools/list'}
+        ])
+
+        self.assertEqual(status, 200)
+        self.assertEqual([r['id'] for r in body], [1, 2])
+
+
+class TestKeepAlive(TestMCPServerHandler, LiveServerMixin):
+    """Test HTTP/1.1 persistent connections and response framing"""
+
+    def setUp(self):
+        super().setUp()
+        self.url = self.start_server(BoundedThreadPoolHTTPServer(('127.0.0.1', 0), MCPServerHandler, workers=2))
+        self.port = int(self.url.rsplit(':', 1)[1])
+
+    def request(self, conn, body, headers=None, encode_chunked=False):
+        """Send one POST on an existing connection and read the full response"""
+        conn.request('POST', '/', body=body, headers=headers or {'Content-Type': 'application/json'},
+                     encode_chunked=encode_chunked)
+        response = conn.getresponse()
+        return response, response.read()
+
+    def test_connection_is_reused(self):
+        """Test several calls share one TCP connection"""
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=5)
+        self.addCleanup(conn.close)
+        payload = json.dumps({'jsonrpc': '2.0', 'id': 1, 'method': 'initialize'})
+
+        response, _ = self.request(conn, payload)
+        first_socket = conn.sock
+        self.assertEqual(response.version, 11)
+        self.assertIsNotNone(response.getheader('Content-Length'))
+
+        response, body = self.request(conn, payload)
+        self.assertIs(conn.sock, first_socket)
+        self.assertEqual(json.loads(body)['id'], 1)
+
+    def test_chunked_request_body(self):
+        """Test request bodies sent with chunked transfer coding"""
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=5)
+        self.addCleanup(conn.close)
+        chunks = iter([b'{"jsonrpc": "2.0", ', b'"id": 7, "method": "initialize"}'])
+
+        response, body = self.request(conn, chunks, encode_chunked=True)
+
+        self.assertEqual(response.status, 200)
+        self.assertEqual(json.loads(body)['id'], 7)
+
+    def test_errors_are_framed_and_keep_connection(self):
+        """Test error responses carry a JSON body and do not drop the connection"""
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=5)
+        self.addCleanup(conn.close)
+
+        response, body = self.request(conn, '{not json')
+        self.assertEqual(response.status, 400)
+        self.assertEqual(int(response.getheader('Content-Length')), len(body))
+        self.assertEqual(json.loads(body)['error']['code'], -32700)
+
+        first_socket = conn.sock
+        response, body = self.request(conn, json.dumps({'jsonrpc': '2.0', 'id': 2, 'method': 'initialize'}))
+        self.assertEqual(response.status, 200)
+        self.assertIs(conn.sock, first_socket)
+
+        # PUT is not supported: send_error must still be framed
+        conn.request('PUT', '/')
+        response = conn.getresponse()
+        body = response.read()
+        self.assertEqual(response.status, 501)
+        self.assertIn('error', json.loads(body))
+
+    def test_missing_length_is_rejected(self):
+        """Test a POST without Content-Length gets 411"""
+        with socket.create_connection(('127.0.0.1', self.port), timeout=5) as sock:
+            sock.sendall(b'POST / HTTP/1.1\r\nHost: x\r\n\r\n')
+            reply = sock.recv(4096)
+        self.assertTrue(reply.startswith(b'HTTP/1.1 411'))
+        self.assertIn(b'Connection: close', reply)
+
+    def test_malformed_length_is_rejected(self):
+        """Test a non-numeric or negative Content-Length gets a JSON 400 and closes the connection"""
+        for length in (b'abc', b'-1', b'+5'):
+            with socket.create_connection(('127.0.0.1', self.port), timeout=5) as sock:
+                sock.sendall(b'POST / HTTP/1.1\r\nHost: x\r\nContent-Length: ' + length + b'\r\n\r\n{}')
+                reply = b''
+                while True:
+                    data = sock.recv(4096)
+                    if not data:
+                        break
+                    reply += data
+            head, _, body = reply.partition(b'\r\n\r\n')
+            self.assertTrue(head.startswith(b'HTTP/1.1 400'), length)
+            self.assertIn(b'Connection: close', head)
+            self.assertEqual(json.loads(body)['error']['message'], 'Invalid Content-Length')
+
+    def test_request_cap_closes_connection(self):
+        """Test the per-connection request cap"""
+        payload = json.dumps({'jsonrpc': '2.0', 'id': 1, 'method': 'initialize'})
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=5)
+        self.addCleanup(conn.close)
+
+        with patch.dict(http_mcp_server.HTTP_CONFIG, {'max_requests_per_connection': 2}):
+            first, _ = self.request(conn, payload)
+            second, _ = self.request(conn, payload)
+
+        self.assertNotEqual(first.getheader('Connection'), 'close')
+        self.assertEqual(second.getheader('Connection'), 'close')
+
+    def test_idle_connection_times_out(self):
+        """Test idle keep-alive connections are closed by the server"""
+        with patch.object(MCPServerHandler, 'timeout', 0.3):
+            with socket.create_connection(('127.0.0.1', self.port), timeout=5) as sock:
+                started = time.time()
+                self.assertEqual(sock.recv(1), b'')
+                self.assertLess(time.time() - started, 3)
+
+
+class TestProgressStreaming(TestMCPServerHandler, LiveServerMixin):
+    """Test the streamable HTTP transport with SSE progress notifications"""
+
+    def setUp(self):
+        super().setUp()
+        self.url = self.start_server(BoundedThreadPoolHTTPServer(('127.0.0.1', 0), MCPServerHandler, workers=2))
+        embedding = patch.object(http_mcp_server, 'embed_texts',
+                                 lambda texts, provider=None: ([[0.1] * 8 for _ in texts], {}))
+        embedding.start()
+        self.addCleanup(embedding.stop)
+
+    def post_stream(self, payload, accept='application/json, text/event-stream'):
+        """POST and return (content type, list of SSE messages or parsed JSON)"""
+        req = urllib.request.Request(
+            self.url,
+            data=json.dumps(payload).encode('utf-8'),
+            headers={'Content-Type': 'application/json', 'Accept': accept}
+        )
+        with urllib.request.urlopen(req, timeout=10) as response:
+            content_type = response.getheader('Content-Type')
+            body = response.read().decode('utf-8')
+
+        if content_type != 'text/event-stream':
+            return content_type, json.loads(body)
+
+        messages = []
+        for event in body.split('\n\n'):
+            for line in event.splitlines():
+                if line.startswith('data: '):
+                    messages.append(json.loads(line[6:]))
+        return content_type, messages
+
+    def ingest_call(self, meta=None):
+        params = {
+            'name': 'process_text_chunks',
+            'arguments': {'text': 'Sentence number one. ' * 60, 'filename': 'notes.txt', 'chunk_size': 300}
+        }
+        if meta:
+            params['_meta'] = meta
+        return {'jsonrpc': '2.0', 'id': 5, 'method': 'tools/call', 'params': params}
+
+    def test_progress_notifications_streamed(self):
+        """Test ingestion progress arrives before the final response"""
+        content_type, messages = self.post_stream(self.ingest_call({'progressToken': 'ingest-1'}))
+
+        self.assertEqual(content_type, 'text/event-stream')
+        progress = [m for m in messages if m.get('method') == 'notifications/progress']
+        self.assertGreater(len(progress), 1)
+        self.assertTrue(all(m['params']['progressToken'] == 'ingest-1' for m in progress))
+
+        values = [m['params']['progress'] for m in progress]
+        self.assertEqual(values, sorted(values))
+        self.assertEqual(values[-1], progress[-1]['params']['total'])
+
+        final = messages[-1]
+        self.assertEqual(final['id'], 5)
+        self.assertIn('result', final)
+
+    def test_get_stream_not_offered(self):
+        """Test GET is answered with 405 as Streamable HTTP allows"""
+        with self.assertRaises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(self.url, timeout=5)
+        self.assertEqual(error.exception.code, 405)
+
+    def test_plain_json_without_progress_token(self):
+        """Test clients that do not ask for progress still get a JSON response"""
+        content_type, body = self.post_stream(self.ingest_call())
+
+        self.assertEqual(content_type, 'application/json')
+        self.assertEqual(body['id'], 5)
+
+    def test_progress_phases_only_increase(self):
+        """Test progress keeps growing across phases of one call"""
+        sent = []
+        context = http_mcp_server.RequestContext(progress_token='t', notify=sent.append)
+
+        context.report_progress(3, 3)
+        context.next_progress_phase()
+        context.report_progress(1, 4)
+        context.report_progress(4, 4)
+
+        self.assertEqual([m['params']['progress'] for m in sent], [3, 4, 7])
+        self.assertEqual(sent[-1]['params']['total'], 7)
+
+
+class TestServerModes(TestMCPServerHandler, LiveServerMixin):
+    """Test concurrent serving and admission control"""
+
+    def test_create_http_server_modes(self):
+        """Test serving mode selection"""
+        single = create_http_server('127.0.0.1', 0, mode='single')
+        self.addCleanup(single.server_close)
+        self.assertNotIsInstance(single, BoundedThreadPoolHTTPServer)
+        self.assertIsInstance(single, HTTPServer)
+
+        threaded = create_http_server('127.0.0.1', 0, mode='threaded', workers=3, queue_size=5)
+        self.addCleanup(threaded.server_close)
+        self.assertEqual(threaded.workers, 3)
+        self.assertEqual(threaded.pending.maxsize, 5)
+
+        with self.assertRaises(ValueError):
+            create_http_server('127.0.0.1', 0, mode='unknown')
+
+    def test_slow_tool_does_not_block_other_clients(self):
+        """Test tools/list is answered while another request is still running"""
+        release = threading.Event()
+        started = threading.Event()
+
+        def slow_tool(handler, args):
+            started.set()
+            release.wait(10)
+            return {'success': True}
+
+        url = self.start_server(BoundedThreadPoolHTTPServer(('127.0.0.1', 0), MCPServerHandler, workers=2))
+
+        with patch.object(MCPServerHandler, 'tool_git_status', slow_tool):
+            slow = threading.Thread(target=self.post, args=(url, {
+                'jsonrpc': '2.0', 'id': 1, 'method': 'tools/call',
+                'params': {'name': 'git_status', 'arguments': {}}
+            }))
+            slow.start()
+            self.assertTrue(started.wait(5))
+
+            status, body = self.post(url, {'jsonrpc': '2.0', 'id': 2, 'method': 'tools/list'}, timeout=5)
+            self.assertEqual(status, 200)
+            self.assertIn('tools', body['result'])
+
+            release.set()
+            slow.join(5)
+
+    def test_full_queue_answers_503(self):
+        """Test overload is rejected fast instead of queueing forever"""
+        release = threading.Event()
+        started = threading.Event()
+
+        def slow_tool(handler, args):
+            started.set()
+            release.wait(10)
+            return {'success': True}
+
+        httpd = BoundedThreadPoolHTTPServer(('127.0.0.1', 0), MCPServerHandler, workers=1, queue_size=1)
+        url = self.start_server(httpd)
+        call = {
+            'jsonrpc': '2.0', 'id': 1, 'method': 'tools/call',
+            'params': {'name': 'git_status', 'arguments': {}}
+        }
+
+        with patch.object(MCPServerHandler, 'tool_git_status', slow_tool):
+            busy = threading.Thread(target=self.post, args=(url, call))
+            busy.start()
+            self.assertTrue(started.wait(5))
+
+            # Second connection occupies the only queue slot
+            waiting = threading.Thread(target=self.post, args=(url, call))
+            waiting.start()
+            for _ in range(100):
+                if httpd.pending.full():
+                    break
+                time.sleep(0.02)
+
+            status, body = self.post(url, {'jsonrpc': '2.0', 'id': 3, 'method': 'tools/list'}, timeout=5)
+            self.assertEqual(status, 503)
+            self.assertEqual(body['error']['code'], -32000)
+
+            release.set()
+            busy.join(5)
+            waiting.join(5)
+
+
+class TestPreforkServer(TestMCPServerHandler, LiveServerMixin):
+    """Test the pre-fork multi-process serving mode"""
+
+    @unittest.skipUnless(os.path.exists('/proc/self/task') and hasattr(os, 'fork'), 'requires Linux /proc')
+    def test_prefork_serves_and_restarts_workers(self):
+        """Test workers share the socket and the supervisor replaces dead ones"""
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+
+        script = (
+            'import http_mcp_server as s\n'
+            f's.EMBEDDINGS_DB_PATH = {os.path.join(self.test_dir, "prefork.db")!r}\n'
+            f's.CRM_DATA_DIR = {self.test_dir!r}\n'
+            f's.run_server(host="127.0.0.1", port={port}, mode="prefork", processes=2, workers=2)\n'
+        )
+        supervisor = subprocess.Popen(
+            [sys.executable, '-c', script],
+            cwd=os.path.dirname(os.path.abspath(http_mcp_server.__file__)),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+        self.addCleanup(supervisor.kill)
+
+        def children():
+            path = f'/proc/{supervisor.pid}/task/{supervisor.pid}/children'
+            with open(path) as f:
+                return [int(pid) for pid in f.read().split()]
+
+        url = f'http://127.0.0.1:{port}'
+        for _ in range(50):
+            if len(children()) == 2:
+                try:
+                    self.post(url, {'jsonrpc': '2.0', 'id': 1, 'method': 'initialize'}, timeout=1)
+                    break
+                except OSError:
+                    pass
+            time.sleep(0.1)
+
+        status, body = self.post(url, {'jsonrpc': '2.0', 'id': 1, 'method': 'tools/list'})
+        self.assertEqual(status, 200)
+
+        victim = children()[0]
+        os.kill(victim, 9)
+        for _ in range(50):
+            current = children()
+            if len(current) == 2 and victim not in current:
+                break
+            time.sleep(0.1)
+        self.assertEqual(len(children()), 2)
+        self.assertNotIn(victim, children())
+
+        status, body = self.post(url, {'jsonrpc': '2.0', 'id': 2, 'method': 'initialize'})
+        self.assertEqual(status, 200)
+
+        supervisor.terminate()
+        self.assertEqual(supervisor.wait(10), 0)
+
+
+class TestJSONStores(TestMCPServerHandler):
+    """Test JSON store updates under concurrency"""
+
+    def test_concurrent_task_creation_keeps_unique_ids(self):
+        """Test parallel create_task calls do not lose or duplicate tasks"""
+        def create(i):
+            self.handler.tool_create_task({
+                'title': f'Task {i}',
+                'description': 'Parallel task',
+                'priority': 'low'
+            })
+
+        threads = [threading.Thread(target=create, args=(i,)) for i in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        tasks = http_mcp_server.load_tasks()['tasks']
+        self.assertEqual(len(tasks), 10)
+        self.assertEqual(len({t['id'] for t in tasks}), 10)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'requires fork')
+    def test_task_creation_consistent_across_processes(self):
+        """Test pre-fork style workers share tasks.json without lost updates"""
+        def worker(n):
+            handler = object.__new__(MCPServerHandler)
+            for i in range(5):
+                handler.tool_create_task({
+                    'title': f'Worker {n} task {i}',
+                    'description': 'Cross-process task',
+                    'priority': 'medium'
+                })
+
+        context = multiprocessing.get_context('fork')
+        processes = [context.Process(target=worker, args=(n,)) for n in range(3)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(30)
+            self.assertEqual(process.exitcode, 0)
+
+        data = http_mcp_server.load_tasks()
+        self.assertEqual(len(data['tasks']), 15)
+        self.assertEqual(len({t['id'] for t in data['tasks']}), 15)
+        self.assertEqual(data['next_id'], 16)
+
+    def test_crm_changes_from_other_workers_are_picked_up(self):
+        """Test CRM cache reloads when the files change on disk"""
+        http_mcp_server.write_json_atomic(
+            os.path.join(self.test_dir, 'crm_users.json'),
+            {'users': [{'id': 1, 'name': 'Ann', 'email': 'ann@example.com'}]}
+        )
+        http_mcp_server.write_json_atomic(os.path.join(self.test_dir, 'crm_tickets.json'), {'tickets': []})
+        http_mcp_server.load_crm_data()
+
+        # Another process appends a ticket
+        http_mcp_server.write_json_atomic(os.path.join(self.test_dir, 'crm_tickets.json'), {'tickets': [{
+            'id': 7, 'user_id': 1, 'title': 'Login', 'status': 'open', 'history': []
+        }]})
+
+        result = self.handler.tool_get_ticket({'ticket_id': 7})
+        self.assertTrue(result['success'])
+        self.assertEqual(result['user']['name'], 'Ann')
+
+
+class TestBackgroundJobs(TestMCPServerHandler):
+    """Test async tool calls executed as background jobs"""
+
+    def setUp(self):
+        super().setUp()
+        self.jobs = http_mcp_server.JobManager()
+        manager = patch.object(http_mcp_server, 'JOB_MANAGER', self.jobs)
+        manager.start()
+        self.addCleanup(manager.stop)
+        self.addCleanup(lambda: self.jobs._executor and self.jobs._executor.shutdown(wait=True))
+
+        self.release = threading.Event()
+        self.release.set()
+
+        def embed(texts, provider=None):
+            self.release.wait(10)
+            return [[0.1] * 8 for _ in texts], {}
+        embedding = patch.object(http_mcp_server, 'embed_texts', embed)
+        embedding.start()
+        self.addCleanup(embedding.stop)
+        # One chunk per embedding request, so a cancelled job stops between chunks
+        batches = patch.dict(http_mcp_server.EMBEDDING_CONFIG, {'batch_size': 1})
+        batches.start()
+        self.addCleanup(batches.stop)
+
+    def call(self, name, arguments):
+        response = self.handler.handle_tools_call(1, {'name': name, 'arguments': arguments})
+        return json.loads(response['result']['content'][0]['text'])
+
+    def start_ingest(self, **extra):
+        arguments = {'text': 'Sentence number one. ' * 60, 'filename': 'notes.txt',
+                     'chunk_size': 300, 'max_workers': 1, 'async': True}
+        arguments.update(extra)
+        return self.call('process_text_chunks', arguments)
+
+    def wait_for(self, job_id, statuses, timeout=10):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            job = self.call('get_job_status', {'job_id': job_id})['job']
+            if job['status'] in statuses:
+                return job
+            time.sleep(0.05)
+        self.fail(f'Job {job_id} did not reach {statuses}')
+
+    def test_async_call_returns_job_and_result(self):
+        """Test an async call returns a job id at once and the job ends with the tool result"""
+        started = self.start_ingest()
+        self.assertTrue(started['success'])
+        self.assertIn(started['status'], ('queued', 'running', 'succeeded'))
+
+        job = self.wait_for(started['job_id'], ('succeeded',))
+        self.assertEqual(job['tool'], 'process_text_chunks')
+        self.assertEqual(job['label'], 'notes.txt')
+        self.assertEqual(job['result']['chunks_saved'], job['result']['total_chunks'])
+        self.assertEqual(job['progress'], job['total'])
+        self.assertEqual(http_mcp_server.EmbeddingsDatabase.count_documents(), job['result']['chunks_saved'])
+
+    def test_cancel_running_job_keeps_partial_counts(self):
+        """Test cancelling a running job stops it and reports the chunks saved so far"""
+        self.release.clear()
+        job_id = self.start_ingest()['job_id']
+        self.wait_for(job_id, ('running',))
+
+        cancelled = self.call('cancel_job', {'job_id': job_id})
+        self.assertTrue(cancelled['job']['cancel_requested'])
+        self.release.set()
+
+        job = self.wait_for(job_id, ('cancelled',))
+        self.assertTrue(job['result']['cancelled'])
+        self.assertLess(job['result']['chunks_saved'], job['result']['total_chunks'])
+        self.assertEqual(job['result']['chunks_saved'] + job['result']['chunks_skipped'], job['result']['total_chunks'])
+        self.assertEqual(http_mcp_server.EmbeddingsDatabase.count_documents(), job['result']['chunks_saved'])
+
+    def test_cancel_queued_job(self):
+        """Test a job cancelled before it starts never runs"""
+        self.release.clear()
+        http_mcp_server.JOB_CONFIG['workers'], workers = 1, http_mcp_server.JOB_CONFIG['workers']
+        self.addCleanup(http_mcp_server.JOB_CONFIG.__setitem__, 'workers', workers)
+
+        first = self.start_ingest()['job_id']
+        second = self.start_ingest()['job_id']
+        self.assertEqual(self.call('cancel_job', {'job_id': second})['job']['status'], 'cancelled')
+        self.release.set()
+
+        self.wait_for(first, ('succeeded',))
+        self.assertIsNone(self.call('get_job_status', {'job_id': second})['job']['started_at'])
+
+    def test_list_jobs_and_unknown_job(self):
+        """Test listing jobs by status, the limit argument and looking up a missing job"""
+        job_id = self.start_ingest()['job_id']
+        self.wait_for(job_id, ('succeeded',))
+
+        listed = self.call('list_jobs', {'status': 'succeeded'})
+        self.assertEqual([job['job_id'] for job in listed['jobs']], [job_id])
+        self.assertNotIn('result', listed['jobs'][0])
+        self.assertEqual(self.call('list_jobs', {'status': 'failed'})['count'], 0)
+        self.assertFalse(self.call('get_job_status', {'job_id': 'missing'})['success'])
+
+        self.assertEqual(self.call('list_jobs', {'limit': -5})['count'], 1)
+        invalid = self.call('list_jobs', {'limit': 'ten'})
+        self.assertFalse(invalid['success'])
+        self.assertEqual(invalid['error'], 'limit must be an integer')
+
+    def test_unfinished_jobs_are_interrupted_on_restart(self):
+        """Test jobs left running by a stopped server are marked interrupted"""
+        self.release.clear()
+        job_id = self.start_ingest()['job_id']
+        self.wait_for(job_id, ('running',))
+
+        # What a freshly started server finds in the database
+        http_mcp_server.JobManager().recover()
+        self.assertEqual(self.jobs.get(job_id)['status'], 'interrupted')
+        self.release.set()
+
+
+class TestCancellation(TestMCPServerHandler):
+    """Test notifications/cancelled and per-call deadlines"""
+
+    def setUp(self):
+        super().setUp()
+        self.embedded = []
+
+        def embed(texts, provider=None):
+            # Slow like a busy Ollama, but bounded by the call's remaining time
+            time.sleep(min(0.2, http_mcp_server.call_timeout(0.2)))
+            self.embedded.extend(texts)
+            return [[0.1] * 8 for _ in texts], {}
+        embedding = patch.object(http_mcp_server, 'embed_texts', embed)
+        embedding.start()
+        self.addCleanup(embedding.stop)
+        batches = patch.dict(http_mcp_server.EMBEDDING_CONFIG, {'batch_size': 2})
+        batches.start()
+        self.addCleanup(batches.stop)
+
+    def ingest_params(self, meta=None):
+        params = {
+            'name': 'process_text_chunks',
+            'arguments': {'text': 'Sentence number one. ' * 200, 'filename': 'notes.txt',
+                          'chunk_size': 200, 'chunk_overlap': 0, 'max_workers': 2}
+        }
+        if meta:
+            params['_meta'] = meta
+        return params
+
+    def ingest(self, request_id, meta=None):
+        return self.handler.handle_tools_call(request_id, self.ingest_params(meta))
+
+    def test_deadline_stops_ingestion_with_partial_result(self):
+        """Test a call past its deadline stops early and returns its partial result with the error"""
+        started = time.time()
+        response = self.ingest(1, {'deadlineMs': 500})
+
+        self.assertLess(time.time() - started, 2)
+        self.assertEqual(response['error']['code'], -32001)
+        partial = response['error']['data']
+        self.assertGreater(partial['chunks_saved'], 0)
+        self.assertLess(partial['chunks_saved'], partial['total_chunks'])
+        # Every chunk is accounted for, and every saved row is counted
+        self.assertGreater(partial['chunks_skipped'], 0)
+        self.assertEqual(partial['chunks_saved'] + partial['chunks_failed'] + partial['chunks_skipped'],
+                         partial['total_chunks'])
+        self.assertEqual(http_mcp_server.EmbeddingsDatabase.count_documents(), partial['chunks_saved'])
+
+    def test_cancel_notification_stops_call(self):
+        """Test notifications/cancelled stops the call and no more chunks are embedded"""
+        responses = []
+        worker = threading.Thread(target=lambda: responses.append(self.ingest('ingest-7')))
+        worker.start()
+        time.sleep(0.3)
+
+        notification = {'jsonrpc': '2.0', 'method': 'notifications/cancelled',
+                        'params': {'requestId': 'ingest-7', 'reason': 'User left the screen'}}
+        self.assertIsNone(self.handler.handle_mcp_request(notification))
+        worker.join(5)
+
+        self.assertFalse(worker.is_alive())
+        self.assertEqual(responses[0]['error']['code'], -32800)
+        self.assertEqual(http_mcp_server.ACTIVE_CALLS, {})
+        embedded = len(self.embedded)
+        time.sleep(0.3)
+        self.assertEqual(len(self.embedded), embedded)
+
+    def test_cancel_only_reaches_the_sending_client(self):
+        """Test two clients behind one proxy host can use the same request id"""
+        def client(port, session_id=None):
+            handler = object.__new__(MCPServerHandler)
+            handler.client_address = ('127.0.0.1', port)
+            handler.headers = {'Mcp-Session-Id': session_id} if session_id else {}
+            return handler
+
+        first, second = client(50001), client(50002)
+        responses = {}
+        workers = [threading.Thread(target=lambda name=name, handler=handler: responses.__setitem__(
+                       name, handler.handle_tools_call(1, self.ingest_params())))
+                   for name, handler in (('first', first), ('second', second))]
+        for worker in workers:
+            worker.start()
+        time.sleep(0.3)
+        self.assertEqual(len(http_mcp_server.ACTIVE_CALLS), 2)
+
+        notification = {'jsonrpc': '2.0', 'method': 'notifications/cancelled', 'params': {'requestId': 1}}
+        second.handle_mcp_request(notification)
+        for worker in workers:
+            worker.join(10)
+        self.assertEqual(responses['second']['error']['code'], -32800)
+        self.assertIn('result', responses['first'])
+
+        # With a session, the notification may come over another connection; reused ids are all cancelled
+        sessions = [client(port, 'all.session-a') for port in (50003, 50004)]
+        workers = [threading.Thread(target=lambda handler=handler: responses.__setitem__(
+                       handler.client_address[1], handler.handle_tools_call(1, self.ingest_params())))
+                   for handler in sessions]
+        for worker in workers:
+            worker.start()
+        time.sleep(0.3)
+        client(50005, 'all.session-b').handle_mcp_request(notification)
+        client(50006, 'all.session-a').handle_mcp_request(notification)
+        for worker in workers:
+            worker.join(10)
+        self.assertEqual(responses[50003]['error']['code'], -32800)
+        self.assertEqual(responses[50004]['error']['code'], -32800)
+        self.assertEqual(http_mcp_server.ACTIVE_CALLS, {})
+
+    def test_cancel_unknown_request_is_ignored(self):
+        """Test cancelling a request that is not in flight is a no-op"""
+        notification = {'jsonrpc': '2.0', 'method': 'notifications/cancelled', 'params': {'requestId': 99}}
+        self.assertIsNone(self.handler.handle_mcp_request(notification))
+
+    def test_subprocess_killed_on_deadline_and_cancel(self):
+        """Test subprocesses are killed when the call runs out of time or is cancelled"""
+        context = http_mcp_server.RequestContext(deadline=time.monotonic() + 0.3)
+        token = http_mcp_server._request_context.set(context)
+        try:
+            started = time.time()
+            with self.assertRaises(subprocess.TimeoutExpired):
+                http_mcp_server.run_subprocess([sys.executable, '-c', 'import time; time.sleep(10)'])
+            self.assertLess(time.time() - started, 2)
+
+            context.deadline = None
+            threading.Timer(0.2, context.cancel).start()
+            with self.assertRaises(http_mcp_server.RequestCancelled):
+                http_mcp_server.run_subprocess([sys.executable, '-c', 'import time; time.sleep(10)'])
+            self.assertLess(time.time() - started, 3)
+        finally:
+            http_mcp_server._request_context.reset(token)
+
+    def test_deadline_caps_blocking_timeouts(self):
+        """Test call_timeout is capped by the remaining time and raises once it is over"""
+        self.assertEqual(http_mcp_server.call_timeout(30), 30)
+
+        context = http_mcp_server.RequestContext(deadline=time.monotonic() + 5)
+        token = http_mcp_server._request_context.set(context)
+        try:
+            self.assertLessEqual(http_mcp_server.call_timeout(30), 5)
+            context.deadline = time.monotonic() - 1
+            with self.assertRaises(http_mcp_server.DeadlineExceeded):
+                http_mcp_server.call_timeout(30)
+        finally:
+            http_mcp_server._request_context.reset(token)
+
+
+class TestToolRegistry(TestMCPServerHandler):
+    """Test registry-based tool dispatch and admission control"""
+
+    def test_registry_drives_tools_list(self):
+        """Test every listed tool is registered with a handler method"""
+        tools = self.handler.handle_tools_list(1)['result']['tools']
+
+        listed = [name for name, spec in http_mcp_server.TOOL_REGISTRY.items() if not spec.admin]
+        self.assertEqual([t['name'] for t in tools], listed)
+        for name, spec in http_mcp_server.TOOL_REGISTRY.items():
+            self.assertTrue(callable(spec.bind(self.handler)), name)
+            self.assertEqual(spec.input_schema['type'], 'object')
+        self.assertTrue(http_mcp_server.TOOL_REGISTRY['create_task'].mutates)
+        self.assertTrue(http_mcp_server.TOOL_REGISTRY['list_tasks'].cacheable)
+        self.assertIsNone(http_mcp_server.TOOL_REGISTRY['process_pdf'].timeout)
+
+    def test_registered_timeout_is_default_deadline(self):
+        """Test tools get their registered timeout unless the client sets deadlineMs"""
+        self.assertEqual(self.handler.call_deadline_seconds('git_status', {}), 30)
+        self.assertIsNone(self.handler.call_deadline_seconds('process_text_chunks', {}))
+        self.assertEqual(self.handler.call_deadline_seconds('git_status', {'deadlineMs': 1500}), 1.5)
+
+    def test_full_concurrency_class_is_rejected(self):
+        """Test a call waiting too long for its concurrency class fails with server busy"""
+        limiter = http_mcp_server.ConcurrencyLimiter({'git': 1})
+        config = dict(http_mcp_server.CONCURRENCY_CONFIG, wait_seconds=0.1)
+        with patch.object(http_mcp_server, 'TOOL_LIMITER', limiter), \
+                patch.object(http_mcp_server, 'CONCURRENCY_CONFIG', config):
+            with limiter.slot('git', 1):
+                response = self.handler.handle_tools_call(1, {'name': 'git_status', 'arguments': {}})
+            self.assertEqual(response['error']['code'], -32003)
+
+            response = self.handler.handle_tools_call(2, {'name': 'git_status', 'arguments': {'repo_path': '/nonexistent'}})
+            self.assertIn('result', response)
+
+
+class TestToolCatalogue(TestMCPServerHandler, LiveServerMixin):
+    """Test the pre-serialized, ETag-validated tools/list response"""
+
+    def setUp(self):
+        super().setUp()
+        url = self.start_server(BoundedThreadPoolHTTPServer(('127.0.0.1', 0), MCPServerHandler, workers=2))
+        self.conn = http.client.HTTPConnection(url[len('http://'):], timeout=5)
+        self.addCleanup(self.conn.close)
+
+    def tools_list(self, request_id=1, etag=None):
+        headers = {'Content-Type': 'application/json'}
+        if etag:
+            headers['If-None-Match'] = etag
+        body = json.dumps({'jsonrpc': '2.0', 'id': request_id, 'method': 'tools/list'})
+        self.conn.request('POST', '/', body=body, headers=headers)
+        response = self.conn.getresponse()
+        return response, response.read()
+
+    def test_tools_list_carries_stable_etag(self):
+        """Test the pre-serialized catalogue matches handle_tools_list and keeps its ETag"""
+        first, body = self.tools_list(request_id='a')
+        second, _ = self.tools_list(request_id=2)
+
+        self.assertEqual(first.status, 200)
+        self.assertTrue(first.getheader('ETag'))
+        self.assertEqual(first.getheader('ETag'), second.getheader('ETag'))
+        self.assertEqual(json.loads(body), self.handler.handle_tools_list('a'))
+
+    def test_matching_etag_answers_304(self):
+        """Test If-None-Match with the current ETag gets an empty 304 on a reusable connection"""
+        response, _ = self.tools_list()
+        etag = response.getheader('ETag')
+
+        not_modified, body = self.tools_list(etag=f'"stale", W/{etag}')
+        self.assertEqual(not_modified.status, 304)
+        self.assertEqual(body, b'')
+        self.assertEqual(not_modified.getheader('ETag'), etag)
+
+        # Connection is still usable after the bodiless response
+        refreshed, body = self.tools_list(etag='"stale"')
+        self.assertEqual(refreshed.status, 200)
+        self.assertIn('tools', json.loads(body)['result'])
+
+    def test_registering_a_tool_changes_etag(self):
+        """Test registering a tool invalidates the catalogue and its ETag"""
+        response, _ = self.tools_list()
+        etag = response.getheader('ETag')
+
+        def remove_tool():
+            http_mcp_server.TOOL_REGISTRY.pop('echo', None)
+            http_mcp_server._tools_list_cache.clear()
+        self.addCleanup(remove_tool)
+        http_mcp_server.mcp_tool('echo', 'Echo arguments back', {'type': 'object', 'properties': {}})(
+            lambda handler, args: args
+        )
+
+        response, body = self.tools_list(etag=etag)
+        self.assertEqual(response.status, 200)
+        self.assertNotEqual(response.getheader('ETag'), etag)
+        self.assertEqual(json.loads(body)['result']['tools'][-1]['name'], 'echo')
+
+
+class TestToolProfiles(TestMCPServerHandler, LiveServerMixin):
+    """Test selecting a tool subset by header, query parameter or initialize params"""
+
+    def setUp(self):
+        super().setUp()
+        self.url = self.start_server(BoundedThreadPoolHTTPServer(('127.0.0.1', 0), MCPServerHandler, workers=2))
+
+    def request(self, payload, headers=None, path='/'):
+        """POST and return (status, response headers, parsed body)"""
+        req = urllib.request.Request(
+            self.url + path,
+            data=json.dumps(payload).encode('utf-8'),
+            headers=dict({'Content-Type': 'application/json'}, **(headers or {}))
+        )
+        try:
+            with urllib.request.urlopen(req, timeout=10) as response:
+                return response.status, response.headers, json.loads(response.read().decode('utf-8'))
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers, json.loads(e.read().decode('utf-8'))
+
+    def tool_names(self, headers=None, path='/'):
+        status, response_headers, body = self.request(
+            {'jsonrpc': '2.0', 'id': 1, 'method': 'tools/list'}, headers, path
+        )
+        self.assertEqual(status, 200)
+        return [tool['name'] for tool in body['result']['tools']], response_headers.get('ETag')
+
+    def test_profile_selects_tool_subset(self):
+        """Test the header and query parameter select the profile catalogue with its own ETag"""
+        all_tools, all_etag = self.tool_names()
+        support, support_etag = self.tool_names({'X-MCP-Profile': 'support'})
+        team, _ = self.tool_names(path='/?profile=team')
+
+        self.assertEqual(all_tools, [name for name, spec in http_mcp_server.TOOL_REGISTRY.items() if not spec.admin])
+        self.assertEqual(set(support), set(http_mcp_server.TOOL_PROFILES['support']))
+        self.assertEqual(set(team), set(http_mcp_server.TOOL_PROFILES['team']))
+        self.assertNotEqual(all_etag, support_etag)
+
+    def test_initialize_issues_session_for_profile(self):
+        """Test initialize with a profile returns a session id that keeps the profile"""
+        status, headers, body = self.request({
+            'jsonrpc': '2.0', 'id': 1, 'method': 'initialize',
+            'params': {'protocolVersion': '2024-11-05', 'profile': 'rag'}
+        })
+        session_id = headers.get('Mcp-Session-Id')
+
+        self.assertEqual(status, 200)
+        self.assertEqual(body['result']['_meta'], {'profile': 'rag', 'sessionId': session_id})
+        tools, _ = self.tool_names({'Mcp-Session-Id': session_id})
+        self.assertEqual(set(tools), set(http_mcp_server.TOOL_PROFILES['rag']))
+
+    def test_dispatch_is_limited_to_profile(self):
+        """Test tools outside the profile cannot be called"""
+        call = {'jsonrpc': '2.0', 'id': 3, 'method': 'tools/call',
+                'params': {'name': 'list_tasks', 'arguments': {}}}
+
+        status, _, body = self.request(call, {'X-MCP-Profile': 'support'})
+        self.assertIn('not available in profile', body['error']['message'])
+
+        status, _, body = self.request(call, {'X-MCP-Profile': 'team'})
+        self.assertIn('result', body)
+
+    def test_initialize_in_batch_applies_to_whole_batch(self):
+        """Test an initialize inside a batch sets the profile before any sibling call runs"""
+        call = {'jsonrpc': '2.0', 'method': 'tools/call', 'params': {'name': 'list_tasks', 'arguments': {}}}
+        status, _, body = self.request([
+            dict(call, id=1),
+            {'jsonrpc': '2.0', 'id': 2, 'method': 'initialize', 'params': {'profile': 'support'}},
+            dict(call, id=3)
+        ])
+
+        self.assertEqual(status, 200)
+        self.assertEqual([response['id'] for response in body], [1, 2, 3])
+        self.assertEqual(body[1]['result']['_meta']['profile'], 'support')
+        # Both calls see the profile, whatever their position and the thread timing
+        self.assertIn('not available in profile', body[0]['error']['message'])
+        self.assertIn('not available in profile', body[2]['error']['message'])
+
+    def test_unknown_profile_is_rejected(self):
+        """Test an unknown profile name is rejected with invalid params"""
+        status, _, body = self.request({'jsonrpc': '2.0', 'id': 1, 'method': 'tools/list'},
+                                       {'X-MCP-Profile': 'marketing'})
+        self.assertEqual(status, 400)
+        self.assertEqual(body['error']['code'], -32602)
+
+        response = self.handler.handle_initialize(1, {'profile': 'marketing'})
+        self.assertEqual(response['error']['code'], -32602)
+
+
+class TestResultEncoding(TestMCPServerHandler, LiveServerMixin):
+    """Test structuredContent results and compact response encoding"""
+
+    def call(self, meta=None, headers=None, name='create_task', arguments=None):
+        params = {'name': name, 'arguments': arguments or {'title': 'Починить вход', 'description': 'Ошибка'}}
+        if meta:
+            params['_meta'] = meta
+        req = urllib.request.Request(
+            self.url,
+            data=json.dumps({'jsonrpc': '2.0', 'id': 1, 'method': 'tools/call', 'params': params}).encode('utf-8'),
+            headers=dict({'Content-Type': 'application/json'}, **(headers or {}))
+        )
+        with urllib.request.urlopen(req, timeout=10) as response:
+            return response.read()
+
+    def setUp(self):
+        super().setUp()
+        self.url = self.start_server(BoundedThreadPoolHTTPServer(('127.0.0.1', 0), MCPServerHandler, workers=2))
+
+    def test_default_result_has_structured_content_and_compact_text(self):
+        """Test results carry structuredContent and a compact UTF-8 text mirror by default"""
+        raw = self.call()
+        result = json.loads(raw)['result']
+
+        self.assertEqual(result['structuredContent']['status'], 'created')
+        self.assertEqual(json.loads(result['content'][0]['text']), result['structuredContent'])
+        self.assertNotIn('\n', result['content'][0]['text'])
+        # UTF-8 on the wire instead of \\u escapes
+        task_id = result['structuredContent']['task_id']
+        self.assertIn('Починить'.encode('utf-8'), self.call(name='get_task', arguments={'task_id': task_id}))
+
+    def test_structured_format_serializes_once(self):
+        """Test the structured and text formats, by _meta and by header"""
+        raw = self.call(meta={'resultFormat': 'structured'})
+        result = json.loads(raw)['result']
+
+        self.assertEqual(result['content'], [])
+        self.assertTrue(result['structuredContent']['success'])
+        self.assertNotIn(b'\\"', raw)
+
+        via_header = json.loads(self.call(headers={'X-MCP-Result-Format': 'text'}))['result']
+        self.assertNotIn('structuredContent', via_header)
+        self.assertTrue(json.loads(via_header['content'][0]['text'])['success'])
+
+    def test_unknown_format_is_an_error(self):
+        """Test an unknown format fails the call before the tool runs"""
+        response = self.handler.handle_tools_call(1, {
+            'name': 'list_tasks', 'arguments': {}, '_meta': {'resultFormat': 'yaml'}
+        })
+        self.assertIn('resultFormat', response['error']['message'])
+
+        # Rejected before the tool runs, so a retry does not create the task twice
+        self.handler.result_format = 'xml'
+        response = self.handler.handle_tools_call(2, {
+            'name': 'create_task', 'arguments': {'title': 'Once', 'description': 'Only once', 'priority': 'low'}
+        })
+        self.assertIn('resultFormat', response['error']['message'])
+        self.assertEqual(http_mcp_server.load_tasks()['tasks'], [])
+
+    def test_log_preview_summarizes_large_values(self):
+        """Test log previews summarize large strings and lists instead of dumping them"""
+        preview = http_mcp_server.log_preview({'success': True, 'text': 'x' * 100000, 'hits': list(range(500))})
+
+        self.assertLessEqual(len(preview), 103)
+        self.assertIn('success=True', preview)
+        self.assertIn('<str of 100000 chars>', preview)
+
+
+class TestEmbeddingEncoding(TestMCPServerHandler):
+    """Test compact embedding encodings in tool arguments and results"""
+
+    embedding = [0.5, -1.25, 3.0, 0.1] * 192
+
+    def test_encodings_round_trip(self):
+        """Test float32 and float16 base64 encodings decode back to the original values"""
+        encode, decode = http_mcp_server.encode_embedding, http_mcp_server.decode_embedding
+
+        self.assertIs(encode(self.embedding, 'json'), self.embedding)
+        float32 = encode(self.embedding, 'float32_b64')
+        float16 = encode(self.embedding, 'float16_b64')
+
+        self.assertEqual(len(float32), 4096)
+        self.assertEqual(len(float16), 2048)
+        for original, restored in zip(self.embedding, decode(float32)):
+            self.assertAlmostEqual(original, restored, places=6)
+        for original, restored in zip(self.embedding, decode(float16, 'float16_b64')):
+            self.assertAlmostEqual(original, restored, places=2)
+
+    def test_invalid_embeddings_are_rejected(self):
+        """Test malformed encodings and unknown encoding names are rejected"""
+        decode = http_mcp_server.decode_embedding
+        for value, encoding in (('not base64!', None), ('AAAA', 'float32_b64'), ([], None),
+                                (['a'], None), ('AAAAAA==', 'int8'), (7, None)):
+            with self.assertRaises(ValueError):
+                decode(value, encoding)
+        with self.assertRaises(ValueError):
+            http_mcp_server.encode_embedding([1e6], 'float16_b64')
+
+        result = self.handler.tool_create_embedding({'text': 'hello', 'encoding': 'float64'})
+        self.assertFalse(result['success'])
+
+    def test_precomputed_embeddings_skip_generation(self):
+        """Test client-supplied embeddings are used without calling Ollama"""
+        def no_ollama(handler, args):
+            raise AssertionError('embedding should not be generated')
+
+        with patch.object(MCPServerHandler, 'tool_create_embedding', no_ollama):
+            saved = self.handler.tool_save_document({
+                'content': 'Reset your password from the login screen',
+                'embedding': http_mcp_server.encode_embedding(self.embedding, 'float16_b64'),
+                'embedding_encoding': 'float16_b64'
+            })
+            found = self.handler.tool_search_similar({
+                'query': 'password',
+                'query_embedding': http_mcp_server.encode_embedding(self.embedding, 'float32_b64')
+            })
+            invalid = self.handler.tool_search_similar({'query': 'password', 'query_embedding': '%%%'})
+            # The embedding alone is enough, and the schemas let clients send just that
+            embedding_only = self.handler.tool_semantic_search({'query_embedding': self.embedding, 'threshold': 0.5})
+            missing = self.handler.tool_search_similar({'limit': 3})
+        for name in ('search_similar', 'semantic_search'):
+            self.assertNotIn('query', http_mcp_server.TOOL_REGISTRY[name].input_schema.get('required', []))
+
+        self.assertTrue(saved['success'])
+        self.assertEqual(saved['embedding_dimensions'], 768)
+        self.assertEqual(found['documents'][0]['id'], saved['document_id'])
+        self.assertAlmostEqual(found['documents'][0]['similarity'], 1.0, places=3)
+        self.assertFalse(invalid['success'])
+        self.assertEqual(embedding_only['documents'][0]['id'], saved['document_id'])
+        self.assertEqual(missing['error'], 'query or query_embedding is required')
+
+
+class TestBatchedEmbeddings(TestMCPServerHandler):
+    """Test multi-input /api/embed requests and per-text failures"""
+
+    def setUp(self):
+        super().setUp()
+        self.requests = []
+
+        def ollama(endpoint, payload, timeout=60):
+            self.requests.append((endpoint, list(payload['input'])))
+            if any('bad' in text for text in payload['input']):
+                raise urllib.error.HTTPError(endpoint, 400, 'input too long', {}, None)
+            return {'embeddings': [[float(len(text)), 1.0] for text in payload['input']]}
+        request = patch.object(http_mcp_server, 'ollama_request', ollama)
+        request.start()
+        self.addCleanup(request.stop)
+
+    def test_batches_respect_size_and_token_budget(self):
+        """Test batches are cut by text count and by estimated tokens"""
+        with patch.dict(http_mcp_server.EMBEDDING_CONFIG, {'batch_size': 3, 'max_batch_tokens': 100}):
+            batches = list(http_mcp_server.embedding_batches(['a'] * 7))
+            self.assertEqual(batches, [[0, 1, 2], [3, 4, 5], [6]])
+            # ~67 estimated tokens each: a budget of 100 fits one text per request
+            self.assertEqual(list(http_mcp_server.embedding_batches(['x' * 200] * 3)), [[0], [1], [2]])
+
+    def test_failed_texts_are_isolated(self):
+        """Test a rejected text fails alone while the rest of its batch is embedded"""
+        texts = ['one', 'two', 'bad three', 'four', 'five']
+        embeddings, errors = http_mcp_server.embed_texts(texts)
+
+        self.assertEqual(list(errors), [2])
+        self.assertIsNone(embeddings[2])
+        self.assertEqual([e[0] for i, e in enumerate(embeddings) if i != 2], [3.0, 3.0, 4.0, 4.0])
+        self.assertEqual(self.requests[0], ('/api/embed', texts))
+
+    def test_unreachable_ollama_fails_whole_batch_once(self):
+        """Test a connection error fails the batch with one request, not one per text"""
+        def refused(endpoint, payload, timeout=60):
+            self.requests.append(payload['input'])
+            raise urllib.error.URLError('refused')
+
+        with patch.object(http_mcp_server, 'ollama_request', refused):
+            embeddings, errors = http_mcp_server.embed_texts(['a', 'b', 'c'])
+        self.assertEqual(embeddings, [None, None, None])
+        self.assertEqual(sorted(errors), [0, 1, 2])
+        self.assertEqual(len(self.requests), 1)
+
+    def test_overloaded_or_missing_model_is_not_bisected(self):
+        """Test 503 and 404 fail each batch with one request instead of splitting it"""
+        for status in (503, 404):
+            def failing(endpoint, payload, timeout=60):
+                self.requests.append(payload['input'])
+                raise urllib.error.HTTPError(endpoint, status, 'overloaded', {}, None)
+
+            self.requests.clear()
+            with patch.object(http_mcp_server, 'ollama_request', failing):
+                embeddings, errors = http_mcp_server.embed_texts([f'text {i}' for i in range(64)])
+            self.assertEqual(embeddings, [None] * 64)
+            self.assertEqual(len(errors), 64)
+            self.assertEqual(len(self.requests), 2, status)
+
+    def test_ingestion_reports_failed_chunks(self):
+        """Test ingestion embeds in one request and lists the chunks that failed"""
+        text = ' '.join(f'Sentence {index} is {"bad" if index == 13 else "fine"} here.' for index in range(40))
+        chunks = self.handler._chunk_text(text, 100, 0)
+        result = self.handler.tool_process_text_chunks({'text': text, 'filename': 'notes.txt',
+                                                        'chunk_size': 100, 'chunk_overlap': 0})
+
+        self.assertTrue(result['success'])
+        self.assertEqual(result['total_chunks'], len(chunks))
+        self.assertEqual(result['failed_chunk_indexes'], [i for i, chunk in enumerate(chunks) if 'bad' in chunk])
+        self.assertEqual(result['chunks_saved'], len(chunks) - 1)
+        self.assertEqual(result['embedding_requests'], 1)
+        self.assertEqual(http_mcp_server.EmbeddingsDatabase.count_documents(), result['chunks_saved'])
+
+    def test_similar_tasks_embedded_in_one_request(self):
+        """Test the query and all tasks are embedded together"""
+        self.handler.tool_create_task({'title': 'Fix login', 'description': 'Crash on login screen'})
+        self.handler.tool_create_task({'title': 'Write docs', 'description': 'Describe the API'})
+
+        result = self.handler.tool_search_similar_tasks({'query': 'login crash', 'threshold': 0.5})
+
+        self.assertTrue(result['success'])
+        self.assertEqual(result['total'], 2)
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual(len(self.requests[0][1]), 3)
+
+
+class TestEmbeddingCache(TestMCPServerHandler):
+    """Test the memory and SQLite tiers of the embedding cache"""
+
+    def setUp(self):
+        super().setUp()
+        self.embedded = []
+
+        def ollama(endpoint, payload, timeout=60):
+            self.embedded.extend(payload['input'])
+            return {'embeddings': [[float(len(text)), 0.5] for text in payload['input']]}
+        request = patch.object(http_mcp_server, 'ollama_request', ollama)
+        request.start()
+        self.addCleanup(request.stop)
+
+    def test_repeated_texts_are_embedded_once(self):
+        """Test duplicate and normalized-equal texts are embedded once per model"""
+        embeddings, errors = http_mcp_server.embed_texts(['reset password', 'reset password', 'login'])
+        self.assertEqual(errors, {})
+        self.assertEqual(embeddings[0], embeddings[1])
+        self.assertEqual(self.embedded, ['reset password', 'login'])
+
+        again, _ = http_mcp_server.embed_texts([' reset   password\n', 'login'])
+        self.assertEqual(again, [embeddings[0], embeddings[2]])
+        self.assertEqual(len(self.embedded), 2)
+
+        # Another model never gets these vectors
+        http_mcp_server.embed_texts(['login'], http_mcp_server.OllamaEmbeddingProvider('other-model'))
+        self.assertEqual(len(self.embedded), 3)
+
+    def test_sqlite_tier_survives_restart(self):
+        """Test a fresh cache finds earlier vectors in SQLite, and the admin tool reports and clears them"""
+        http_mcp_server.embed_texts(['chunk one', 'chunk two'])
+        with patch.object(http_mcp_server, 'EMBEDDING_CACHE', http_mcp_server.EmbeddingCache()):
+            embeddings, _ = http_mcp_server.embed_texts(['chunk two', 'chunk three'])
+            self.assertEqual(embeddings[0], [9.0, 0.5])
+            self.assertEqual(self.embedded, ['chunk one', 'chunk two', 'chunk three'])
+
+            with patch.dict(http_mcp_server.ADMIN_CONFIG, {'token': 'secret'}):
+                self.handler.headers = {'X-MCP-Admin-Token': 'secret'}
+                response = self.handler.handle_tools_call(1, {'name': 'embedding_cache', 'arguments': {}})
+                stats = response['result']['structuredContent']
+                self.assertEqual(stats['sqlite_models'], {'ollama:nomic-embed-text': 3})
+                self.assertEqual(stats['memory_entries'], 2)
+
+                response = self.handler.handle_tools_call(2, {'name': 'embedding_cache',
+                                                              'arguments': {'action': 'clear'}})
+                self.assertEqual(response['result']['structuredContent']['deleted'], 3)
+
+    def test_memory_tier_respects_byte_budget(self):
+        """Test the memory tier evicts least recently used vectors to stay within its byte budget"""
+        cache = http_mcp_server.EmbeddingCache()
+        entry = 8 + cache.ENTRY_OVERHEAD
+        with patch.dict(http_mcp_server.EMBEDDING_CACHE_CONFIG, {'memory_bytes': entry * 2, 'sqlite': False}):
+            cache.put_many('m', {'a': [1.0, 1.0], 'b': [2.0, 2.0]})
+            self.assertEqual(cache.get_many(['a'])[0], [1.0, 1.0])
+            cache.put_many('m', {'c': [3.0, 3.0]})
+
+            # 'b' was least recently used
+            self.assertEqual(cache.get_many(['a', 'b', 'c']), [[1.0, 1.0], None, [3.0, 3.0]])
+            self.assertEqual(cache.bytes, entry * 2)
+
+
+class TestEmbeddingProviders(TestMCPServerHandler):
+    """Test provider selection and detection of mixed embedding indexes"""
+
+    def setUp(self):
+        super().setUp()
+        config = patch.dict(http_mcp_server.EMBEDDING_CONFIG, {'provider': 'hashing', 'model': None})
+        config.start()
+        self.addCleanup(config.stop)
+
+    def test_hashing_provider_is_deterministic(self):
+        """Test hashing vectors are normalized, repeatable and closer for texts sharing words"""
+        provider = http_mcp_server.HashingEmbeddingProvider('hashing-64')
+        first = provider.vector('Reset the password on the login screen')
+
+        self.assertEqual(len(first), 64)
+        self.assertEqual(first, http_mcp_server.HashingEmbeddingProvider('hashing-64').vector(
+            'reset the PASSWORD on the login screen'))
+        self.assertAlmostEqual(sum(x * x for x in first), 1.0)
+        similar = provider.vector('Password reset from the login screen')
+        unrelated = provider.vector('Quarterly revenue grew by ten percent')
+        self.assertGreater(http_mcp_server._cosine_similarity(first, similar),
+                           http_mcp_server._cosine_similarity(first, unrelated))
+        with self.assertRaises(ValueError):
+            http_mcp_server.HashingEmbeddingProvider('hashing-big')
+
+    def test_create_embedding_reports_provider(self):
+        """Test create_embedding reports its provider and model, and unknown providers fail"""
+        result = self.handler.tool_create_embedding({'text': 'hello world'})
+        self.assertEqual((result['provider'], result['model'], result['dimensions']), ('hashing', 'hashing-256', 256))
+
+        with patch.dict(http_mcp_server.EMBEDDING_CONFIG, {'provider': 'word2vec'}):
+            self.assertIn('Unknown embedding provider', self.handler.tool_create_embedding({'text': 'x'})['error'])
+
+    @unittest.skipIf(importlib.util.find_spec('sentence_transformers'), 'sentence-transformers is installed')
+    def test_missing_in_process_model_is_reported(self):
+        """Test a missing sentence-transformers install is reported with the install command"""
+        with patch.dict(http_mcp_server.EMBEDDING_CONFIG, {'provider': 'sentence_transformers'}):
+            result = self.handler.tool_create_embedding({'text': 'hello'})
+        self.assertFalse(result['success'])
+        self.assertIn('pip install sentence-transformers', result['error'])
+
+    def test_mixed_index_is_detected(self):
+        """Test documents of another model are skipped and reported with a warning"""
+        self.handler.tool_process_text_chunks({'text': 'Reset the password on the login screen. ' * 5,
+                                               'filename': 'guide.txt', 'chunk_size': 100, 'chunk_overlap': 0})
+        found = self.handler.tool_search_similar({'query': 'password reset'})
+        self.assertGreater(found['count'], 0)
+        self.assertNotIn('warning', found)
+
+        with patch.dict(http_mcp_server.EMBEDDING_CONFIG, {'model': 'hashing-128'}):
+            found = self.handler.tool_search_similar({'query': 'password reset'})
+            semantic = self.handler.tool_semantic_search({'query': 'password reset'})
+
+        self.assertEqual(found['count'], 0)
+        self.assertEqual(list(found['skipped_documents']), ['hashing:hashing-256/256'])
+        self.assertIn('re-index', found['warning'])
+        self.assertEqual(semantic['skipped_documents'], found['skipped_documents'])
+
+    def test_rows_from_before_providers_are_attributed_to_ollama(self):
+        """Test rows created before the provider columns are backfilled as Ollama vectors"""
+        conn = http_mcp_server.sqlite3.connect(os.path.join(self.test_dir, 'legacy.db'))
+        conn.execute('CREATE TABLE documents (id INTEGER PRIMARY KEY AUTOINCREMENT, content TEXT NOT NULL, '
+                     'embedding BLOB NOT NULL, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)')
+        conn.execute('INSERT INTO documents (content, embedding) VALUES (?, ?)',
+                     ('old chunk', http_mcp_server._serialize_embedding([0.5] * 768)))
+        conn.commit()
+        conn.close()
+
+        http_mcp_server.EMBEDDINGS_DB_PATH = os.path.join(self.test_dir, 'legacy.db')
+        init_database()
+        conn = http_mcp_server.sqlite3.connect(http_mcp_server.EMBEDDINGS_DB_PATH)
+        row = conn.execute('SELECT embedding_provider, embedding_model, embedding_dimensions FROM documents').fetchone()
+        conn.close()
+        self.assertEqual(row, ('ollama', 'nomic-embed-text', 768))
+
+
+class TestEmbeddingScheduler(TestMCPServerHandler):
+    """Test adaptive, fair concurrency of embedding requests"""
+
+    def setUp(self):
+        super().setUp()
+        config = patch.dict(http_mcp_server.EMBEDDING_SCHEDULER_CONFIG, {
+            'initial_limit': 4, 'min_limit': 1, 'max_limit': 8, 'decrease_interval': 0})
+        config.start()
+        self.addCleanup(config.stop)
+        self.scheduler = http_mcp_server.EmbeddingScheduler()
+
+    def request(self, seconds, failed=False, owner=None):
+        self.scheduler.acquire(owner)
+        self.scheduler.release(owner, seconds, texts=1, failed=failed)
+
+    def test_limit_grows_when_fast_and_backs_off_on_overload(self):
+        """Test the limit grows additively while saturated and fast, and halves on slow or failed requests"""
+        # Every slot busy and every response fast: about one more slot per limit's worth of responses
+        for _ in range(4):
+            self.scheduler.acquire()
+        for _ in range(40):
+            self.scheduler.release(seconds=0.01)
+            while self.scheduler.in_flight < int(self.scheduler.limit):
+                self.scheduler.acquire()
+        self.assertEqual(self.scheduler.limit, 8)
+        for _ in range(self.scheduler.in_flight):
+            self.scheduler.release()
+
+        grown = self.scheduler.limit
+        self.request(0.05)
+        self.assertAlmostEqual(self.scheduler.limit, grown / 2)
+        self.request(0.01, failed=True)
+        self.assertAlmostEqual(self.scheduler.limit, grown / 4)
+        for _ in range(5):
+            self.request(0.01, failed=True)
+        self.assertEqual(self.scheduler.limit, 1)
+
+        # A single request at a time does not grow the limit it is not using
+        self.scheduler.limit = 4
+        for _ in range(10):
+            self.request(0.01)
+        self.assertEqual(self.scheduler.limit, 4)
+
+    def test_second_call_gets_its_fair_share(self):
+        """Test a freed slot goes to the call below its share, not to the one holding most slots"""
+        for _ in range(4):
+            self.scheduler.acquire('upload-1')
+
+        granted = []
+
+        def take(owner):
+            self.scheduler.acquire(owner)
+            granted.append(owner)
+        more = threading.Thread(target=take, args=('upload-1',))
+        other = threading.Thread(target=take, args=('upload-2',))
+        more.start()
+        other.start()
+        time.sleep(0.1)
+        self.assertEqual(granted, [])
+
+        # The freed slot goes to the call holding none, not to the one holding three
+        self.scheduler.release('upload-1')
+        other.join(2)
+        self.assertEqual(granted, ['upload-2'])
+        self.assertTrue(more.is_alive())
+        self.assertEqual(self.scheduler.stats()['calls'], 2)
+
+        self.scheduler.release('upload-1')
+        self.scheduler.release('upload-1')
+        more.join(2)
+        self.assertEqual(granted, ['upload-2', 'upload-1'])
+
+    def test_waiting_respects_the_call_deadline(self):
+        """Test waiting for a slot ends with DeadlineExceeded when the call runs out of time"""
+        for _ in range(4):
+            self.scheduler.acquire('upload-1')
+        context = http_mcp_server.RequestContext(deadline=time.monotonic() + 0.2)
+        token = http_mcp_server._request_context.set(context)
+        try:
+            started = time.time()
+            with self.assertRaises(http_mcp_server.DeadlineExceeded):
+                self.scheduler.acquire(context)
+            self.assertLess(time.time() - started, 1)
+        finally:
+            http_mcp_server._request_context.reset(token)
+        self.assertEqual(self.scheduler.stats()['waiting'], 0)
+
+    def test_max_workers_is_only_an_upper_bound(self):
+        """Test invalid or out-of-range max_workers values fall back to a valid pool size"""
+        with patch.dict(http_mcp_server.EMBEDDING_CONFIG, {'provider': 'hashing', 'model': None}):
+            for max_workers in (-1, -2.5, 0, 'many', 100):
+                result = self.handler.tool_process_text_chunks({
+                    'text': 'First sentence. Second sentence.', 'filename': 'notes.txt', 'max_workers': max_workers})
+                self.assertTrue(result['success'], max_workers)
+                self.assertEqual(result['chunks_saved'], result['total_chunks'])
+
+    def test_embed_texts_runs_in_a_slot(self):
+        """Test each provider request holds a slot and feeds the latency baseline"""
+        seen = []
+
+        def embed(texts):
+            seen.append(http_mcp_server.EMBEDDING_SCHEDULER.stats()['in_flight'])
+            return [[1.0] for _ in texts], {}
+
+        provider = http_mcp_server.HashingEmbeddingProvider()
+        with patch.object(http_mcp_server, 'EMBEDDING_SCHEDULER', self.scheduler), \
+                patch.object(provider, 'embed', embed):
+            http_mcp_server.embed_texts(['a', 'b'], provider)
+        self.assertEqual(seen, [1])
+        self.assertEqual(self.scheduler.in_flight, 0)
+        self.assertIsNotNone(self.scheduler.baseline)
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    """Minimal /api/embed that records which connection served each request"""
+
+    protocol_version = 'HTTP/1.1'
+    # Headers and body leave in one segment, as with a real server (no Nagle/delayed-ACK stall)
+    wbufsize = 1 << 16
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.connections.add(self.client_address)
+        time.sleep(self.server.delay)
+        if 'bad' in payload['input']:
+            status, body = 400, {'error': 'input is not valid'}
+        else:
+            status, body = 200, {'embeddings': [[1.0, 0.0] for _ in payload['input']]}
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        if self.server.close_after_response:
+            self.send_header('Connection', 'close')
+            self.close_connection = True
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestOllamaConnectionPool(TestMCPServerHandler, LiveServerMixin):
+    """Test keep-alive connection reuse for Ollama requests"""
+
+    def setUp(self):
+        super().setUp()
+        self.ollama = ThreadingHTTPServer(('127.0.0.1', 0), FakeOllamaHandler)
+        self.ollama.daemon_threads = True
+        self.ollama.connections = set()
+        self.ollama.delay = 0
+        self.ollama.close_after_response = False
+        url = self.start_server(self.ollama)
+        for patcher in (patch.object(http_mcp_server, 'OLLAMA_API_URL', url),
+                        patch.dict(http_mcp_server.OLLAMA_CONFIG, {'max_connections': 2, 'pool_wait': 5})):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(lambda: http_mcp_server.get_ollama_pool().close())
+
+    def test_connections_are_reused_across_threads(self):
+        """Test concurrent requests share a few keep-alive connections"""
+        def embed(_):
+            return http_mcp_server.ollama_request('/api/embed', {'input': ['text']})
+
+        with ThreadPoolExecutor(max_workers=6) as pool:
+            results = list(pool.map(embed, range(30)))
+
+        self.assertEqual(results[0], {'embeddings': [[1.0, 0.0]]})
+        self.assertLessEqual(len(self.ollama.connections), 2)
+
+    def test_closed_idle_connection_is_replaced(self):
+        """Test connections closed by Ollama are replaced without failing the request"""
+        self.ollama.close_after_response = True
+        for _ in range(3):
+            http_mcp_server.ollama_request('/api/embed', {'input': ['text']})
+        self.assertEqual(len(self.ollama.connections), 3)
+
+        # A connection the server dropped while idle is retried on a new one
+        self.ollama.close_after_response = False
+        http_mcp_server.ollama_request('/api/embed', {'input': ['text']})
+        pool = http_mcp_server.get_ollama_pool()
+        pool._idle[0].sock.shutdown(socket.SHUT_RDWR)
+        self.assertIn('embeddings', http_mcp_server.ollama_request('/api/embed', {'input': ['text']}))
+
+    def test_rejected_input_and_exhausted_pool(self):
+        """Test HTTP errors are raised and waiting for a busy pool times out"""
+        with self.assertRaises(urllib.error.HTTPError) as error:
+            http_mcp_server.ollama_request('/api/embed', {'input': ['bad']})
+        self.assertEqual(error.exception.code, 400)
+        self.assertEqual(http_mcp_server.embed_texts(['ok', 'bad'])[1].keys(), {1})
+
+        self.ollama.delay = 1
+        with patch.dict(http_mcp_server.OLLAMA_CONFIG, {'max_connections': 1, 'pool_wait': 0.3}):
+            http_mcp_server.get_ollama_pool().close()
+            http_mcp_server._ollama_pool = None
+            busy = threading.Thread(target=http_mcp_server.ollama_request, args=('/api/embed', {'input': ['a']}))
+            busy.start()
+            time.sleep(0.2)
+            with self.assertRaises(TimeoutError):
+                http_mcp_server.ollama_request('/api/embed', {'input': ['b']})
+            busy.join()
+
+
+class TestCompression(TestMCPServerHandler, LiveServerMixin):
+    """Test gzip/deflate negotiation for responses and request bodies"""
+
+    def setUp(self):
+        super().setUp()
+        url = self.start_server(BoundedThreadPoolHTTPServer(('127.0.0.1', 0), MCPServerHandler, workers=2))
+        self.conn = http.client.HTTPConnection(url[len('http://'):], timeout=5)
+        self.addCleanup(self.conn.close)
+
+    def post(self, body, headers=None):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+        self.conn.request('POST', '/', body=body, headers=dict({'Content-Type': 'application/json'}, **(headers or {})))
+        response = self.conn.getresponse()
+        return response, response.read()
+
+    def test_large_response_is_gzipped(self):
+        """Test a large tools/list is gzipped with Vary and a weak ETag that still answers 304"""
+        response, body = self.post({'jsonrpc': '2.0', 'id': 1, 'method': 'tools/list'},
+                                   {'Accept-Encoding': 'gzip, deflate'})
+
+        self.assertEqual(response.getheader('Content-Encoding'), 'gzip')
+        self.assertEqual(response.getheader('Vary'), 'Accept-Encoding')
+        tools = json.loads(gzip.decompress(body))['result']['tools']
+        self.assertEqual(len(tools), sum(not spec.admin for spec in http_mcp_server.TOOL_REGISTRY.values()))
+
+        etag = response.getheader('ETag')
+        self.assertTrue(etag.startswith('W/'))
+        response, _ = self.post({'jsonrpc': '2.0', 'id': 2, 'method': 'tools/list'},
+                                {'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+        self.assertEqual(response.status, 304)
+
+    def test_encoding_negotiation(self):
+        """Test Accept-Encoding q-values pick the encoding and small responses stay uncompressed"""
+        choose = http_mcp_server.choose_content_encoding
+        self.assertEqual(choose('gzip;q=0, deflate'), 'deflate')
+        self.assertEqual(choose('br, *;q=0.5'), 'gzip')
+        self.assertIsNone(choose('identity'))
+        self.assertIsNone(choose(None))
+
+        response, body = self.post({'jsonrpc': '2.0', 'id': 1, 'method': 'tools/list'},
+                                   {'Accept-Encoding': 'deflate'})
+        self.assertEqual(response.getheader('Content-Encoding'), 'deflate')
+        self.assertIn('result', json.loads(zlib.decompress(body)))
+
+        # Below the threshold compression is not worth it
+        response, body = self.post({'jsonrpc': '2.0', 'id': 1, 'method': 'initialize'}, {'Accept-Encoding': 'gzip'})
+        self.assertIsNone(response.getheader('Content-Encoding'))
+        self.assertEqual(json.loads(body)['id'], 1)
+
+    def test_compressed_request_bodies(self):
+        """Test gzip, zlib and raw deflate request bodies are decoded"""
+        payload = json.dumps({'jsonrpc': '2.0', 'id': 7, 'method': 'initialize'}).encode('utf-8')
+        raw_deflate = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+
+        for body, encoding in ((gzip.compress(payload), 'gzip'),
+                               (zlib.compress(payload), 'deflate'),
+                               (raw_deflate.compress(payload) + raw_deflate.flush(), 'deflate')):
+            response, body = self.post(body, {'Content-Encoding': encoding})
+            self.assertEqual(response.status, 200, encoding)
+            self.assertEqual(json.loads(body)['id'], 7)
+
+    def test_bad_compressed_bodies_are_rejected(self):
+        """Test decompression bombs, corrupt bodies and unknown encodings are rejected"""
+        with patch.dict(http_mcp_server.HTTP_CONFIG, {'max_decompressed_bytes': 1024 * 1024}):
+            bomb = gzip.compress(b' ' * (4 * 1024 * 1024))
+            response, _ = self.post(bomb, {'Content-Encoding': 'gzip'})
+            self.assertEqual(response.status, 413)
+        self.conn.close()
+
+        response, _ = self.post(b'not gzip at all', {'Content-Encoding': 'gzip'})
+        self.assertEqual(response.status, 400)
+        self.conn.close()
+
+        response, _ = self.post(b'{}', {'Content-Encoding': 'br'})
+        self.assertEqual(response.status, 415)
+
+
+class TestUploads(TestMCPServerHandler, LiveServerMixin):
+    """Test raw document uploads streamed to a temporary file"""
+
+    def setUp(self):
+        super().setUp()
+        self.upload_dir = os.path.join(self.test_dir, 'uploads')
+        os.mkdir(self.upload_dir)
+        upload_config = patch.dict(http_mcp_server.UPLOAD_CONFIG, {'dir': self.upload_dir})
+        upload_config.start()
+        self.addCleanup(upload_config.stop)
+
+        self.received = []
+        self.extract_pdf = MCPServerHandler.process_pdf_file
+
+        def process_pdf_file(handler, pdf_file, filename, chunk_size, chunk_overlap):
+            with open(pdf_file, 'rb') as f:
+                self.received.append((filename, chunk_size, f.read()))
+            return {'success': True, 'filename': filename, 'chunks_saved': 2}
+        pdf = patch.object(MCPServerHandler, 'process_pdf_file', process_pdf_file)
+        pdf.start()
+        self.addCleanup(pdf.stop)
+
+        url = self.start_server(BoundedThreadPoolHTTPServer(('127.0.0.1', 0), MCPServerHandler, workers=2))
+        self.conn = http.client.HTTPConnection(url[len('http://'):], timeout=5)
+        self.addCleanup(self.conn.close)
+
+    def upload(self, body, content_type='application/pdf', path='/upload', headers=None, **kwargs):
+        headers = dict({'Content-Type': content_type}, **(headers or {}))
+        self.conn.request('POST', path, body=body, headers=headers, **kwargs)
+        response = self.conn.getresponse()
+        return response, json.loads(response.read() or 'null')
+
+    def test_pdf_is_streamed_to_a_file(self):
+        """Test a PDF upload is streamed to a temporary file that is removed afterwards"""
+        document = os.urandom(300 * 1024)
+        with patch.dict(http_mcp_server.HTTP_CONFIG, {'upload_block_bytes': 4096}):
+            response, result = self.upload(document, path='/upload?chunk_size=500',
+                                           headers={'X-Filename': '%D0%BE%D1%82%D1%87%D1%91%D1%82.pdf'})
+
+        self.assertEqual(response.status, 200)
+        self.assertEqual(result['chunks_saved'], 2)
+        self.assertEqual(self.received, [('отчёт.pdf', 500, document)])
+        self.assertEqual(os.listdir(self.upload_dir), [])
+
+        # The connection stays usable for JSON-RPC
+        response, body = self.upload(json.dumps({'jsonrpc': '2.0', 'id': 1, 'method': 'initialize'}),
+                                     content_type='application/json', path='/')
+        self.assertEqual(body['id'], 1)
+
+    def test_pdf_pages_are_released_as_extracted(self):
+        """Test each parsed PDF page is released before the next one is read"""
+        events = []
+
+        class Page:
+            def __init__(self, number):
+                self.number = number
+
+            def extract_text(self):
+                events.append(('extract', self.number))
+                return f'Text of page {self.number}.'
+
+            def close(self):
+                events.append(('close', self.number))
+
+        class Document:
+            pages = [Page(1), Page(2), Page(3)]
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc_info):
+                events.append(('close document', None))
+
+        class pdfplumber:
+            open = staticmethod(lambda pdf_file: Document())
+
+        texts = []
+
+        def process_text_chunks(handler, args):
+            texts.append(args['text'])
+            return {'success': True}
+
+        with patch.dict(sys.modules, {'pdfplumber': pdfplumber}), \
+                patch.object(MCPServerHandler, 'tool_process_text_chunks', process_text_chunks):
+            self.assertTrue(self.extract_pdf(self.handler, 'report.pdf', 'report.pdf', 1000, 200)['success'])
+
+        self.assertEqual(events, [('extract', 1), ('close', 1), ('extract', 2), ('close', 2),
+                                  ('extract', 3), ('close', 3), ('close document', None)])
+        self.assertEqual(texts, ['Text of page 1.\n\nText of page 2.\n\nText of page 3.'])
+
+    def test_chunked_gzip_text_upload(self):
+        """Test a chunked, gzipped text upload is decoded and its filename sanitized"""
+        texts = []
+
+        def process_text_chunks(handler, args):
+            texts.append((args['filename'], args['text']))
+            return {'success': True, 'chunks_saved': 1}
+
+        text = 'Строка текста для загрузки. ' * 5000
+        compressed = gzip.compress(text.encode('utf-8'))
+        blocks = (compressed[i:i + 1000] for i in range(0, len(compressed), 1000))
+        with patch.object(MCPServerHandler, 'tool_process_text_chunks', process_text_chunks):
+            response, result = self.upload(blocks, content_type='text/plain; charset=utf-8',
+                                           headers={'Content-Encoding': 'gzip', 'X-Filename': '../notes.txt'},
+                                           encode_chunked=True)
+
+        self.assertEqual(response.status, 200)
+        self.assertEqual(texts, [('notes.txt', text)])
+
+    def test_async_upload_runs_as_job(self):
+        """Test async=1 answers 202 and ingests the upload as a background job"""
+        jobs = http_mcp_server.JobManager()
+        manager = patch.object(http_mcp_server, 'JOB_MANAGER', jobs)
+        manager.start()
+        self.addCleanup(manager.stop)
+        self.addCleanup(lambda: jobs._executor and jobs._executor.shutdown(wait=True))
+
+        response, started = self.upload(b'%PDF-1.4 test', path='/upload?async=1')
+        self.assertEqual(response.status, 202)
+        self.assertEqual(started['tool'], 'process_pdf')
+
+        deadline = time.time() + 10
+        job = jobs.get(started['job_id'])
+        while job['status'] in ('queued', 'running') and time.time() < deadline:
+            time.sleep(0.05)
+            job = jobs.get(started['job_id'])
+        self.assertEqual(job['status'], 'succeeded')
+        self.assertEqual(job['result']['chunks_saved'], 2)
+        self.assertEqual(os.listdir(self.upload_dir), [])
+
+    def test_upload_runs_as_a_tool_call(self):
+        """Test a synchronous upload is tracked, counted and cancellable like a tools/call"""
+        seen = []
+
+        def process_pdf_file(handler, pdf_file, filename, chunk_size, chunk_overlap):
+            context = http_mcp_server.current_request_context()
+            with http_mcp_server.ACTIVE_CALLS_LOCK:
+                seen.append((context.request_id, [context in contexts for contexts in http_mcp_server.ACTIVE_CALLS.values()]))
+            if filename == 'cancelled.pdf':
+                context.cancel()
+            return {'success': True, 'chunks_saved': 1}
+
+        def calls(status):
+            snapshot = http_mcp_server.TOOL_CALLS_TOTAL.snapshot()
+            return snapshot.get(json.dumps(['process_pdf', status]), 0)
+
+        ok, aborted = calls('ok'), calls('aborted')
+        with patch.object(MCPServerHandler, 'process_pdf_file', process_pdf_file):
+            response, result = self.upload(b'%PDF-1.4 test', headers={'X-MCP-Request-Id': 'upload-1'})
+            self.assertEqual(response.status, 200)
+            self.assertEqual(result['chunks_saved'], 1)
+
+            response, result = self.upload(b'%PDF-1.4 test', headers={'X-Filename': 'cancelled.pdf'})
+            self.assertEqual(response.status, 409)
+            self.assertEqual(result['code'], -32800)
+            self.assertEqual(result['partial'], {'success': True, 'chunks_saved': 1})
+
+        self.assertEqual(seen, [('upload-1', [True]), (None, [])])
+        self.assertEqual(http_mcp_server.ACTIVE_CALLS, {})
+        self.assertEqual((calls('ok'), calls('aborted')), (ok + 1, aborted + 1))
+        self.assertEqual(os.listdir(self.upload_dir), [])
+
+    def test_rejected_uploads(self):
+        """Test unsupported types, profile limits and oversized bodies are rejected without leftovers"""
+        response, _ = self.upload(b'data', content_type='multipart/form-data; boundary=x')
+        self.assertEqual(response.status, 415)
+        self.conn.close()
+
+        response, _ = self.upload(b'%PDF', headers={'X-MCP-Profile': 'support'})
+        self.assertEqual(response.status, 403)
+        self.conn.close()
+
+        with patch.dict(http_mcp_server.HTTP_CONFIG, {'max_upload_bytes': 1024}):
+            response, _ = self.upload(b'x' * 2048)
+        self.assertEqual(response.status, 413)
+        self.assertEqual(self.received, [])
+        self.assertEqual(os.listdir(self.upload_dir), [])
+
+
+class TestLogging(TestMCPServerHandler):
+    """Test structured logging through the background writer"""
+
+    def setUp(self):
+        super().setUp()
+        logger = http_mcp_server.logger
+        saved = (logger.handlers[:], logger.level, logger.propagate)
+
+        def restore():
+            http_mcp_server.stop_logging()
+            logger.handlers[:], logger.level, logger.propagate = saved
+        self.addCleanup(restore)
+
+    def capture(self, **config):
+        """Configure logging into a buffer; returns a function reading the records written so far"""
+        stream = io.StringIO()
+        patcher = patch.dict(http_mcp_server.LOG_CONFIG, config)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        http_mcp_server.configure_logging(stream=stream)
+
+        def records():
+            http_mcp_server.stop_logging()
+            return [json.loads(line) for line in stream.getvalue().splitlines()]
+        return records
+
+    def call(self, name, arguments, request_id=1):
+        return self.handler.handle_tools_call(request_id, {'name': name, 'arguments': arguments})
+
+    def test_records_are_json_and_tagged_with_the_call(self):
+        """Test JSON log records carry the tool and request id of the call"""
+        records = self.capture(format='json', level='DEBUG')
+        self.call('list_tasks', {'status': 'pending'}, request_id=7)
+
+        tagged = [r for r in records() if r.get('tool') == 'list_tasks']
+        self.assertTrue(tagged)
+        self.assertTrue(all(r['request_id'] == 7 for r in tagged))
+        self.assertIn("status='pending'", tagged[0]['msg'])
+        self.assertIn('DEBUG', [r['level'] for r in tagged])
+
+    def test_sampling_keeps_errors(self):
+        """Test sampled-out tools log nothing but warnings and errors"""
+        records = self.capture(format='json', sample_rates={'list_tasks': 0, 'get_task': 0})
+        self.call('list_tasks', {})
+        self.call('get_task', {})
+        self.call('unknown_tool', {})
+
+        written = records()
+        self.assertFalse([r for r in written if r.get('tool') == 'list_tasks'])
+        self.assertTrue([r for r in written if r.get('tool') == 'unknown_tool'])
+        self.assertTrue(all(r['level'] in ('WARNING', 'ERROR') for r in written if r.get('tool') == 'get_task'))
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        """Test records are dropped and counted when the log queue is full"""
+        handler = http_mcp_server.DroppingQueueHandler(queue.Queue(1))
+        for _ in range(3):
+            handler.handle(logging.makeLogRecord({'msg': 'line', 'levelno': logging.INFO}))
+        self.assertEqual(handler.dropped, 2)
+
+    def test_arguments_are_formatted_lazily(self):
+        """Test argument previews are only built when the record is emitted"""
+        preview = http_mcp_server.LazyPreview({'text': 'x' * 100000}, limit=50)
+        with patch.object(http_mcp_server, 'log_preview', wraps=http_mcp_server.log_preview) as log_preview:
+            http_mcp_server.logger.setLevel(logging.WARNING)
+            http_mcp_server.logger.info('args: %s', preview)
+            log_preview.assert_not_called()
+        self.assertEqual(str(preview), "{text=<str of 100000 chars>}")
+
+
+class TestMetrics(TestMCPServerHandler, LiveServerMixin):
+    """Test the Prometheus /metrics endpoint and its instrumentation"""
+
+    def test_metrics_endpoint(self):
+        """Test GET /metrics exposes call, request and SQLite metrics in Prometheus text format"""
+        url = self.start_server(BoundedThreadPoolHTTPServer(('127.0.0.1', 0), MCPServerHandler, workers=2))
+        self.post(url, {'jsonrpc': '2.0', 'id': 1, 'method': 'tools/call',
+                        'params': {'name': 'list_tasks', 'arguments': {}}})
+        self.post(url, {'jsonrpc': '2.0', 'id': 2, 'method': 'tools/list'})
+
+        with urllib.request.urlopen(url + '/metrics', timeout=5) as response:
+            content_type = response.getheader('Content-Type')
+            text = response.read().decode('utf-8')
+
+        self.assertTrue(content_type.startswith('text/plain; version=0.0.4'))
+        self.assertIn('# TYPE mcp_tool_calls_total counter', text)
+        self.assertIn('mcp_tool_calls_total{tool="list_tasks",status="ok"}', text)
+        self.assertIn('mcp_request_duration_seconds_bucket{method="tools/call",le="+Inf"}', text)
+        self.assertIn('mcp_requests_total{method="tools/list"}', text)
+        self.assertIn('mcp_sqlite_query_duration_seconds_count{statement="create"}', text)
+        self.assertRegex(text, r'\nmcp_http_requests_in_flight \d+\n')
+        self.assertIn('mcp_connection_queue_depth 0', text)
+
+    def test_histogram_rendering_and_merge(self):
+        """Test histogram buckets render cumulatively and worker snapshots merge"""
+        registry = http_mcp_server.MetricsRegistry()
+        latency = registry.register(http_mcp_server.Histogram('latency_seconds', 'Latency', ('op',), buckets=(1, 2)))
+        remaining = registry.register(http_mcp_server.Gauge('remaining', 'Remaining', merge='min'))
+        for value in (0.5, 1.5, 3):
+            latency.observe(value, op='read')
+        remaining.set(10)
+
+        lines = registry.render().splitlines()
+        self.assertIn('latency_seconds_bucket{op="read",le="1"} 1', lines)
+        self.assertIn('latency_seconds_bucket{op="read",le="2"} 2', lines)
+        self.assertIn('latency_seconds_bucket{op="read",le="+Inf"} 3', lines)
+        self.assertIn('latency_seconds_sum{op="read"} 5', lines)
+        self.assertIn('latency_seconds_count{op="read"} 3', lines)
+
+        other = registry.snapshot()
+        other['remaining'] = {'[]': 4}
+        merged = registry.render([registry.snapshot(), json.loads(json.dumps(other))]).splitlines()
+        self.assertIn('latency_seconds_count{op="read"} 6', merged)
+        self.assertIn('remaining 4', merged)
+
+    def test_external_calls_are_measured(self):
+        """Test GitHub rate limits and Ollama errors are recorded"""
+        class FakeResponse(io.BytesIO):
+            headers = {'X-RateLimit-Remaining': '4321'}
+
+        with patch.object(http_mcp_server, 'GITHUB_TOKEN', 'token'), \
+                patch('urllib.request.urlopen', return_value=FakeResponse(b'{"login": "octocat"}')):
+            self.assertEqual(http_mcp_server.github_api_request('/user'), {'login': 'octocat'})
+        self.assertEqual(http_mcp_server.GITHUB_RATE_LIMIT_REMAINING.snapshot(), {'[]': 4321})
+
+        errors = http_mcp_server.OLLAMA_ERRORS
+        before = errors.snapshot().get('["/api/embed"]', 0)
+        with socket.socket() as unused:
+            unused.bind(('127.0.0.1', 0))
+            with patch.object(http_mcp_server, 'OLLAMA_API_URL', f'http://127.0.0.1:{unused.getsockname()[1]}'):
+                with self.assertRaises(OSError):
+                    http_mcp_server.ollama_request('/api/embed', {'input': ['x']})
+        self.assertEqual(errors.snapshot()['["/api/embed"]'], before + 1)
+
+
+class TestTracing(TestMCPServerHandler):
+    """Test opt-in per-call tracing"""
+
+    def setUp(self):
+        super().setUp()
+
+        def embed(handler, args):
+            return {'success': True, 'embedding': [1.0, 0.0, 0.0], 'dimensions': 3}
+        embedding = patch.object(MCPServerHandler, 'tool_create_embedding', embed)
+        embedding.start()
+        self.addCleanup(embedding.stop)
+
+        for index, vector in enumerate(([1.0, 0.0, 0.0], [0.9, 0.1, 0.0], [0.0, 1.0, 0.0])):
+            self.handler.tool_save_document({'content': f'Document {index}', 'source_file': 'guide.pdf',
+                                             'chunk_index': index, 'embedding': vector})
+
+    def search(self, meta=None):
+        params = {'name': 'semantic_search', 'arguments': {'query': 'guide', 'limit': 2, 'threshold': 0.5}}
+        if meta is not None:
+            params['_meta'] = meta
+        return self.handler.handle_tools_call(1, params)['result']
+
+    def test_trace_spans_in_result_meta(self):
+        """Test a traced call returns its spans, nested under the root, in _meta"""
+        result = self.search({'trace': True})
+
+        trace = result['_meta']['trace']
+        self.assertRegex(trace['traceId'], r'^[0-9a-f]{32}$')
+        spans = {span['name']: span for span in trace['spans']}
+        for stage in ('embedding', 'db_fetch', 'scoring', 'filtering', 'citation_formatting', 'serialization'):
+            self.assertIn(stage, spans)
+        root = spans['tools/call semantic_search']
+        self.assertIsNone(root['parentSpanId'])
+        self.assertEqual(spans['serialization']['parentSpanId'], root['spanId'])
+        self.assertEqual(spans['embedding']['attributes'],
+                         {'source': 'server', 'provider': http_mcp_server.get_embedding_provider().identity})
+        self.assertEqual(spans['db_fetch']['attributes']['rows'], 3)
+        self.assertEqual(spans['filtering']['attributes']['kept'], 2)
+        self.assertTrue(all(span['durationMs'] <= root['durationMs'] for span in trace['spans']))
+
+        # The tool result itself is unchanged
+        self.assertEqual(result['structuredContent']['count'], 2)
+        self.assertIn('citation', result['structuredContent']['documents'][0])
+
+    def test_tracing_is_opt_in(self):
+        """Test traces are only returned for _meta.trace or the X-MCP-Trace header"""
+        self.assertNotIn('_meta', self.search())
+
+        self.handler.trace_requested = True
+        self.assertIn('trace', self.search()['_meta'])
+
+    def test_otlp_export(self):
+        """Test traced calls are exported as OTLP JSON lines"""
+        export_file = os.path.join(self.test_dir, 'traces.jsonl')
+        with patch.dict(http_mcp_server.TRACE_CONFIG, {'export_file': export_file}):
+            trace_id = self.search({'trace': True})['_meta']['trace']['traceId']
+            self.search()
+
+        with open(export_file, encoding='utf-8') as f:
+            exported = [json.loads(line) for line in f]
+        self.assertEqual(len(exported), 1)
+        scope = exported[0]['resourceSpans'][0]['scopeSpans'][0]
+        self.assertTrue(all(span['traceId'] == trace_id for span in scope['spans']))
+        self.assertIn('serialization', [span['name'] for span in scope['spans']])
+        root = [span for span in scope['spans'] if 'parentSpanId' not in span]
+        self.assertEqual(len(root), 1)
+        self.assertLessEqual(int(root[0]['startTimeUnixNano']), int(root[0]['endTimeUnixNano']))
+
+
+class TestCallProfiling(TestMCPServerHandler):
+    """Test admin-only profiling of single tool calls"""
+
+    def setUp(self):
+        super().setUp()
+        admin = patch.dict(http_mcp_server.ADMIN_CONFIG, {'token': 'secret'})
+        admin.start()
+        self.addCleanup(admin.stop)
+        self.handler.headers = {'X-MCP-Admin-Token': 'secret'}
+
+        embedding = patch.object(http_mcp_server, 'embed_texts',
+                                 lambda texts, provider=None: ([[0.1] * 8 for _ in texts], {}))
+        embedding.start()
+        self.addCleanup(embedding.stop)
+
+    def call(self, name, arguments, meta=None):
+        params = {'name': name, 'arguments': arguments}
+        if meta is not None:
+            params['_meta'] = meta
+        return self.handler.handle_tools_call(1, params)
+
+    def ingest(self, meta=None):
+        return self.call('process_text_chunks', {'text': 'Sentence number one. ' * 200, 'filename': 'notes.txt',
+                                                 'chunk_size': 300, 'max_workers': 1}, meta)
+
+    def test_profiled_call_returns_summary_and_saves_profile(self):
+        """Test a profiled call returns its top functions and saves a loadable profile"""
+        result = self.ingest({'profile': {'top': 100, 'sort': 'cumulative'}})['result']
+
+        self.assertTrue(result['structuredContent']['success'])
+        profile = result['_meta']['profile']
+        self.assertGreater(profile['wallSeconds'], 0)
+        self.assertIn('_chunk_text', [row['function'] for row in profile['top']])
+        cumulative = [row['cumtime'] for row in profile['top']]
+        self.assertEqual(cumulative, sorted(cumulative, reverse=True))
+
+        listed = self.call('list_call_profiles', {})['result']['structuredContent']
+        self.assertEqual([p['file'] for p in listed['profiles']], [profile['file']])
+        http_mcp_server.pstats.Stats(os.path.join(listed['directory'], profile['file']))
+
+    def test_profiling_requires_admin_token(self):
+        """Test profiling and list_call_profiles need the admin token and are not listed"""
+        self.handler.headers = {'X-MCP-Admin-Token': 'wrong'}
+        self.assertIn('admin token', self.ingest({'profile': True})['error']['message'])
+        self.assertIn('admin token', self.call('list_call_profiles', {})['error']['message'])
+
+        with patch.dict(http_mcp_server.ADMIN_CONFIG, {'token': None}):
+            self.handler.headers = {'X-MCP-Admin-Token': ''}
+            self.assertIn('error', self.ingest({'profile': True}))
+
+        tools = self.handler.handle_tools_list(1)['result']['tools']
+        self.assertNotIn('list_call_profiles', [tool['name'] for tool in tools])
+
+    def test_one_profile_at_a_time(self):
+        """Test a second profiled call is rejected while one runs, and the lock is released"""
+        with http_mcp_server.CallProfiler._active:
+            response = self.ingest({'profile': True})
+        self.assertEqual(response['error']['code'], -32003)
+
+        # The lock is released after a failed call
+        response = self.call('get_task', {'task_id': 'missing'}, {'profile': True})
+        self.assertIn('profile', response['result']['_meta'])
+        self.assertIn('profile', self.ingest({'profile': True})['result']['_meta'])
+
+
+class TestMemoryDiagnostics(TestMCPServerHandler):
+    """Test the memory_trace admin tool and per-call RSS accounting"""
+
+    def setUp(self):
+        super().setUp()
+        admin = patch.dict(http_mcp_server.ADMIN_CONFIG, {'token': 'secret'})
+        admin.start()
+        self.addCleanup(admin.stop)
+        self.handler.headers = {'X-MCP-Admin-Token': 'secret'}
+        self.addCleanup(http_mcp_server._memory_snapshots.clear)
+        self.addCleanup(tracemalloc.stop)
+
+    def memory(self, **arguments):
+        response = self.handler.handle_tools_call(1, {'name': 'memory_trace', 'arguments': arguments})
+        return response['result']['structuredContent']
+
+    def test_status_reports_rss_per_tool(self):
+        """Test status reports process RSS and per-tool growth"""
+        self.handler.handle_tools_call(1, {'name': 'list_tasks', 'arguments': {}})
+        status = self.memory(action='status')
+
+        self.assertFalse(status['tracing'])
+        self.assertGreater(status['rss_kb'], 0)
+        self.assertGreater(status['peak_rss_kb'], 0)
+        self.assertGreaterEqual(status['tools']['list_tasks']['calls'], 1)
+        self.assertIn('peak_rss_growth_max_kb', status['tools']['list_tasks'])
+
+    def test_snapshot_diff_and_allocations_by_tool(self):
+        """Test snapshot diffs attribute allocations to the tool that made them"""
+        self.assertFalse(self.memory(action='top')['success'])
+        self.assertTrue(self.memory(action='start', frames=12)['success'])
+        base = self.memory(action='snapshot')['snapshot_id']
+
+        for index in range(40):
+            self.handler.tool_save_document({'content': f'Document {index} ' * 20, 'source_file': 'guide.pdf',
+                                             'chunk_index': index, 'embedding': [0.1 * (index % 7)] * 64})
+        # Kept alive so the diff sees the memory allocated by the tool
+        found = self.handler.tool_search_similar({'query_embedding': [0.5] * 64, 'limit': 40})
+        self.assertEqual(found['count'], 40)
+
+        by_tool = self.memory(action='diff', base=base, group_by='tool')
+        tools = {row['tool']: row for row in by_tool['top']}
+        self.assertIn('search_similar', tools)
+        self.assertGreater(tools['search_similar']['size_diff_kb'], 0)
+
+        by_line = self.memory(action='top', group_by='lineno', limit=5)
+        self.assertEqual(len(by_line['top']), 5)
+        self.assertIn(':', by_line['top'][0]['location'])
+
+        self.assertFalse(self.memory(action='start')['success'])
+        self.assertFalse(self.memory(action='stop')['tracing'])
+
+
+class TestCallRecorder(TestMCPServerHandler, LiveServerMixin):
+    """Test tools/call recording and the replay benchmark"""
+
+    def setUp(self):
+        super().setUp()
+        self.trace_file = os.path.join(self.test_dir, 'calls.jsonl')
+        recorder = patch.dict(http_mcp_server.RECORDER_CONFIG, {'file': self.trace_file, 'flush_interval': 0.05})
+        recorder.start()
+        self.addCleanup(recorder.stop)
+        self.addCleanup(http_mcp_server.CALL_RECORDER.flush)
+
+    def test_calls_are_recorded_with_blobs_hashed(self):
+        """Test calls are recorded with large arguments replaced by sized hashes"""
+        embedding = [0.25] * 128
+        self.handler.handle_tools_call(1, {'name': 'save_document', 'arguments': {
+            'content': 'x' * 1000, 'source_file': 'guide.pdf', 'chunk_index': 0, 'embedding': embedding}})
+        self.handler.handle_tools_call(2, {'name': 'list_tasks', 'arguments': {'status': 'pending'}})
+        self.assertTrue(http_mcp_server.CALL_RECORDER.flush())
+
+        records = replay_trace.load_trace(self.trace_file)
+        self.assertEqual([record['tool'] for record in records], ['save_document', 'list_tasks'])
+        saved = records[0]
+        self.assertEqual(saved['args']['source_file'], 'guide.pdf')
+        self.assertEqual(saved['args']['content']['len'], 1000)
+        self.assertEqual(saved['args']['embedding'], {'$blob': saved['args']['embedding']['$blob'],
+                                                      'type': 'list', 'len': 128})
+        self.assertEqual(saved['status'], 'ok')
+        self.assertGreater(saved['bytes'], 0)
+        self.assertGreaterEqual(saved['ms'], 0)
+        self.assertEqual(records[1]['args'], {'status': 'pending'})
+
+        restored = replay_trace.restore_blobs(saved['args'], replay_trace.random.Random(0))
+        self.assertEqual(len(restored['content']), 1000)
+        self.assertEqual(len(restored['embedding']), 128)
+
+    def test_replay_reports_percentiles_per_tool(self):
+        """Test a replayed trace reports calls, failures and latency percentiles per tool"""
+        with open(self.trace_file, 'w', encoding='utf-8') as f:
+            for index in range(6):
+                f.write(json.dumps({'t': 100 + index * 0.01, 'tool': 'list_tasks', 'args': {}, 'ms': 2}) + '\n')
+            f.write(json.dumps({'t': 100.02, 'tool': 'get_task', 'args': {'task_id': 'missing'}, 'ms': 1}) + '\n')
+            f.write('{"t": 100.1, "tool": "list_ta')
+
+        records = replay_trace.load_trace(self.trace_file)
+        self.assertEqual(len(records), 7)
+        self.assertEqual(len(replay_trace.load_trace(self.trace_file, tools=['get_task'])), 1)
+
+        # The replayed calls are recorded too; keep them out of the trace being read
+        http_mcp_server.RECORDER_CONFIG['file'] = None
+        url = self.start_server(BoundedThreadPoolHTTPServer(('127.0.0.1', 0), MCPServerHandler, workers=2))
+        results, wall_seconds = replay_trace.replay(records, url, speed=10, concurrency=2)
+        summary = replay_trace.summarize(results, wall_seconds, records)
+
+        self.assertEqual(summary['tools']['list_tasks']['calls'], 6)
+        self.assertEqual(summary['tools']['list_tasks']['errors'], 0)
+        self.assertEqual(summary['tools']['get_task']['failed'], 1)
+        self.assertEqual(summary['total']['calls'], 7)
+        self.assertLessEqual(summary['tools']['list_tasks']['p50_ms'], summary['tools']['list_tasks']['p99_ms'])
+        self.assertEqual(summary['tools']['list_tasks']['recorded_p50_ms'], 2)
+        self.assertIn('ALL', replay_trace.format_summary(summary))
+
+    def test_paced_latency_counts_time_waiting_for_a_connection(self):
+        """Test paced replays measure latency from the time a call was due"""
+        def list_tasks(handler, args):
+            time.sleep(0.2)
+            return {'success': True, 'tasks': []}
+
+        records = [{'t': 100, 'tool': 'list_tasks', 'args': {}} for _ in range(3)]
+        http_mcp_server.RECORDER_CONFIG['file'] = None
+        url = self.start_server(BoundedThreadPoolHTTPServer(('127.0.0.1', 0), MCPServerHandler, workers=2))
+        with patch.object(MCPServerHandler, 'tool_list_tasks', list_tasks):
+            paced = replay_trace.summarize(*replay_trace.replay(records, url, speed=1, concurrency=1))
+            unpaced = replay_trace.summarize(*replay_trace.replay(records, url, speed=None, concurrency=1))
+
+        # All three calls were due at once; the last one waited for the two before it
+        self.assertGreaterEqual(paced['total']['max_ms'], 550)
+        self.assertGreaterEqual(paced['total']['queue_p99_ms'], 350)
+        self.assertLess(unpaced['total']['max_ms'], 550)
+        self.assertIn('queue p99', replay_trace.format_summary(paced))
+
+    def test_calls_that_change_state_are_not_replayed_by_default(self):
+        """Test calls to mutating tools are skipped unless --include-mutating is given"""
+        self.handler.handle_tools_call(1, {'name': 'create_task', 'arguments': {
+            'title': 'Recorded', 'description': 'From a real session', 'priority': 'low'}})
+        self.handler.handle_tools_call(2, {'name': 'list_tasks', 'arguments': {}})
+        self.assertTrue(http_mcp_server.CALL_RECORDER.flush())
+        records = replay_trace.load_trace(self.trace_file)
+        self.assertEqual([record['mutates'] for record in records], [True, False])
+        # Traces recorded without the flag fall back to the known tool names
+        self.assertTrue(replay_trace.is_mutating({'tool': 'create_issue'}))
+        self.assertEqual(replay_trace.MUTATING_TOOLS,
+                         {name for name, spec in http_mcp_server.TOOL_REGISTRY.items() if spec.mutates})
+
+        http_mcp_server.RECORDER_CONFIG['file'] = None
+        url = self.start_server(BoundedThreadPoolHTTPServer(('127.0.0.1', 0), MCPServerHandler, workers=2))
+        output = io.StringIO()
+        with patch('sys.stdout', output), patch('sys.stderr', io.StringIO()):
+            self.assertEqual(replay_trace.main([self.trace_file, '--url', url, '--max', '--json']), 0)
+        self.assertEqual(list(json.loads(output.getvalue())['tools']), ['list_tasks'])
+        self.assertEqual(len(http_mcp_server.load_tasks()['tasks']), 1)
+
+        with patch('sys.stdout', io.StringIO()):
+            replay_trace.main([self.trace_file, '--url', url, '--max', '--include-mutating'])
+        self.assertEqual(len(http_mcp_server.load_tasks()['tasks']), 2)
+
+    def test_percentile(self):
+        """Test nearest-rank percentiles"""
+        values = list(range(1, 101))
+        self.assertEqual(replay_trace.percentile(values, 50), 50)
+        self.assertEqual(replay_trace.percentile(values, 99), 99)
+        self.assertEqual(replay_trace.percentile([7], 95), 7)
+        self.assertIsNone(replay_trace.percentile([], 50))
+
+
+def run_tests():
+    """Run all tests with detailed output"""
+    loader = unittest.TestLoader()
+    suite = unittest.TestSuite()
+
+    suite.addTests(loader.loadTestsFromTestCase(TestJSONRPCProtocol))
+    suite.addTests(loader.loadTestsFromTestCase(TestBatchRequests))
+    suite.addTests(loader.loadTestsFromTestCase(TestKeepAlive))
+    suite.addTests(loader.loadTestsFromTestCase(TestProgressStreaming))
+    suite.addTests(loader.loadTestsFromTestCase(TestServerModes))
+    suite.addTests(loader.loadTestsFromTestCase(TestPreforkServer))
+    suite.addTests(loader.loadTestsFromTestCase(TestJSONStores))
+    suite.addTests(loader.loadTestsFromTestCase(TestBackgroundJobs))
+    suite.addTests(loader.loadTestsFromTestCase(TestCancellation))
+    suite.addTests(loader.loadTestsFromTestCase(TestToolRegistry))
+    suite.addTests(loader.loadTestsFromTestCase(TestToolCatalogue))
+    suite.addTests(loader.loadTestsFromTestCase(TestToolProfiles))
+    suite.addTests(loader.loadTestsFromTestCase(TestResultEncoding))
+    suite.addTests(loader.loadTestsFromTestCase(TestEmbeddingEncoding))
+    suite.addTests(loader.loadTestsFromTestCase(TestBatchedEmbeddings))
+    suite.addTests(loader.loadTestsFromTestCase(TestOllamaConnectionPool))
+    suite.addTests(loader.loadTestsFromTestCase(TestEmbeddingCache))
+    suite.addTests(loader.loadTestsFromTestCase(TestEmbeddingProviders))
+    suite.addTests(loader.loadTestsFromTestCase(TestEmbeddingScheduler))
+    suite.addTests(loader.loadTestsFromTestCase(TestCompression))
+    suite.addTests(loader.loadTestsFromTestCase(TestUploads))
+    suite.addTests(loader.loadTestsFromTestCase(TestLogging))
+    suite.addTests(loader.loadTestsFromTestCase(TestMetrics))
+    suite.addTests(loader.loadTestsFromTestCase(TestTracing))
+    suite.addTests(loader.loadTestsFromTestCase(TestCallProfiling))
+    suite.addTests(loader.loadTestsFromTestCase(TestMemoryDiagnostics))
+    suite.addTests(loader.loadTestsFromTestCase(TestCallRecorder))
+
+    runner = unittest.TextTestRunner(verbosity=2)
+    result = runner.run(suite)
+
+    print('\n' + '=' * 70)
+    print('TEST SUMMARY')
+    print('=' * 70)
+    print(f'Tests run: {result.testsRun}')
+    print(f'Successes: {result.testsRun - len(result.failures) - len(result.errors)}')
+    print(f'Failures: {len(result.failures)}')
+    print(f'Errors: {len(result.errors)}')
+    print('=' * 70)
+
+    return result.wasSuccessful()
+
+
+if __name__ == '__main__':
+    success = run_tests()
+    exit(0 if success else 1)